@@ -0,0 +1,150 @@
+"""Import time and resident memory of the pipeline modules, cold.
+
+    python benchmarks/bench_cold_start.py --output run.json
+    python benchmarks/bench_cold_start.py --root ../old-checkout --output before.json
+    python benchmarks/bench_cold_start.py --baseline before.json
+
+Each pipeline is loaded in a fresh interpreter, the way the pipelines server
+loads every module in its directory at start: import the module, then build
+`Pipeline()`. The resident set size is read after each step, along with
+which heavy libraries the module pulled in. Pipelines that build their
+machinery lazily (`get_graph`) are also timed on that first use, which is
+the cost moved from server start to the first chat. Timings are the median
+of `--repeat` fresh interpreters.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+PIPELINES = ("toolbox_v23", "rag_v4", "rag_wiki_llmv2", "wiki_ragv2", "wiki_ragv3")
+HEAVY = ("langchain_core", "langchain_openai", "langgraph", "openai", "numpy", "aiohttp", "requests", "tiktoken")
+
+# Runs in the child interpreter; prints one JSON line of measurements.
+PROBE = r"""
+import importlib, json, os, sys, time
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+root, name, heavy = sys.argv[1], sys.argv[2], sys.argv[3].split(",")
+sys.path.insert(0, root)
+os.chdir(root)
+result = {"baseline_rss_mb": rss_mb()}
+start = time.perf_counter()
+module = importlib.import_module(name)
+result["import_s"] = time.perf_counter() - start
+result["import_rss_mb"] = rss_mb()
+result["import_loaded"] = [lib for lib in heavy if lib in sys.modules]
+start = time.perf_counter()
+pipeline = module.Pipeline()
+result["init_s"] = time.perf_counter() - start
+result["init_rss_mb"] = rss_mb()
+result["init_loaded"] = [lib for lib in heavy if lib in sys.modules]
+if hasattr(pipeline, "get_graph"):
+    start = time.perf_counter()
+    pipeline.get_graph()
+    result["first_use_s"] = time.perf_counter() - start
+    result["first_use_rss_mb"] = rss_mb()
+print(json.dumps(result))
+"""
+
+
+def probe(root: str, name: str) -> dict:
+    completed = subprocess.run(
+        [sys.executable, "-c", PROBE, root, name, ",".join(HEAVY)],
+        capture_output=True,
+        text=True,
+    )
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode or not lines:
+        error = (completed.stderr.strip().splitlines() or ["no output"])[-1]
+        return {"error": error}
+    return json.loads(lines[-1])
+
+
+def measure(root: str, name: str, repeat: int) -> dict:
+    samples: List[dict] = []
+    for _ in range(repeat):
+        sample = probe(root, name)
+        if "error" in sample:
+            return {"pipeline": name, "error": sample["error"]}
+        samples.append(sample)
+    run = {"pipeline": name, "loaded": samples[-1]["init_loaded"]}
+    for field in samples[0]:
+        if field.endswith(("_s", "_mb")):
+            run[field] = statistics.median(sample[field] for sample in samples)
+    return run
+
+
+def print_report(report: dict, baseline: Optional[dict]):
+    previous = {run["pipeline"]: run for run in (baseline or {}).get("runs", [])}
+
+    def cell(run, old, field, scale, digits):
+        if field not in run:
+            return "-"
+        text = f"{run[field] * scale:.{digits}f}"
+        if old and old.get(field):
+            text += f" ({(run[field] - old[field]) / old[field] * 100:+.0f}%)"
+        return text
+
+    print(f"{'pipeline':<16} {'import ms':>14} {'init ms':>14} {'rss MB':>13} {'first use ms':>13}  loaded at start")
+    for run in report["runs"]:
+        if "error" in run:
+            print(f"{run['pipeline']:<16} failed: {run['error']}")
+            continue
+        old = previous.get(run["pipeline"])
+        if old and "error" in old:
+            old = None
+        print(
+            f"{run['pipeline']:<16} {cell(run, old, 'import_s', 1000, 0):>14} {cell(run, old, 'init_s', 1000, 0):>14} "
+            f"{cell(run, old, 'init_rss_mb', 1, 1):>13} {cell(run, old, 'first_use_s', 1000, 0):>13}  "
+            f"{', '.join(run['loaded']) or '-'}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pipelines", nargs="+", default=list(PIPELINES))
+    parser.add_argument("--root", default=ROOT, help="directory to import the pipelines from, e.g. an older checkout")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per pipeline")
+    parser.add_argument("--output", help="result JSON; defaults to benchmarks/results/cold-start-<time>.json")
+    parser.add_argument("--baseline", help="earlier result JSON to compare against")
+    args = parser.parse_args()
+
+    root = os.path.abspath(args.root)
+    report = {
+        "config": {"root": root, "repeat": args.repeat, "python": sys.version.split()[0]},
+        "runs": [measure(root, name, args.repeat) for name in args.pipelines],
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    output = args.output or os.path.join(RESULTS, f"cold-start-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved {output}")
+
+
+if __name__ == "__main__":
+    main()
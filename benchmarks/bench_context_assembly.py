@@ -0,0 +1,55 @@
+"""Compare the old rag_v4 chapter concatenation with `assemble_context`.
+
+    python benchmarks/bench_context_assembly.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline_core.context import assemble_context
+
+SIZES = (10, 100, 1000)
+CHUNK_WORDS = 120
+
+
+def legacy_merge(results):
+    # rag_v4.query_vector_database before the context assembly stage.
+    first_title = results[0].get('metadata', {}).get('title', "")
+    concatenated_document = ""
+    metadata = {}
+    for result in results:
+        if result.get('metadata', {}).get('title', "") == first_title:
+            chapter_number = f"Chapter_{len(concatenated_document.split(' ')) + 1}" if concatenated_document else " Chapter_1: "
+            concatenated_document += f" {chapter_number}: {result.get('document', '')} | "
+            metadata = result.get('metadata', {})
+    concatenated_document = concatenated_document.rstrip('CHAPTER_SEP')
+    return {"document": concatenated_document, "metadata": metadata}
+
+
+def make_results(n):
+    words = " ".join(f"word{i}" for i in range(CHUNK_WORDS))
+    return [
+        {"document": f"{words} {i}", "metadata": {"title": "Article", "url": "https://example.org", "chunk": i}}
+        for i in range(n)
+    ]
+
+
+def best_of(func, results, repeat=5):
+    number = max(1, 2000 // len(results))
+    return min(timeit.repeat(lambda: func(results), number=number, repeat=repeat)) / number
+
+
+def main():
+    print(f"{'chunks':>7} {'legacy ms':>11} {'assemble ms':>12} {'speedup':>8}")
+    for n in SIZES:
+        results = make_results(n)
+        legacy = best_of(legacy_merge, results) * 1000
+        assembled = best_of(assemble_context, results) * 1000
+        print(f"{n:>7} {legacy:>11.3f} {assembled:>12.3f} {legacy / assembled:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""Latency, throughput and retrieval recall of the pipelines against local stand-ins.
+
+    python benchmarks/bench_pipelines.py --concurrency 1 4 16 --output run.json
+    python benchmarks/bench_pipelines.py --baseline run.json --valve RERANK_ENABLED=true
+
+Starts the stand-in search and OpenAI-compatible servers from
+`pipeline_core.standins`, points each pipeline's valves at them and replays
+`queries.jsonl` through `Pipeline.pipe` from a thread pool, the way the
+pipelines server calls it. Latency runs to the last streamed chunk;
+time-to-first-token is the first non-empty chunk, or the whole call when
+the pipeline returns a plain string.
+
+Recall@k is measured on what reaches the model: the share of a query's
+relevant documents whose text appears in the completion prompts the
+stand-in received or in the pipeline's reply. That pass runs first, one
+query at a time, and doubles as the warm-up.
+
+The rewrite and retrieval caches are off, so every request takes the cold
+path and runs stay comparable across commits; after the warm-up pass a
+cached run would time only cache hits. `--warm-caches` leaves them on to
+measure the cache-hit path instead.
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pipeline_core.chunk_store import ChunkStore
+from pipeline_core.embeddings import HASHING, HashingEmbedder
+from pipeline_core.local_index import LocalVectorIndex
+from pipeline_core.standins import SAMPLE_CORPUS, StandInOpenAIServer, StandInSearchServer
+
+PIPELINES = ("rag_v4", "rag_wiki_llmv2", "wiki_ragv2", "wiki_ragv3")
+# Valves of the caches that would answer every request after the warm-up pass.
+CACHE_VALVES = {"RETRIEVAL_CACHE_ENABLED": False, "REWRITE_CACHE_ENABLED": False}
+QUERIES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "queries.jsonl")
+RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+MODEL_ID = "standin"
+
+_WORD = re.compile(r"\w+")
+
+
+def words(text: str) -> str:
+    return " " + " ".join(_WORD.findall(text.lower())) + " "
+
+
+def load_queries(path: str) -> List[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_corpus(path: Optional[str]) -> List[dict]:
+    if not path:
+        return SAMPLE_CORPUS
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def parse_valve(text: str) -> Tuple[str, object]:
+    key, _, value = text.partition("=")
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def percentiles(samples: List[float]) -> dict:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def at(q):
+        pos = q * (len(ordered) - 1)
+        low = int(pos)
+        high = min(low + 1, len(ordered) - 1)
+        return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+    return {
+        "p50": at(0.50) * 1000,
+        "p95": at(0.95) * 1000,
+        "p99": at(0.99) * 1000,
+        "mean": sum(ordered) / len(ordered) * 1000,
+    }
+
+
+def corpus_records(corpus: List[dict]) -> List[dict]:
+    """The corpus with ids in the metadata, as the stand-in search server returns it."""
+    return [{"document": doc["document"], "metadata": {**doc.get("metadata", {}), "id": doc.get("id")}} for doc in corpus]
+
+
+def build_local_index(corpus: List[dict], path: str) -> str:
+    records = corpus_records(corpus)
+    embeddings = HashingEmbedder().embed([record["document"] for record in records])
+    LocalVectorIndex.build(path, records, embeddings, HASHING)
+    return path
+
+
+def build_chunk_store(corpus: List[dict], path: str) -> str:
+    ChunkStore.build(path, corpus_records(corpus))
+    return path
+
+
+def configure(pipeline, valves: dict) -> List[str]:
+    """Apply the valves the pipeline has; returns the names it lacks."""
+    missing = []
+    for key, value in valves.items():
+        if hasattr(pipeline.valves, key):
+            setattr(pipeline.valves, key, value)
+        else:
+            missing.append(key)
+    return missing
+
+
+def run_query(pipeline, query: str) -> Tuple[float, float, str]:
+    """(latency, time to first token, reply text) of one `pipe` call."""
+    messages = [{"role": "user", "content": query}]
+    body = {"model": MODEL_ID, "messages": messages, "stream": True}
+    start = time.perf_counter()
+    result = pipeline.pipe(query, MODEL_ID, messages, body)
+    first = None
+    if isinstance(result, str):
+        parts = [result]
+    elif isinstance(result, dict):
+        parts = [json.dumps(result)]
+    else:
+        parts = []
+        for chunk in result:
+            if first is None and chunk:
+                first = time.perf_counter()
+            parts.append(chunk if isinstance(chunk, str) else json.dumps(chunk))
+    end = time.perf_counter()
+    return end - start, (first or end) - start, "".join(parts)
+
+
+def attempt(pipeline, query: str) -> Optional[Tuple[float, float]]:
+    try:
+        latency, ttft, text = run_query(pipeline, query)
+    except Exception as e:
+        print(f"  {query!r} failed: {e}")
+        return None
+    if text.startswith("Error"):
+        return None
+    return latency, ttft
+
+
+def measure_recall(pipeline, queries: List[dict], corpus: List[dict], llm: StandInOpenAIServer) -> float:
+    documents = {doc["id"]: words(doc["document"]) for doc in corpus}
+    scores = []
+    for item in queries:
+        llm.chat_requests.clear()
+        _, _, text = run_query(pipeline, item["query"])
+        prompts = [
+            message.get("content", "")
+            for request in list(llm.chat_requests)
+            for message in request.get("messages", [])
+            if isinstance(message.get("content"), str)
+        ]
+        evidence = words(" ".join([text] + prompts))
+        relevant = item["relevant"]
+        scores.append(sum(documents[doc_id] in evidence for doc_id in relevant) / len(relevant))
+    return sum(scores) / len(scores) if scores else 0.0
+
+
+def run_level(pipeline, name: str, queries: List[dict], concurrency: int, repeat: int) -> dict:
+    work = [item["query"] for _ in range(repeat) for item in queries]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        outcomes = list(pool.map(lambda query: attempt(pipeline, query), work))
+        wall = time.perf_counter() - start
+    done = [outcome for outcome in outcomes if outcome is not None]
+    return {
+        "pipeline": name,
+        "concurrency": concurrency,
+        "requests": len(work),
+        "errors": len(work) - len(done),
+        "throughput_rps": len(done) / wall if wall else 0.0,
+        "latency_ms": percentiles([latency for latency, _ in done]),
+        "ttft_ms": percentiles([ttft for _, ttft in done]),
+    }
+
+
+def bench_pipeline(name: str, valves: dict, args, queries, corpus, llm) -> Tuple[List[dict], Optional[dict]]:
+    try:
+        pipeline = importlib.import_module(name).Pipeline()
+    except ImportError as e:
+        print(f"{name}: skipped, {e}; run from the pipelines server's directory")
+        return [], None
+    missing = configure(pipeline, valves)
+    if args.backend == "remote" and "VECTOR_DB_URL" in missing:
+        print(f"{name}: skipped, it has no VECTOR_DB_URL valve; try --backend local")
+        return [], None
+    asyncio.run(pipeline.on_startup())
+    try:
+        recall = {"k": args.top_k, "recall_at_k": measure_recall(pipeline, queries, corpus, llm)}
+        runs = [run_level(pipeline, name, queries, concurrency, args.repeat) for concurrency in args.concurrency]
+    finally:
+        asyncio.run(pipeline.on_shutdown())
+    return runs, recall
+
+
+def print_report(report: dict, baseline: Optional[dict]):
+    previous = {}
+    if baseline:
+        previous = {(run["pipeline"], run["concurrency"]): run for run in baseline["runs"]}
+        if baseline["config"].get("warm_caches", True) != report["config"]["warm_caches"]:
+            print("Baseline ran with the caches " + ("on" if baseline["config"].get("warm_caches", True) else "off")
+                  + "; latencies are not comparable.")
+
+    def change(new, old):
+        return f" ({(new - old) / old * 100:+.0f}%)" if old else ""
+
+    print(f"{'pipeline':<16} {'conc':>4} {'p50 ms':>14} {'p95 ms':>14} {'p99 ms':>9} {'ttft p50':>9} {'rps':>12} {'errors':>6}")
+    for run in report["runs"]:
+        old = previous.get((run["pipeline"], run["concurrency"]))
+        latency, ttft = run["latency_ms"], run["ttft_ms"]
+        if not latency:
+            print(f"{run['pipeline']:<16} {run['concurrency']:>4} {'all failed':>14} {run['errors']:>60}")
+            continue
+        p50 = f"{latency['p50']:.1f}" + (change(latency["p50"], old["latency_ms"].get("p50", 0)) if old else "")
+        p95 = f"{latency['p95']:.1f}" + (change(latency["p95"], old["latency_ms"].get("p95", 0)) if old else "")
+        rps = f"{run['throughput_rps']:.1f}" + (change(run["throughput_rps"], old["throughput_rps"]) if old else "")
+        print(
+            f"{run['pipeline']:<16} {run['concurrency']:>4} {p50:>14} {p95:>14} {latency['p99']:>9.1f} "
+            f"{ttft['p50']:>9.1f} {rps:>12} {run['errors']:>6}"
+        )
+    for name, recall in report["recall"].items():
+        old = (baseline or {}).get("recall", {}).get(name)
+        was = f" (was {old['recall_at_k']:.3f})" if old else ""
+        print(f"{name:<16} recall@{recall['k']}: {recall['recall_at_k']:.3f}{was}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pipelines", nargs="+", default=list(PIPELINES))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the query set per concurrency level")
+    parser.add_argument("--queries", default=QUERIES, help="JSON lines of {query, relevant: [corpus ids]}")
+    parser.add_argument("--corpus", help="JSON list of {id, document, metadata}; defaults to the stand-in sample")
+    parser.add_argument("--backend", choices=("remote", "local"), default="remote",
+                        help="stand-in search server, or an in-process hashing index of the corpus")
+    parser.add_argument("--chunk-store", action="store_true",
+                        help="search for ids and scores only and read the text from a chunk store of the corpus")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--search-latency", type=float, default=0.02)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds before the first completion byte")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="seconds between streamed words")
+    parser.add_argument("--warm-caches", action="store_true",
+                        help="keep the rewrite and retrieval caches on; latencies then time cache hits")
+    parser.add_argument("--valve", action="append", default=[], metavar="NAME=VALUE",
+                        help="override a valve on every pipeline that has it; VALUE is parsed as JSON when it can be")
+    parser.add_argument("--output", help="result JSON; defaults to benchmarks/results/pipelines-<time>.json")
+    parser.add_argument("--baseline", help="earlier result JSON to compare against")
+    args = parser.parse_args()
+
+    queries = load_queries(args.queries)
+    corpus = load_corpus(args.corpus)
+    overrides = dict(parse_valve(valve) for valve in args.valve)
+    workdir = tempfile.mkdtemp(prefix="bench-pipelines-")
+
+    search = StandInSearchServer(corpus, top_k=args.top_k, latency=args.search_latency).start()
+    llm = StandInOpenAIServer(models=[MODEL_ID], latency=args.llm_latency, token_latency=args.token_latency).start()
+    valves = {
+        "OPENAI_API_BASE_URL": llm.api_url,
+        "OPENAI_API_KEY": "standin",
+        "MODEL_ID": MODEL_ID,
+        "VECTOR_DB_URL": search.url,
+        "VECTOR_DB_BATCH_URL": search.batch_url,
+        "MODEL_LIST_CACHE_PATH": os.path.join(workdir, "models.json"),
+        "LOCAL_INDEX_TOP_K": args.top_k,
+    }
+    if args.backend == "local":
+        valves.update(VECTOR_BACKEND="local", LOCAL_INDEX_PATH=build_local_index(corpus, os.path.join(workdir, "index")))
+    if args.chunk_store:
+        valves.update(CHUNK_STORE_PATH=build_chunk_store(corpus, os.path.join(workdir, "chunks")))
+    if not args.warm_caches:
+        valves.update(CACHE_VALVES)
+    valves.update(overrides)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": {**{key: value for key, value in vars(args).items() if key not in ("valve", "output", "baseline")}, "valves": overrides},
+        "runs": [],
+        "recall": {},
+    }
+    try:
+        for name in args.pipelines:
+            print(f"{name}: running")
+            runs, recall = bench_pipeline(name, valves, args, queries, corpus, llm)
+            report["runs"].extend(runs)
+            if recall is not None:
+                report["recall"][name] = recall
+    finally:
+        search.stop()
+        llm.stop()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    output = args.output or os.path.join(RESULTS, f"pipelines-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+"""Shared building blocks for the pipelines in this directory.
+
+The pipeline modules live next to this package and import it directly, so the
+pipelines server can load them as single files while the transport, caching
+and retrieval code is written once.
+"""
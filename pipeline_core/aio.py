@@ -0,0 +1,100 @@
+"""Asyncio plumbing: a pooled aiohttp client and response helpers."""
+
+import asyncio
+from typing import AsyncIterator, Dict, Optional
+
+import aiohttp
+
+from pipeline_core.http_pool import PoolConfig, PoolStats
+from pipeline_core.metrics import current_span
+
+
+class AsyncHTTPPool:
+    """aiohttp counterpart of `HTTPPool`, configured from the same valves.
+
+    aiohttp sessions are bound to the loop that created them, so one session
+    is kept per running loop. Connection reuse is counted through aiohttp
+    tracing into the same `PoolStats` shape as the sync pool, and request and
+    response bytes are attributed to the current metrics span.
+    """
+
+    def __init__(self, config: Optional[PoolConfig] = None):
+        self.config = config or PoolConfig()
+        self.stats = PoolStats()
+        self._sessions: Dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+
+    def _build_session(self) -> aiohttp.ClientSession:
+        trace = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            self.stats.record_request()
+
+        async def on_connection_create_end(session, ctx, params):
+            self.stats.record_new_connection()
+
+        async def on_request_chunk_sent(session, ctx, params):
+            span = current_span()
+            if span is not None:
+                span.add(bytes_out=len(params.chunk))
+
+        async def on_response_chunk_received(session, ctx, params):
+            span = current_span()
+            if span is not None:
+                span.add(bytes_in=len(params.chunk))
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_connection_create_end.append(on_connection_create_end)
+        trace.on_request_chunk_sent.append(on_request_chunk_sent)
+        trace.on_response_chunk_received.append(on_response_chunk_received)
+
+        connector_kwargs = {
+            "limit": self.config.pool_connections * self.config.pool_maxsize,
+            "limit_per_host": self.config.pool_maxsize,
+        }
+        if self.config.keep_alive:
+            connector_kwargs["keepalive_timeout"] = 30.0
+        else:
+            connector_kwargs["force_close"] = True
+
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(**connector_kwargs),
+            timeout=aiohttp.ClientTimeout(
+                total=None,
+                sock_connect=self.config.connect_timeout,
+                sock_read=self.config.read_timeout,
+            ),
+            trace_configs=[trace],
+        )
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            session = self._sessions[loop] = self._build_session()
+        return session
+
+    async def close(self):
+        current = asyncio.get_running_loop()
+        sessions, self._sessions = self._sessions, {}
+        for loop, session in sessions.items():
+            if session.closed:
+                continue
+            if loop is current:
+                await session.close()
+            elif loop.is_running():
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(session.close(), loop))
+
+    async def reconfigure(self, config: PoolConfig):
+        if config != self.config:
+            await self.close()
+            self.config = config
+
+
+async def aiter_lines(response: aiohttp.ClientResponse) -> AsyncIterator[bytes]:
+    """Yield response lines without line endings, like `requests.iter_lines`."""
+    try:
+        async for line in response.content:
+            yield line.rstrip(b"\r\n")
+    finally:
+        response.release()
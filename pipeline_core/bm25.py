@@ -0,0 +1,187 @@
+"""BM25 inverted index over the records of a local index directory.
+
+Postings are stored term-major in three flat arrays next to `records.jsonl`:
+
+    bm25.json            k1, b, document count, average length
+    bm25_terms.json      {term: term id}
+    bm25_offsets.npy     int64 (terms + 1) start of each term's postings
+    bm25_docs.npy        uint32 document row of each posting
+    bm25_impacts.npy     float32 precomputed idf * saturated tf per posting
+
+so scoring a query is one `bincount` over the postings of its terms. Build
+with `python -m pipeline_core.bm25 build INDEX_DIR [--corpus FILE]`.
+"""
+
+import argparse
+import functools
+import json
+import os
+import re
+from collections import Counter
+from typing import List, Sequence
+
+import numpy as np
+
+from pipeline_core.local_index import RECORDS, load_records, open_chunks, read_corpus, top_k, write_records
+
+BM25_MANIFEST = "bm25.json"
+BM25_TERMS = "bm25_terms.json"
+BM25_OFFSETS = "bm25_offsets.npy"
+BM25_DOCS = "bm25_docs.npy"
+BM25_IMPACTS = "bm25_impacts.npy"
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the to was were what when where "
+    "which who whom why how with did does do this these those".split()
+)
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    return [word for word in _WORD.findall(text.lower()) if word not in STOPWORDS]
+
+
+class BM25Index:
+    """Okapi BM25 search with impacts precomputed at build time."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, BM25_MANIFEST), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        with open(os.path.join(path, BM25_TERMS), "r", encoding="utf-8") as f:
+            self.terms = json.load(f)
+        self.offsets = np.load(os.path.join(path, BM25_OFFSETS))
+        self.docs = np.load(os.path.join(path, BM25_DOCS), mmap_mode="r")
+        self.impacts = np.load(os.path.join(path, BM25_IMPACTS), mmap_mode="r")
+        self.chunks = open_chunks(path)
+        # Best impact of each term, the ceiling used by `confidence`.
+        starts = self.offsets[:-1]
+        self.max_impacts = np.maximum.reduceat(np.asarray(self.impacts), starts) if len(starts) else np.zeros(0)
+
+    def __len__(self) -> int:
+        return self.manifest["docs"]
+
+    @classmethod
+    def build(cls, path: str, records: Sequence[dict], k1: float = 1.2, b: float = 0.75) -> "BM25Index":
+        """Index `records`, which must be the rows of `path`'s records.jsonl
+        when it has one; otherwise they are written there."""
+        os.makedirs(path, exist_ok=True)
+        if not os.path.exists(os.path.join(path, RECORDS)):
+            write_records(path, records)
+        documents = [record.get("document", "") for record in records]
+        terms: dict = {}
+        posting_terms, posting_docs, posting_tfs = [], [], []
+        lengths = np.zeros(len(documents), dtype=np.float32)
+        for doc, text in enumerate(documents):
+            counts = Counter(tokenize(text))
+            lengths[doc] = sum(counts.values())
+            for term, tf in counts.items():
+                posting_terms.append(terms.setdefault(term, len(terms)))
+                posting_docs.append(doc)
+                posting_tfs.append(tf)
+
+        posting_terms = np.asarray(posting_terms, dtype=np.int64)
+        order = np.argsort(posting_terms, kind="stable")
+        term_ids = posting_terms[order]
+        docs = np.asarray(posting_docs, dtype=np.uint32)[order]
+        tfs = np.asarray(posting_tfs, dtype=np.float32)[order]
+
+        df = np.bincount(term_ids, minlength=len(terms)).astype(np.float32)
+        idf = np.log1p((len(documents) - df + 0.5) / (df + 0.5))
+        avgdl = float(lengths.mean()) if len(documents) else 0.0
+        norm = k1 * (1 - b + b * lengths[docs] / (avgdl or 1.0))
+        impacts = (idf[term_ids] * tfs * (k1 + 1) / (tfs + norm)).astype(np.float32)
+
+        np.save(os.path.join(path, BM25_OFFSETS), np.concatenate([[0], np.cumsum(df.astype(np.int64))]))
+        np.save(os.path.join(path, BM25_DOCS), docs)
+        np.save(os.path.join(path, BM25_IMPACTS), impacts)
+        with open(os.path.join(path, BM25_TERMS), "w", encoding="utf-8") as f:
+            json.dump(terms, f, separators=(",", ":"))
+        with open(os.path.join(path, BM25_MANIFEST), "w", encoding="utf-8") as f:
+            json.dump({"k1": k1, "b": b, "docs": len(documents), "avgdl": avgdl, "terms": len(terms)}, f, indent=2)
+        return cls(path)
+
+    def _term_ids(self, query: str) -> List[int]:
+        return [self.terms[term] for term in dict.fromkeys(tokenize(query)) if term in self.terms]
+
+    def scores(self, query: str) -> np.ndarray:
+        ids = self._term_ids(query)
+        if not ids:
+            return np.zeros(len(self), dtype=np.float32)
+        slices = [slice(self.offsets[t], self.offsets[t + 1]) for t in ids]
+        docs = np.concatenate([self.docs[s] for s in slices])
+        impacts = np.concatenate([self.impacts[s] for s in slices])
+        return np.bincount(docs, weights=impacts, minlength=len(self)).astype(np.float32)
+
+    def search(self, query: str, k: int = 5) -> List[dict]:
+        scores = self.scores(query)
+        hits = []
+        for row in top_k(scores[None, :], k)[0]:
+            if scores[row] <= 0:
+                break
+            hits.append(self.chunks.hit(row, {"bm25_score": float(scores[row])}))
+        return hits
+
+    def confidence(self, query: str) -> float:
+        """How decisively the best document matches, in [0, 1].
+
+        The top score over the best score any document could get for the
+        query's known terms, scaled by the share of query terms the corpus
+        knows at all. Near 1 means one document holds the strongest match
+        for every term.
+        """
+        words = list(dict.fromkeys(tokenize(query)))
+        ids = self._term_ids(query)
+        if not ids:
+            return 0.0
+        ceiling = float(self.max_impacts[ids].sum())
+        best = float(self.scores(query).max())
+        return (best / ceiling) * (len(ids) / len(words)) if ceiling else 0.0
+
+
+@functools.lru_cache(maxsize=8)
+def _open(path: str, mtime: float) -> BM25Index:
+    return BM25Index(path)
+
+
+def open_bm25(path: str) -> BM25Index:
+    """Shared, read-only BM25 index for `path`; reopened when it is rebuilt."""
+    return _open(path, os.path.getmtime(os.path.join(path, BM25_MANIFEST)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="index the records of an index directory")
+    build.add_argument("index", help="index directory; gets records.jsonl from --corpus if it has none")
+    build.add_argument("--corpus", help="JSON list or JSON lines of {document, metadata} records")
+    build.add_argument("--k1", type=float, default=1.2)
+    build.add_argument("--b", type=float, default=0.75)
+
+    query = commands.add_parser("query", help="search an index directory")
+    query.add_argument("index")
+    query.add_argument("text")
+    query.add_argument("--top-k", type=int, default=5)
+
+    args = parser.parse_args()
+    if args.command == "build":
+        has_records = os.path.exists(os.path.join(args.index, RECORDS))
+        if args.corpus and has_records:
+            parser.error(f"{args.index} already has {RECORDS}; BM25 must index the same rows")
+        if not args.corpus and not has_records:
+            parser.error(f"{args.index} has no {RECORDS}; pass --corpus")
+        if args.corpus:
+            records = read_corpus(args.corpus)
+        else:
+            records = [json.loads(line) for line in load_records(args.index)]
+        index = BM25Index.build(args.index, records, args.k1, args.b)
+        print(f"Built {args.index}: {json.dumps(index.manifest)}")
+    else:
+        index = open_bm25(args.index)
+        print(json.dumps({"confidence": index.confidence(args.text), "results": index.search(args.text, args.top_k)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Bounded in-process caches shared by the pipelines."""
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+def approx_size(obj: Any) -> int:
+    """Rough retained size of plain JSON-like data, used for byte budgets."""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approx_size(k) + approx_size(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(approx_size(item) for item in obj)
+    return size
+
+
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def record(self, field: str, count: int = 1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + count)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hit_rate,
+            }
+
+
+class LRUCache:
+    """Thread-safe LRU map with optional TTL and byte budget.
+
+    Entries are evicted least-recently-used first once either `max_entries`
+    or `max_bytes` (as measured by `sizeof`) is exceeded. Expired entries are
+    dropped lazily when they are looked up or reach the LRU end. `on_evict` is
+    called with the key of every entry that leaves the cache other than by an
+    explicit `set` overwrite.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+        sizeof: Callable[[Any], int] = approx_size,
+        on_evict: Optional[Callable[[Hashable], None]] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self.stats = CacheStats()
+        self.bytes = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.peek(key) is not None
+
+    def _expired(self, expires_at: Optional[float], now: float) -> bool:
+        return expires_at is not None and expires_at <= now
+
+    def _drop(self, key: Hashable):
+        _, _, size = self._entries.pop(key)
+        self.bytes -= size
+        if self.on_evict is not None:
+            self.on_evict(key)
+
+    def peek(self, key: Hashable) -> Any:
+        """Return a live value without touching LRU order or stats."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry[1], time.monotonic()):
+                return None
+            return entry[0]
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[1], time.monotonic()):
+                self._drop(key)
+                self.stats.record("expirations")
+                entry = None
+            if entry is None:
+                self.stats.record("misses")
+                return default
+            self._entries.move_to_end(key)
+            self.stats.record("hits")
+            return entry[0]
+
+    def touch(self, key: Hashable):
+        """Mark `key` as recently used without counting a lookup."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        size = self.sizeof(key) + self.sizeof(value)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[2]
+            if self.max_bytes is not None and size > self.max_bytes:
+                if previous is not None and self.on_evict is not None:
+                    self.on_evict(key)
+                return
+            self._entries[key] = (value, expires_at, size)
+            self.bytes += size
+            self._evict()
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._entries and (
+            len(self._entries) > self.max_entries
+            or (self.max_bytes is not None and self.bytes > self.max_bytes)
+        ):
+            key, (_, expires_at, _) = next(iter(self._entries.items()))
+            self._drop(key)
+            self.stats.record("expirations" if self._expired(expires_at, now) else "evictions")
+
+    def pop(self, key: Hashable) -> Any:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            value = self._entries[key][0]
+            self._drop(key)
+            return value
+
+    def keys(self) -> list:
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._drop(key)
+
+    def snapshot(self) -> dict:
+        return {**self.stats.snapshot(), "entries": len(self._entries), "bytes": self.bytes}
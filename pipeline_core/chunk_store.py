@@ -0,0 +1,216 @@
+"""Memory-mapped chunk store: retrieved text resolved from chunk ids.
+
+A store is three files, in a local index directory or on their own:
+
+    chunks.bin           UTF-8 document text and compact metadata JSON of each chunk, back to back
+    chunk_offsets.npy    int64 (2 * rows + 1); row i's document is chunks.bin[o[2i]:o[2i+1]]
+                         and its metadata chunks.bin[o[2i+1]:o[2i+2]]
+    chunk_ids.txt        id of each row, one per line
+
+With a store, searches only need to return `{"id", "score"}` per hit. `view`
+slices the mapped file without copying; a chunk is decoded the first time it
+is returned and kept in a bounded hot-chunk cache after that. Build one with
+`python -m pipeline_core.chunk_store build CORPUS DIR`.
+"""
+
+import argparse
+import functools
+import json
+import mmap
+import os
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from pipeline_core.cache import LRUCache
+
+CHUNKS = "chunks.bin"
+CHUNK_OFFSETS = "chunk_offsets.npy"
+CHUNK_IDS = "chunk_ids.txt"
+
+# Fields a compact hit may carry its chunk id in.
+ID_FIELDS = ("id", "chunk_id", "doc_id")
+
+
+def chunk_id(record: dict, row: int) -> str:
+    """A record's id, from the record or its metadata; its row otherwise."""
+    metadata = record.get("metadata") or {}
+    for field in ID_FIELDS:
+        value = record.get(field, metadata.get(field))
+        if value is not None:
+            return str(value)
+    return str(row)
+
+
+def _layout(records: Iterable[dict], write: Callable[[bytes], object]) -> Tuple[np.ndarray, List[str]]:
+    offsets = [0]
+    ids = []
+    position = 0
+    for row, record in enumerate(records):
+        document = record.get("document", "").encode("utf-8")
+        metadata = json.dumps(record.get("metadata", {}), separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        for part in (document, metadata):
+            write(part)
+            position += len(part)
+            offsets.append(position)
+        ids.append(chunk_id(record, row).replace("\n", " "))
+    return np.asarray(offsets, dtype=np.int64), ids
+
+
+def has_chunk_store(path: str) -> bool:
+    return os.path.exists(os.path.join(path, CHUNK_OFFSETS))
+
+
+class ChunkStore:
+    """Chunk text and metadata by row or id, read from one buffer.
+
+    `buffer` is the mapped chunks.bin, or bytes for a store built in memory.
+    Hits returned by `hit` and `resolve` share their metadata dict with the
+    cache and must be treated as read-only.
+    """
+
+    def __init__(
+        self,
+        buffer,
+        offsets: np.ndarray,
+        ids: Sequence[str],
+        path: str = "",
+        cache_entries: int = 4096,
+        cache_bytes: int = 64 * 1024 * 1024,
+    ):
+        self.path = path
+        self._buffer = memoryview(buffer)
+        self.offsets = offsets
+        self.ids = ids
+        self._rows: Optional[Dict[str, int]] = None
+        self._lock = threading.Lock()
+        self.cache = LRUCache(max_entries=cache_entries, max_bytes=cache_bytes)
+        self.unknown_ids = 0
+
+    @classmethod
+    def open(cls, path: str, **cache_options) -> "ChunkStore":
+        with open(os.path.join(path, CHUNK_IDS), "r", encoding="utf-8") as f:
+            ids = f.read().splitlines()
+        offsets = np.load(os.path.join(path, CHUNK_OFFSETS), mmap_mode="r")
+        with open(os.path.join(path, CHUNKS), "rb") as f:
+            # An empty file cannot be mapped; a store of empty chunks has nothing to read.
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+        return cls(buffer, offsets, ids, path, **cache_options)
+
+    @classmethod
+    def build(cls, path: str, records: Iterable[dict], **cache_options) -> "ChunkStore":
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, CHUNKS), "wb") as f:
+            offsets, ids = _layout(records, f.write)
+        with open(os.path.join(path, CHUNK_IDS), "w", encoding="utf-8") as f:
+            f.writelines(f"{chunk}\n" for chunk in ids)
+        # Written last: its presence marks a complete store.
+        np.save(os.path.join(path, CHUNK_OFFSETS), offsets)
+        return cls.open(path, **cache_options)
+
+    @classmethod
+    def from_records(cls, records: Iterable[dict], **cache_options) -> "ChunkStore":
+        """A store held in memory, for indexes written without one."""
+        parts: List[bytes] = []
+        offsets, ids = _layout(records, parts.append)
+        return cls(b"".join(parts), offsets, ids, **cache_options)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def row_of(self, chunk: str) -> Optional[int]:
+        rows = self._rows
+        if rows is None:
+            with self._lock:
+                if self._rows is None:
+                    self._rows = {value: row for row, value in enumerate(self.ids)}
+                rows = self._rows
+        return rows.get(str(chunk))
+
+    def view(self, row: int) -> Tuple[memoryview, memoryview]:
+        """Document and metadata bytes of `row`, as slices of the buffer."""
+        start, middle, end = (int(offset) for offset in self.offsets[2 * row:2 * row + 3])
+        return self._buffer[start:middle], self._buffer[middle:end]
+
+    def chunk(self, row: int) -> dict:
+        chunk = self.cache.get(row)
+        if chunk is None:
+            document, metadata = self.view(row)
+            chunk = {"document": str(document, "utf-8"), "metadata": json.loads(str(metadata, "utf-8"))}
+            self.cache.set(row, chunk)
+        return chunk
+
+    def hit(self, row: int, fields: dict) -> dict:
+        """Row `row` as a search hit, with `fields` such as its score."""
+        chunk = self.chunk(row)
+        return {"document": chunk["document"], "metadata": chunk["metadata"], **fields}
+
+    def resolve(self, hits: Sequence[dict]) -> List[dict]:
+        """Fill in the text of compact `{"id", "score"}` hits.
+
+        Hits that already carry a document pass through; hits whose id is
+        not in the store are dropped and counted in `unknown_ids`.
+        """
+        resolved = []
+        for hit in hits:
+            if "document" in hit:
+                resolved.append(hit)
+                continue
+            chunk = next((hit[field] for field in ID_FIELDS if field in hit), None)
+            row = self.row_of(chunk) if chunk is not None else None
+            if row is None:
+                with self._lock:
+                    self.unknown_ids += 1
+                continue
+            resolved.append(self.hit(row, hit))
+        return resolved
+
+    def resize_cache(self, max_entries: int):
+        self.cache.max_entries = max_entries
+
+    def snapshot(self) -> dict:
+        return {
+            "chunks": len(self),
+            "cached": len(self.cache),
+            "cached_bytes": self.cache.bytes,
+            "unknown_ids": self.unknown_ids,
+            **self.cache.stats.snapshot(),
+        }
+
+
+@functools.lru_cache(maxsize=8)
+def _open(path: str, mtime: float) -> ChunkStore:
+    return ChunkStore.open(path)
+
+
+def open_chunk_store(path: str) -> ChunkStore:
+    """Shared, read-only store for `path`; reopened when it is rebuilt."""
+    return _open(path, os.path.getmtime(os.path.join(path, CHUNK_OFFSETS)))
+
+
+def main():
+    from pipeline_core.local_index import read_corpus
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="write a chunk store for a corpus")
+    build.add_argument("corpus", help="JSON list or JSON lines of {id, document, metadata} records")
+    build.add_argument("store", help="output directory")
+
+    get = commands.add_parser("get", help="print chunks of a store by id")
+    get.add_argument("store")
+    get.add_argument("ids", nargs="+")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        store = ChunkStore.build(args.store, read_corpus(args.corpus))
+        print(f"Built {args.store}: {len(store)} chunks, {os.path.getsize(os.path.join(args.store, CHUNKS))} bytes")
+    else:
+        store = open_chunk_store(args.store)
+        print(json.dumps({"results": store.resolve([{"id": chunk} for chunk in args.ids])}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
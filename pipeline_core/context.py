@@ -0,0 +1,155 @@
+"""Packing retrieved chunks into the prompt context under a token budget."""
+
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence
+
+from pipeline_core.tokenizer import ApproxTokenizer
+
+NO_INFORMATION = "No information found"
+CHAPTER_SEPARATOR = " | "
+CITED_FIELDS = ("title", "url")
+_CHUNK_ORDER_FIELDS = ("chunk_index", "chunk", "position")
+
+
+def _title(hit: dict) -> str:
+    return (hit.get('metadata') or {}).get('title', "")
+
+
+def _chunk_order(hits: List[dict]) -> Optional[str]:
+    """Metadata field giving document order, if every hit carries it."""
+    for name in _CHUNK_ORDER_FIELDS:
+        if all(isinstance((hit.get('metadata') or {}).get(name), int) for hit in hits):
+            return name
+    return None
+
+
+def retrieval_score(hit: dict, rank: int) -> float:
+    """Higher is better; falls back to the search rank when no score is given."""
+    for name in ("rerank_score", "rrf_score", "score"):
+        if isinstance(hit.get(name), (int, float)):
+            return float(hit[name])
+    if isinstance(hit.get("distance"), (int, float)):
+        return -float(hit["distance"])
+    return -float(rank)
+
+
+@dataclass
+class PackedContext:
+    document: str
+    metadata: dict
+    sources: List[dict] = field(default_factory=list)
+    packed_tokens: int = 0
+    dropped_tokens: int = 0
+    packed_chunks: int = 0
+    dropped_chunks: int = 0
+
+    def as_context(self) -> dict:
+        return {"document": self.document, "metadata": self.metadata}
+
+    def stats(self) -> dict:
+        return {
+            "packed_tokens": self.packed_tokens,
+            "dropped_tokens": self.dropped_tokens,
+            "packed_chunks": self.packed_chunks,
+            "dropped_chunks": self.dropped_chunks,
+        }
+
+
+class ContextPacker:
+    """Selects and formats retrieved chunks so the context fits `token_budget`.
+
+    Candidates are the hits sharing the top hit's title (`group_by_title`) or
+    the first `max_chunks` hits. They are admitted by descending retrieval
+    score; the first chunk that no longer fits is truncated when at least
+    `min_truncated_tokens` remain and every lower-scored chunk is dropped.
+    Kept chunks are then put back in document order when the metadata has a
+    chunk index, and only the `fields` we cite are kept from the metadata.
+    """
+
+    def __init__(
+        self,
+        token_budget: Optional[int] = None,
+        tokenizer=None,
+        fields: Sequence[str] = CITED_FIELDS,
+        group_by_title: bool = True,
+        max_chunks: Optional[int] = None,
+        min_truncated_tokens: int = 32,
+    ):
+        self.token_budget = token_budget
+        self.tokenizer = tokenizer or ApproxTokenizer()
+        self.fields = tuple(fields)
+        self.group_by_title = group_by_title
+        self.max_chunks = max_chunks
+        self.min_truncated_tokens = min_truncated_tokens
+
+    def _cited(self, hit: dict) -> dict:
+        metadata = hit.get('metadata') or {}
+        return {name: metadata[name] for name in self.fields if name in metadata}
+
+    def _label(self, number: int) -> str:
+        return f"Chapter_{number}: " if self.group_by_title else ""
+
+    def pack(self, results: List[dict]) -> PackedContext:
+        if not results:
+            return PackedContext(NO_INFORMATION, {})
+
+        candidates = list(results)
+        if self.group_by_title:
+            first_title = _title(candidates[0])
+            candidates = [hit for hit in candidates if _title(hit) == first_title]
+        if self.max_chunks is not None:
+            candidates = candidates[:self.max_chunks]
+
+        ranked = sorted(
+            enumerate(candidates), key=lambda item: retrieval_score(item[1], item[0]), reverse=True
+        )
+        count = self.tokenizer.count
+        separator_cost = count(CHAPTER_SEPARATOR) if self.group_by_title else 0
+        label_cost = count(self._label(1))
+
+        kept = []
+        used = dropped_tokens = dropped_chunks = 0
+        for _, hit in ranked:
+            text = hit.get('document', '')
+            cost = count(text)
+            overhead = label_cost + (separator_cost if kept else 0)
+            if self.token_budget is not None and used + overhead + cost > self.token_budget:
+                room = self.token_budget - used - overhead
+                if room >= self.min_truncated_tokens or (not kept and room > 0):
+                    text = self.tokenizer.truncate(text, room)
+                    dropped_tokens += cost - count(text)
+                    cost = count(text)
+                else:
+                    dropped_tokens += cost
+                    dropped_chunks += 1
+                    continue
+            kept.append((hit, text))
+            used += overhead + cost
+
+        top_hit = kept[0][0] if kept else None
+        order = _chunk_order([hit for hit, _ in kept])
+        if order is not None:
+            kept.sort(key=lambda item: item[0]['metadata'][order])
+
+        separator = CHAPTER_SEPARATOR if self.group_by_title else "\n\n"
+        document = separator.join(f"{self._label(number)}{text}" for number, (_, text) in enumerate(kept, start=1))
+        sources = []
+        for hit, _ in kept:
+            cited = self._cited(hit)
+            if cited not in sources:
+                sources.append(cited)
+
+        return PackedContext(
+            document=document or NO_INFORMATION,
+            metadata=self._cited(top_hit) if top_hit is not None else {},
+            sources=sources,
+            packed_tokens=used,
+            dropped_tokens=dropped_tokens,
+            packed_chunks=len(kept),
+            dropped_chunks=dropped_chunks,
+        )
+
+
+def assemble_context(results: List[dict], token_budget: Optional[int] = None, tokenizer=None) -> dict:
+    """Join every hit sharing the top hit's title into one numbered document."""
+    return ContextPacker(token_budget, tokenizer).pack(results).as_context()
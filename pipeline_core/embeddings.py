@@ -0,0 +1,140 @@
+"""Text embedders for the local index: an OpenAI-compatible client and an
+offline hashing fallback."""
+
+import asyncio
+import re
+import zlib
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from pipeline_core.aio import AsyncHTTPPool
+from pipeline_core.cache import LRUCache
+from pipeline_core.http_pool import HTTPPool
+
+HASHING = "hashing"
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize rows so a dot product is a cosine similarity."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class HashingEmbedder:
+    """Signed feature hashing of lowercased words and word bigrams.
+
+    Needs no model or network, so an index can be built and queried fully
+    offline. It matches shared terms only; use a real embedding model for
+    semantic recall.
+    """
+
+    name = HASHING
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def _vector(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        words = _WORD.findall(text.lower())
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            digest = zlib.crc32(feature.encode("utf-8"))
+            vector[digest % self.dim] += 1.0 if digest & 0x80000000 else -1.0
+        return vector
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return normalize_rows(np.stack([self._vector(text) for text in texts]))
+
+    async def aembed(self, texts: Sequence[str]) -> np.ndarray:
+        return self.embed(texts)
+
+
+class OpenAIEmbedder:
+    """Batched `/embeddings` client with an LRU of query vectors."""
+
+    def __init__(
+        self,
+        base_url: str,
+        model: str,
+        http: HTTPPool,
+        ahttp: Optional[AsyncHTTPPool] = None,
+        headers: Optional[dict] = None,
+        batch_size: int = 64,
+        cache_entries: int = 4096,
+    ):
+        self.name = model
+        self.url = f"{base_url.rstrip('/')}/embeddings"
+        self.http = http
+        self.ahttp = ahttp
+        self.headers = headers or {"Content-Type": "application/json"}
+        self.batch_size = batch_size
+        self.cache = LRUCache(max_entries=cache_entries)
+
+    def _split_cached(self, texts: Sequence[str]):
+        vectors: Dict[int, np.ndarray] = {}
+        missing: List[int] = []
+        for i, text in enumerate(texts):
+            vector = self.cache.get(text)
+            if vector is None:
+                missing.append(i)
+            else:
+                vectors[i] = vector
+        return vectors, missing
+
+    def _payloads(self, texts: Sequence[str], missing: List[int]):
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start:start + self.batch_size]
+            yield batch, {"model": self.name, "input": [texts[i] for i in batch]}
+
+    def _collect(self, texts, vectors, batch, data: dict):
+        rows = sorted(data["data"], key=lambda item: item["index"])
+        embedded = normalize_rows([row["embedding"] for row in rows])
+        for i, vector in zip(batch, embedded):
+            vectors[i] = vector
+            self.cache.set(texts[i], vector)
+
+    def _stack(self, texts, vectors) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([vectors[i] for i in range(len(texts))])
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        texts = list(texts)
+        vectors, missing = self._split_cached(texts)
+        for batch, payload in self._payloads(texts, missing):
+            response = self.http.post(self.url, json=payload, headers=self.headers)
+            response.raise_for_status()
+            self._collect(texts, vectors, batch, response.json())
+        return self._stack(texts, vectors)
+
+    async def aembed(self, texts: Sequence[str]) -> np.ndarray:
+        if self.ahttp is None:
+            return await asyncio.to_thread(self.embed, texts)
+        texts = list(texts)
+        vectors, missing = self._split_cached(texts)
+        for batch, payload in self._payloads(texts, missing):
+            async with self.ahttp.session.post(self.url, json=payload, headers=self.headers) as response:
+                response.raise_for_status()
+                data = await response.json(content_type=None)
+            self._collect(texts, vectors, batch, data)
+        return self._stack(texts, vectors)
+
+
+def get_embedder(
+    model: str,
+    base_url: str = "",
+    http: Optional[HTTPPool] = None,
+    ahttp: Optional[AsyncHTTPPool] = None,
+    headers: Optional[dict] = None,
+    dim: int = 512,
+):
+    """`"hashing"` gives the offline embedder, anything else names a served model."""
+    if model == HASHING:
+        return HashingEmbedder(dim)
+    return OpenAIEmbedder(base_url, model, http or HTTPPool(), ahttp, headers)
@@ -0,0 +1,80 @@
+"""A pipeline-owned asyncio event loop running on a daemon thread.
+
+Kept apart from `pipeline_core.aio` so that pipelines which only need the
+loop do not import aiohttp when the server loads them.
+"""
+
+import asyncio
+import threading
+from typing import AsyncIterator, Awaitable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class EventLoopThread:
+    """Runs one asyncio event loop on a daemon thread.
+
+    Synchronous callers (the pipelines server runs `pipe` on a worker thread)
+    submit coroutines to it and block only their own thread, while all network
+    waits of all concurrent chats are multiplexed on the single loop.
+    """
+
+    def __init__(self, name: str = "pipeline-loop"):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self.start()
+
+    @property
+    def running(self) -> bool:
+        return self._loop is not None and self._loop.is_running()
+
+    def start(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                started = threading.Event()
+
+                def _run():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(started.set)
+                    loop.run_forever()
+
+                self._thread = threading.Thread(target=_run, name=self.name, daemon=True)
+                self._thread.start()
+                started.wait()
+                self._loop = loop
+            return self._loop
+
+    def stop(self):
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop, self._thread = None, None
+        if loop is None:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        loop.close()
+
+    def run(self, coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+        """Run `coro` on the loop and block the calling thread for the result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def iterate(self, agen: AsyncIterator[T]) -> Iterator[T]:
+        """Expose an async iterator living on the loop as a sync generator."""
+        try:
+            while True:
+                try:
+                    item = self.run(agen.__anext__())
+                except StopAsyncIteration:
+                    return
+                yield item
+        finally:
+            aclose = getattr(agen, "aclose", None)
+            if aclose is not None and self.running:
+                self.run(aclose())
@@ -0,0 +1,170 @@
+"""Pooled keep-alive HTTP sessions shared by the pipelines."""
+
+import threading
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from pipeline_core.metrics import current_span
+
+
+class PoolStats:
+    """Counts requests sent and TCP connections opened by a pool.
+
+    Every request either opens a new connection or reuses a kept-alive one,
+    so the number of reused connections is the difference of the two.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_new_connection(self):
+        with self._lock:
+            self.new_connections += 1
+
+    @property
+    def reused_connections(self) -> int:
+        return max(self.requests - self.new_connections, 0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            requests_sent = self.requests
+            new_connections = self.new_connections
+        return {
+            "requests": requests_sent,
+            "new_connections": new_connections,
+            "reused_connections": max(requests_sent - new_connections, 0),
+        }
+
+
+def _counting_pool(base, stats: PoolStats):
+    class CountingPool(base):
+        def _new_conn(self):
+            stats.record_new_connection()
+            return super()._new_conn()
+
+    CountingPool.__name__ = f"Counting{base.__name__}"
+    return CountingPool
+
+
+class _CountingAdapter(HTTPAdapter):
+    def __init__(self, stats: PoolStats, **kwargs):
+        self._stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool(HTTPConnectionPool, self._stats),
+            "https": _counting_pool(HTTPSConnectionPool, self._stats),
+        }
+
+
+@dataclass(frozen=True)
+class PoolConfig:
+    # Number of per-host pools kept around (one per upstream host).
+    pool_connections: int = 10
+    # Connections kept alive per host.
+    pool_maxsize: int = 10
+    # Block instead of opening extra connections once a host hits pool_maxsize.
+    pool_block: bool = False
+    keep_alive: bool = True
+    connect_timeout: float = 5.0
+    read_timeout: float = 120.0
+
+    @classmethod
+    def from_valves(cls, valves) -> "PoolConfig":
+        return cls(
+            pool_connections=valves.HTTP_POOL_CONNECTIONS,
+            pool_maxsize=valves.HTTP_POOL_MAXSIZE,
+            pool_block=valves.HTTP_POOL_BLOCK,
+            keep_alive=valves.HTTP_KEEP_ALIVE,
+            connect_timeout=valves.HTTP_CONNECT_TIMEOUT,
+            read_timeout=valves.HTTP_READ_TIMEOUT,
+        )
+
+
+class HTTPPool:
+    """A lazily created `requests.Session` with a bounded connection pool.
+
+    Pipelines create one in `__init__`, open it in `on_startup` and close it
+    in `on_shutdown`. Calls made before `on_startup` (the model list fetch in
+    `__init__`) open the session on first use.
+    """
+
+    def __init__(self, config: Optional[PoolConfig] = None):
+        self.config = config or PoolConfig()
+        self.stats = PoolStats()
+        self._session: Optional[requests.Session] = None
+        self._lock = threading.Lock()
+
+    @property
+    def timeout(self) -> Tuple[float, float]:
+        return (self.config.connect_timeout, self.config.read_timeout)
+
+    @property
+    def session(self) -> requests.Session:
+        session = self._session
+        if session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._build_session()
+                session = self._session
+        return session
+
+    def _build_session(self) -> requests.Session:
+        adapter = _CountingAdapter(
+            self.stats,
+            pool_connections=self.config.pool_connections,
+            pool_maxsize=self.config.pool_maxsize,
+            pool_block=self.config.pool_block,
+            max_retries=0,
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers["Connection"] = "keep-alive" if self.config.keep_alive else "close"
+        return session
+
+    def open(self) -> "HTTPPool":
+        self.session
+        return self
+
+    def close(self):
+        with self._lock:
+            session, self._session = self._session, None
+        if session is not None:
+            session.close()
+
+    def reconfigure(self, config: PoolConfig):
+        if config != self.config:
+            self.close()
+            self.config = config
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        self.stats.record_request()
+        response = self.session.request(method, url, **kwargs)
+        span = current_span()
+        if span is not None:
+            body = response.request.body
+            span.add(
+                bytes_in=int(response.headers.get("Content-Length") or 0),
+                bytes_out=len(body) if body else 0,
+            )
+        return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
@@ -0,0 +1,294 @@
+"""In-process vector index: memory-mapped embeddings with exact or IVF top-k.
+
+An index is a directory holding
+
+    manifest.json        dimension, row count, embedding model, IVF size
+    embeddings.npy       float32 (rows, dim), L2-normalized, opened with mmap
+    records.jsonl        one {"document", "metadata"} object per row
+    chunks.bin, ...      the same records as a `pipeline_core.chunk_store` store
+    ivf_centroids.npy    optional (nlist, dim) k-means centroids
+    ivf_order.npy        row ids grouped by list
+    ivf_offsets.npy      (nlist + 1) start of each list in ivf_order
+
+Build one from a corpus with `python -m pipeline_core.local_index build`.
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import os
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from pipeline_core.chunk_store import ChunkStore, has_chunk_store, open_chunk_store
+from pipeline_core.embeddings import HASHING, get_embedder, normalize_rows
+
+MANIFEST = "manifest.json"
+EMBEDDINGS = "embeddings.npy"
+RECORDS = "records.jsonl"
+IVF_CENTROIDS = "ivf_centroids.npy"
+IVF_ORDER = "ivf_order.npy"
+IVF_OFFSETS = "ivf_offsets.npy"
+
+# Rows scored per matmul block in exact search, bounding temporary memory.
+BLOCK_ROWS = 65536
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Column indices of the `k` best scores per row, best first."""
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.zeros((scores.shape[0], 0), dtype=np.int64)
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(part, order, axis=1)
+
+
+def kmeans(vectors: np.ndarray, nlist: int, iterations: int = 10, sample: int = 256, seed: int = 0) -> np.ndarray:
+    """Spherical k-means centroids, trained on at most `sample * nlist` rows."""
+    rng = np.random.default_rng(seed)
+    rows = vectors.shape[0]
+    train = vectors[np.sort(rng.choice(rows, min(rows, sample * nlist), replace=False))]
+    centroids = train[rng.choice(train.shape[0], nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(train @ centroids.T, axis=1)
+        for c in range(nlist):
+            members = train[assign == c]
+            if len(members):
+                centroids[c] = members.sum(axis=0)
+        centroids = normalize_rows(centroids)
+    return centroids
+
+
+def write_records(path: str, records: Sequence[dict]):
+    with open(os.path.join(path, RECORDS), "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps({"document": record.get("document", ""), "metadata": record.get("metadata", {})}, separators=(",", ":")))
+            f.write("\n")
+    ChunkStore.build(path, records)
+
+
+def load_records(path: str) -> List[bytes]:
+    """Raw record lines of records.jsonl."""
+    with open(os.path.join(path, RECORDS), "rb") as f:
+        return f.read().splitlines()
+
+
+def open_chunks(path: str) -> ChunkStore:
+    """The chunk store of an index directory. Indexes written before stores
+    existed get one in memory, built from records.jsonl."""
+    if has_chunk_store(path):
+        return open_chunk_store(path)
+    return ChunkStore.from_records(json.loads(line) for line in load_records(path))
+
+
+def read_corpus(path: str) -> List[dict]:
+    """A JSON list or JSON lines of {document, metadata} records."""
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+class LocalVectorIndex:
+    """Top-k cosine search over an index directory, without a server.
+
+    Exact search is one blocked matmul over the memory-mapped matrix. With
+    IVF lists, a query only scores the rows of its `nprobe` nearest lists;
+    at least one list is always probed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, MANIFEST), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self.embeddings = np.load(os.path.join(path, EMBEDDINGS), mmap_mode="r")
+        self.chunks = open_chunks(path)
+        self.centroids = self.order = self.offsets = None
+        if self.manifest.get("nlist"):
+            self.centroids = np.load(os.path.join(path, IVF_CENTROIDS))
+            self.order = np.load(os.path.join(path, IVF_ORDER), mmap_mode="r")
+            self.offsets = np.load(os.path.join(path, IVF_OFFSETS))
+
+    def __len__(self) -> int:
+        return self.embeddings.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.embeddings.shape[1]
+
+    @property
+    def embedding_model(self) -> str:
+        return self.manifest.get("embedding_model", HASHING)
+
+    @classmethod
+    def build(
+        cls,
+        path: str,
+        records: Sequence[dict],
+        embeddings: np.ndarray,
+        embedding_model: str,
+        nlist: int = 0,
+        seed: int = 0,
+    ) -> "LocalVectorIndex":
+        embeddings = normalize_rows(embeddings)
+        if len(records) != embeddings.shape[0]:
+            raise ValueError(f"{len(records)} records but {embeddings.shape[0]} embeddings")
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, EMBEDDINGS), embeddings)
+        write_records(path, records)
+        nlist = min(nlist, embeddings.shape[0])
+        if nlist > 1:
+            centroids = kmeans(embeddings, nlist, seed=seed)
+            assign = np.concatenate([
+                np.argmax(embeddings[start:start + BLOCK_ROWS] @ centroids.T, axis=1)
+                for start in range(0, embeddings.shape[0], BLOCK_ROWS)
+            ])
+            np.save(os.path.join(path, IVF_CENTROIDS), centroids)
+            np.save(os.path.join(path, IVF_ORDER), np.argsort(assign, kind="stable"))
+            np.save(os.path.join(path, IVF_OFFSETS), np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))]))
+        else:
+            nlist = 0
+        manifest = {
+            "rows": int(embeddings.shape[0]),
+            "dim": int(embeddings.shape[1]),
+            "embedding_model": embedding_model,
+            "nlist": nlist,
+        }
+        with open(os.path.join(path, MANIFEST), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        return cls(path)
+
+    def record(self, row: int, score: float) -> dict:
+        return self.chunks.hit(row, {"score": score})
+
+    def _exact(self, queries: np.ndarray, k: int):
+        best_rows = np.zeros((queries.shape[0], 0), dtype=np.int64)
+        best_scores = np.zeros((queries.shape[0], 0), dtype=np.float32)
+        for start in range(0, len(self), BLOCK_ROWS):
+            block = queries @ self.embeddings[start:start + BLOCK_ROWS].T
+            keep = top_k(block, k)
+            rows = np.concatenate([best_rows, keep + start], axis=1)
+            scores = np.concatenate([best_scores, np.take_along_axis(block, keep, axis=1)], axis=1)
+            keep = top_k(scores, k)
+            best_rows = np.take_along_axis(rows, keep, axis=1)
+            best_scores = np.take_along_axis(scores, keep, axis=1)
+        return best_rows, best_scores
+
+    def _ivf(self, query: np.ndarray, k: int, nprobe: int):
+        lists = top_k((query @ self.centroids.T)[None, :], nprobe)[0]
+        # Sorted row ids keep the reads from the memory map sequential.
+        candidates = np.sort(np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in lists]))
+        scores = (self.embeddings[candidates] @ query)[None, :]
+        keep = top_k(scores, k)[0]
+        return candidates[keep], scores[0, keep]
+
+    def search_vectors(self, queries: np.ndarray, k: int = 5, nprobe: int = 8) -> List[List[dict]]:
+        queries = normalize_rows(np.atleast_2d(queries))
+        nprobe = max(1, nprobe)
+        if self.centroids is not None and nprobe < len(self.centroids):
+            found = [self._ivf(query, k, nprobe) for query in queries]
+        else:
+            rows, scores = self._exact(queries, k)
+            found = zip(rows, scores)
+        return [[self.record(int(row), float(score)) for row, score in zip(rows, scores)] for rows, scores in found]
+
+
+@functools.lru_cache(maxsize=8)
+def _open(path: str, mtime: float) -> LocalVectorIndex:
+    return LocalVectorIndex(path)
+
+
+def open_index(path: str) -> LocalVectorIndex:
+    """Shared, read-only index for `path`; reopened when it is rebuilt."""
+    return _open(path, os.path.getmtime(os.path.join(path, MANIFEST)))
+
+
+class LocalSearchClient:
+    """Drop-in for VectorSearchClient that searches a LocalVectorIndex in-process.
+
+    Hits have the remote server's `{"document", "metadata"}` shape plus a
+    cosine `score`.
+    """
+
+    def __init__(self, index: LocalVectorIndex, embedder, top_k: int = 5, nprobe: int = 8):
+        self.index = index
+        self.embedder = embedder
+        self.top_k = top_k
+        self.nprobe = nprobe
+
+    def search(self, query: str) -> List[dict]:
+        return self.search_many([query])[0]
+
+    def search_many(self, queries: Sequence[str]) -> List[List[dict]]:
+        queries = list(queries)
+        if not queries:
+            return []
+        return self.index.search_vectors(self.embedder.embed(queries), self.top_k, self.nprobe)
+
+    async def asearch(self, query: str) -> List[dict]:
+        return (await self.asearch_many([query]))[0]
+
+    async def asearch_many(self, queries: Sequence[str]) -> List[List[dict]]:
+        queries = list(queries)
+        if not queries:
+            return []
+        vectors = await self.embedder.aembed(queries)
+        return await asyncio.to_thread(self.index.search_vectors, vectors, self.top_k, self.nprobe)
+
+
+def build_local_search(
+    path: str,
+    embedding_model: str = "",
+    base_url: str = "",
+    http=None,
+    ahttp=None,
+    headers: Optional[dict] = None,
+    top_k: int = 5,
+    nprobe: int = 8,
+) -> LocalSearchClient:
+    index = open_index(path)
+    model = embedding_model or index.embedding_model
+    embedder = get_embedder(model, base_url, http, ahttp, headers, dim=index.dim)
+    return LocalSearchClient(index, embedder, top_k, nprobe)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="embed a corpus and write an index directory")
+    build.add_argument("corpus", help="JSON list or JSON lines of {document, metadata} records")
+    build.add_argument("index", help="output directory")
+    build.add_argument("--embedding-model", default=HASHING, help=f"served model name, or {HASHING!r} for offline hashing")
+    build.add_argument("--base-url", default="", help="OpenAI-compatible API base URL for the embedding model")
+    build.add_argument("--api-key", default=os.getenv("OPENAI_API_KEY", ""))
+    build.add_argument("--dim", type=int, default=512, help="hashing embedder dimension")
+    build.add_argument("--nlist", type=int, default=0, help="IVF lists; 0 keeps exact search only")
+
+    query = commands.add_parser("query", help="search an index directory")
+    query.add_argument("index")
+    query.add_argument("text")
+    query.add_argument("--base-url", default="")
+    query.add_argument("--api-key", default=os.getenv("OPENAI_API_KEY", ""))
+    query.add_argument("--top-k", type=int, default=5)
+    query.add_argument("--nprobe", type=int, default=8)
+
+    args = parser.parse_args()
+    headers = {"Authorization": f"Bearer {args.api_key}", "Content-Type": "application/json"}
+    if args.command == "build":
+        records = read_corpus(args.corpus)
+        embedder = get_embedder(args.embedding_model, args.base_url, headers=headers, dim=args.dim)
+        embeddings = embedder.embed([record.get("document", "") for record in records])
+        index = LocalVectorIndex.build(args.index, records, embeddings, args.embedding_model, args.nlist)
+        print(f"Built {args.index}: {json.dumps(index.manifest)}")
+    else:
+        client = build_local_search(args.index, base_url=args.base_url, headers=headers, top_k=args.top_k, nprobe=args.nprobe)
+        print(json.dumps({"results": client.search(args.text)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
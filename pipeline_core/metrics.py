@@ -0,0 +1,382 @@
+"""In-process stage metrics and trace spans for the pipelines.
+
+Each pipeline module owns a `Metrics` registry (`get_metrics(__name__)`) and
+wraps its stages in `with metrics.stage("retrieval") as span:`. Wall time goes
+into a per-stage histogram, `span.add(...)` feeds byte and token counters,
+and exceptions count as stage errors. The HTTP pools attribute request and
+response bytes to the innermost open span. Everything can be rendered in
+the Prometheus text format (`prometheus_text`, or `serve_metrics(port)` for a
+scrape endpoint) or exported as OpenTelemetry-style span dicts. Other
+components add their own samples with `metrics.add_collector`, declaring
+the families once with `register_family`.
+"""
+
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("pipeline_span", default=None)
+
+
+def current_span() -> Optional["Span"]:
+    return _current_span.get()
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        total = 0
+        rows = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            rows.append((repr(bound), total))
+        rows.append(("+Inf", self.count))
+        return rows
+
+    def quantile(self, q: float) -> float:
+        """Upper bucket bound below which a fraction `q` of observations fall."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return float(bound)
+        return float("inf")
+
+
+class Span:
+    __slots__ = (
+        "name", "trace_id", "span_id", "parent_id", "start", "end",
+        "attributes", "error", "bytes_in", "bytes_out", "tokens", "coalesced_calls",
+    )
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, attributes: Optional[dict] = None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.attributes = attributes or {}
+        self.error: Optional[str] = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.tokens = 0
+        self.coalesced_calls = 0  # upstream calls shared with a concurrent request instead of made
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.time()) - self.start
+
+    def add(self, bytes_in: int = 0, bytes_out: int = 0, tokens: int = 0, coalesced_calls: int = 0):
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        self.tokens += tokens
+        self.coalesced_calls += coalesced_calls
+
+    def fail(self, error: BaseException):
+        self.error = repr(error)
+
+    def export(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "start_time_unix_nano": int(self.start * 1e9),
+            "end_time_unix_nano": int((self.end or self.start) * 1e9),
+            "attributes": {
+                **self.attributes,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "tokens": self.tokens,
+                "coalesced_calls": self.coalesced_calls,
+            },
+            "status": {"code": "ERROR", "message": self.error} if self.error else {"code": "OK"},
+        }
+
+
+class _StageStats:
+    __slots__ = ("seconds", "calls", "errors", "bytes_in", "bytes_out", "tokens", "coalesced_calls")
+
+    def __init__(self):
+        self.seconds = Histogram()
+        self.calls = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.tokens = 0
+        self.coalesced_calls = 0
+
+
+class Metrics:
+    def __init__(self, pipeline: str, max_spans: int = 1000):
+        self.pipeline = pipeline
+        self.spans: deque = deque(maxlen=max_spans)
+        self.time_to_first_token = Histogram()
+        self._stages: Dict[str, _StageStats] = {}
+        self._collectors: Dict[str, Callable[[], Dict[str, List[str]]]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, span: Span):
+        span.end = span.end or time.time()
+        with self._lock:
+            stats = self._stages.get(span.name)
+            if stats is None:
+                stats = self._stages[span.name] = _StageStats()
+            stats.seconds.observe(span.duration)
+            stats.calls += 1
+            stats.errors += span.error is not None
+            stats.bytes_in += span.bytes_in
+            stats.bytes_out += span.bytes_out
+            stats.tokens += span.tokens
+            stats.coalesced_calls += span.coalesced_calls
+            if self.spans.maxlen:
+                self.spans.append(span)
+
+    @contextmanager
+    def stage(self, name: str, **attributes) -> Iterator[Span]:
+        span = Span(name, _current_span.get(), attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.fail(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            self.record(span)
+
+    def _observe_first_token(self, span: Span, first: bool) -> bool:
+        if first:
+            with self._lock:
+                self.time_to_first_token.observe(span.duration)
+        return False
+
+    def drain(self, chunks: Iterator[str], name: str = "stream_drain") -> Iterator[str]:
+        """Pass a stream of text deltas through, timing it as a stage.
+
+        The span is opened here, inside the caller's trace, rather than when
+        the server starts iterating.
+        """
+        return self._drain(Span(name, _current_span.get()), chunks)
+
+    def adrain(self, chunks: AsyncIterator[str], name: str = "stream_drain") -> AsyncIterator[str]:
+        return self._adrain(Span(name, _current_span.get()), chunks)
+
+    def _drain(self, span: Span, chunks: Iterator[str]) -> Iterator[str]:
+        first = True
+        try:
+            for chunk in chunks:
+                first = self._observe_first_token(span, first)
+                span.add(bytes_out=len(chunk.encode("utf-8")), tokens=1)
+                yield chunk
+        except BaseException as e:
+            span.fail(e)
+            raise
+        finally:
+            self.record(span)
+
+    async def _adrain(self, span: Span, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+        first = True
+        try:
+            async for chunk in chunks:
+                first = self._observe_first_token(span, first)
+                span.add(bytes_out=len(chunk.encode("utf-8")), tokens=1)
+                yield chunk
+        except BaseException as e:
+            span.fail(e)
+            raise
+        finally:
+            aclose = getattr(chunks, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            self.record(span)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                name: {
+                    "calls": stats.calls,
+                    "errors": stats.errors,
+                    "seconds_sum": stats.seconds.sum,
+                    "p50": stats.seconds.quantile(0.5),
+                    "p95": stats.seconds.quantile(0.95),
+                    "bytes_in": stats.bytes_in,
+                    "bytes_out": stats.bytes_out,
+                    "tokens": stats.tokens,
+                    "coalesced_calls": stats.coalesced_calls,
+                }
+                for name, stats in self._stages.items()
+            }
+
+    def add_collector(self, name: str, collect: Callable[[], Dict[str, List[str]]]):
+        """Render `collect()`'s sample lines, grouped by family, with this
+        registry's; a later collector of the same name replaces it."""
+        with self._lock:
+            self._collectors[name] = collect
+
+    def export_spans(self) -> List[dict]:
+        with self._lock:
+            return [span.export() for span in self.spans]
+
+    def prometheus_samples(self) -> Dict[str, List[str]]:
+        """Sample lines grouped by metric family."""
+        families: Dict[str, List[str]] = {}
+
+        def histogram(family: str, labels: str, hist: Histogram):
+            lines = families.setdefault(family, [])
+            for bound, total in hist.cumulative():
+                lines.append(f'{family}_bucket{{{labels},le="{bound}"}} {total}')
+            lines.append(f"{family}_sum{{{labels}}} {hist.sum}")
+            lines.append(f"{family}_count{{{labels}}} {hist.count}")
+
+        with self._lock:
+            for name, stats in sorted(self._stages.items()):
+                labels = f'pipeline="{self.pipeline}",stage="{name}"'
+                histogram("pipeline_stage_seconds", labels, stats.seconds)
+                for counter in _COUNTERS:
+                    family = f"pipeline_stage_{counter}_total"
+                    families.setdefault(family, []).append(f"{family}{{{labels}}} {getattr(stats, counter)}")
+            histogram("pipeline_time_to_first_token_seconds", f'pipeline="{self.pipeline}"', self.time_to_first_token)
+            collectors = list(self._collectors.values())
+        for collect in collectors:
+            for family, lines in collect().items():
+                families.setdefault(family, []).extend(lines)
+        return families
+
+
+_registry: Dict[str, Metrics] = {}
+_registry_lock = threading.Lock()
+
+_COUNTERS = ("calls", "errors", "bytes_in", "bytes_out", "tokens", "coalesced_calls")
+
+_FAMILIES = [
+    ("pipeline_stage_seconds", "histogram", "Wall time of each pipeline stage."),
+    ("pipeline_time_to_first_token_seconds", "histogram", "Time from stream start to the first forwarded delta."),
+] + [
+    (f"pipeline_stage_{counter}_total", "counter", f"Total {counter.replace('_', ' ')} per pipeline stage.")
+    for counter in _COUNTERS
+]
+
+
+def register_family(family: str, kind: str, help_text: str):
+    """Declare a metric family rendered by `prometheus_text`."""
+    with _registry_lock:
+        if all(name != family for name, _, _ in _FAMILIES):
+            _FAMILIES.append((family, kind, help_text))
+
+
+def get_metrics(pipeline: str) -> Metrics:
+    with _registry_lock:
+        metrics = _registry.get(pipeline)
+        if metrics is None:
+            metrics = _registry[pipeline] = Metrics(pipeline)
+        return metrics
+
+
+def prometheus_text() -> str:
+    with _registry_lock:
+        registries = list(_registry.values())
+        declared = list(_FAMILIES)
+    samples = [metrics.prometheus_samples() for metrics in registries]
+    lines = []
+    for family, kind, help_text in declared:
+        lines.append(f"# HELP {family} {help_text}")
+        lines.append(f"# TYPE {family} {kind}")
+        for families in samples:
+            lines.extend(families.get(family, []))
+    return "\n".join(lines) + "\n"
+
+
+def configure_logging(logger: logging.Logger, level: str):
+    """Apply a valve log level; debug output costs nothing above DEBUG.
+
+    An unknown level name is logged and replaced by INFO rather than
+    raised, since this runs on every valve update.
+    """
+    if not logger.handlers and not logging.getLogger().handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        logger.addHandler(handler)
+    number = logging.getLevelName(str(level).strip().upper())
+    if not isinstance(number, int):
+        logger.setLevel(logging.INFO)
+        logger.warning("Unknown LOG_LEVEL %r, logging at INFO", level)
+        return
+    logger.setLevel(number)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_servers: Dict[Tuple[str, int], ThreadingHTTPServer] = {}
+_server_owners: Dict[str, Tuple[str, int]] = {}
+
+
+def serve_metrics(port: int, host: str = "127.0.0.1", owner: str = "") -> Optional[ThreadingHTTPServer]:
+    """Serve a `/metrics` scrape endpoint on `host:port` for `owner`.
+
+    Each address is bound once per process and renders every registry.
+    Calling again with another port moves `owner` there, and port 0 stops
+    serving for it; an address no owner uses any more is shut down. A port
+    that cannot be bound is logged rather than raised, so a clash does not
+    abort the pipeline's startup.
+    """
+    address = (host, port)
+    server = stale = None
+    with _registry_lock:
+        previous = _server_owners.pop(owner, None)
+        if port:
+            server = _servers.get(address)
+            if server is None:
+                try:
+                    server = ThreadingHTTPServer(address, _MetricsHandler)
+                except OSError as e:
+                    logger.warning("Cannot serve metrics on %s:%s: %s", host, port, e)
+                else:
+                    server.daemon_threads = True
+                    threading.Thread(target=server.serve_forever, name="pipeline-metrics", daemon=True).start()
+                    _servers[address] = server
+            if server is not None:
+                _server_owners[owner] = address
+        if previous is not None and previous != address and previous not in _server_owners.values():
+            stale = _servers.pop(previous, None)
+    if stale is not None:
+        # Outside the lock: a scrape in progress takes it to render.
+        stale.shutdown()
+        stale.server_close()
+    return server
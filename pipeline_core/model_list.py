@@ -0,0 +1,122 @@
+"""Model list for manifold pipelines, served from disk and refreshed in the background."""
+
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def default_cache_path(pipeline: str) -> str:
+    return os.path.join(os.path.expanduser("~"), ".cache", "pipelines", f"{pipeline}-models.json")
+
+
+def cache_key(base_url: str, api_key: str = "") -> str:
+    """Upstream identity a saved list belongs to: the base URL and a digest
+    of the API key, since one server may list different models per key."""
+    return f"{base_url}#{hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]}"
+
+
+class ModelListCache:
+    """Keeps the last good model list and refreshes it off the request path.
+
+    `load` returns whatever was saved for `key` (see `cache_key`) by a
+    previous run, so loading a pipeline never waits on the inference server.
+    `start` runs `fetch` on a daemon thread: after a success it waits `ttl`
+    seconds, after a failure it backs off exponentially with jitter, capped
+    at `max_backoff`. A failed refresh keeps serving the previous list.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[], List[dict]],
+        path: str,
+        key: str = "",
+        ttl: float = 300.0,
+        backoff: float = 1.0,
+        max_backoff: float = 300.0,
+    ):
+        self.fetch = fetch
+        self.path = path
+        self.key = key
+        self.ttl = ttl
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.models: List[dict] = []
+        self.last_error: Optional[str] = None
+        self.refreshed_at: Optional[float] = None
+        self.failures = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def load(self) -> List[dict]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return self.models
+        if saved.get("key") == self.key and isinstance(saved.get("models"), list):
+            self.models = saved["models"]
+        return self.models
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"key": self.key, "models": self.models, "saved_at": time.time()}, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning("Could not save model list to %s: %s", self.path, e)
+
+    def refresh(self) -> bool:
+        try:
+            models = self.fetch()
+        except Exception as e:
+            self.failures += 1
+            self.last_error = repr(e)
+            logger.warning("Error fetching models: %s", e)
+            return False
+        self.failures = 0
+        self.last_error = None
+        self.refreshed_at = time.time()
+        if models != self.models:
+            self.models = models
+            self.save()
+        return True
+
+    def next_delay(self) -> float:
+        if not self.failures:
+            return self.ttl
+        delay = min(self.max_backoff, self.backoff * 2 ** (self.failures - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _run(self, stop: threading.Event):
+        while not stop.is_set():
+            self.refresh()
+            stop.wait(self.next_delay())
+
+    def start(self):
+        """Begin refreshing in the background; the first attempt is immediate."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stop,), name="model-list-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def snapshot(self) -> dict:
+        return {
+            "models": len(self.models),
+            "refreshed_at": self.refreshed_at,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
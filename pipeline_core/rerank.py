@@ -0,0 +1,148 @@
+"""Rerankers scoring (question, passage) pairs in one batched CPU pass.
+
+`get_reranker` loads a cross-encoder exported to ONNX (a directory, or a
+`.onnx` file, next to its `tokenizer.json`) with `onnxruntime` and
+`tokenizers`. Both are optional imports: without them, or without a model,
+it falls back to `OverlapScorer`, a NumPy BM25 over the candidate set, so
+the rerank stage still runs, with lexical precision only.
+"""
+
+import functools
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from typing import List, Sequence
+
+import numpy as np
+
+from pipeline_core.bm25 import tokenize
+
+logger = logging.getLogger(__name__)
+
+OVERLAP = "overlap"
+
+
+def passage(hit: dict) -> str:
+    """The text a reranker sees for a hit: its title, then its document."""
+    title = (hit.get("metadata") or {}).get("title", "")
+    document = hit.get("document", "")
+    return f"{title}\n{document}" if title else document
+
+
+class Reranker:
+    """Times every batch to keep a running cost per pair, which `capacity`
+    turns into the number of pairs that fit a latency budget."""
+
+    name = "reranker"
+
+    def __init__(self):
+        self.seconds_per_pair = 0.0
+        self._lock = threading.Lock()
+
+    def _score(self, query: str, passages: Sequence[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    def score(self, query: str, passages: Sequence[str]) -> np.ndarray:
+        if not passages:
+            return np.zeros(0, dtype=np.float32)
+        start = time.perf_counter()
+        scores = np.asarray(self._score(query, passages), dtype=np.float32).reshape(-1)
+        cost = (time.perf_counter() - start) / len(passages)
+        with self._lock:
+            self.seconds_per_pair = cost if not self.seconds_per_pair else 0.8 * self.seconds_per_pair + 0.2 * cost
+        return scores
+
+    def capacity(self, budget: float) -> int:
+        """Pairs one batch can score within `budget` seconds; 0 means no limit."""
+        if budget <= 0 or not self.seconds_per_pair:
+            return 0
+        return int(budget / self.seconds_per_pair)
+
+
+class OverlapScorer(Reranker):
+    """Okapi BM25 of the question over the candidate passages, as a matrix.
+
+    Needs no model. It rewards passages dense in the question's rarer terms
+    among the candidates; use a cross-encoder model for semantic precision.
+    """
+
+    name = OVERLAP
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        super().__init__()
+        self.k1 = k1
+        self.b = b
+
+    def _score(self, query: str, passages: Sequence[str]) -> np.ndarray:
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return np.zeros(len(passages), dtype=np.float32)
+        documents = [Counter(tokenize(text)) for text in passages]
+        counts = np.array([[words[term] for term in terms] for words in documents], dtype=np.float32)
+        lengths = np.array([sum(words.values()) for words in documents], dtype=np.float32)
+        rows = len(documents)
+        df = (counts > 0).sum(axis=0)
+        idf = np.log1p((rows - df + 0.5) / (df + 0.5))
+        norm = self.k1 * (1 - self.b + self.b * lengths / max(lengths.mean(), 1.0))
+        return (counts * (self.k1 + 1) / (counts + norm[:, None]) * idf).sum(axis=1)
+
+
+class ONNXCrossEncoder(Reranker):
+    """A sequence-pair classifier run with onnxruntime on the CPU.
+
+    All pairs are tokenized together, padded to the longest, and scored in
+    one `InferenceSession.run`; the last logit of each row is its score.
+    """
+
+    def __init__(self, path: str, max_length: int = 256, threads: int = 0):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        super().__init__()
+        model = path if path.endswith(".onnx") else os.path.join(path, "model.onnx")
+        self.name = model
+        self.tokenizer = Tokenizer.from_file(os.path.join(os.path.dirname(model), "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.enable_padding()
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(model, options, providers=["CPUExecutionProvider"])
+        self.inputs = {node.name for node in self.session.get_inputs()}
+
+    def _score(self, query: str, passages: Sequence[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch([(query, text) for text in passages])
+        feed = {
+            "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+            "attention_mask": np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64),
+            "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64),
+        }
+        logits = self.session.run(None, {name: value for name, value in feed.items() if name in self.inputs})[0]
+        return logits[:, -1] if logits.ndim == 2 else logits
+
+
+@functools.lru_cache(maxsize=4)
+def get_reranker(model: str, max_length: int = 256, threads: int = 0) -> Reranker:
+    """The reranker for `model`, loaded and warmed up once per setting.
+
+    An empty `model` or `"overlap"` gives the NumPy fallback, as does a
+    model that cannot be loaded.
+    """
+    reranker: Reranker = OverlapScorer()
+    if model and model != OVERLAP:
+        try:
+            reranker = ONNXCrossEncoder(model, max_length, threads)
+        except Exception as e:
+            logger.warning("Cross-encoder unavailable for %r, reranking by term overlap: %s", model, e)
+    # Builds the session's kernels and gives `capacity` a first estimate.
+    reranker.score("warm up", ["warm up passage"] * 4)
+    return reranker
+
+
+def rerank(reranker: Reranker, query: str, hits: List[dict], top_k: int) -> List[dict]:
+    """The `top_k` best `hits` by reranker score, under `rerank_score`."""
+    scores = reranker.score(query, [passage(hit) for hit in hits])
+    order = np.argsort(-scores, kind="stable")[:top_k]
+    return [{**hits[i], "rerank_score": float(scores[i])} for i in order]
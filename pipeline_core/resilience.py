@@ -0,0 +1,382 @@
+"""Deadlines, bounded concurrency, retries and circuit breaking per upstream."""
+
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+import aiohttp
+import requests
+
+from pipeline_core.metrics import register_family
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+register_family("pipeline_upstream_circuit_state", "gauge", "Upstream circuit: 0 closed, 1 half-open, 2 open.")
+register_family("pipeline_upstream_in_flight", "gauge", "Upstream calls holding a concurrency slot.")
+register_family("pipeline_upstream_queued", "gauge", "Upstream calls waiting for a concurrency slot.")
+register_family("pipeline_upstream_rejected_total", "counter", "Upstream calls refused without being attempted.")
+register_family("pipeline_upstream_retries_total", "counter", "Upstream call attempts repeated after a transient failure.")
+register_family("pipeline_upstream_failures_total", "counter", "Upstream calls failed after their last attempt.")
+
+
+class UpstreamUnavailable(Exception):
+    """An upstream call was refused without being attempted."""
+
+
+class CircuitOpen(UpstreamUnavailable):
+    pass
+
+
+class Overloaded(UpstreamUnavailable):
+    pass
+
+
+def is_transient(error: BaseException) -> bool:
+    """Whether `error` says the upstream is down or overloaded, rather than
+    that it answered and rejected the request."""
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, aiohttp.ClientConnectionError)):
+        return True
+    if isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+        return True
+    status = None
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+    elif isinstance(error, aiohttp.ClientResponseError):
+        status = error.status
+    return status is not None and (status >= 500 or status == 429)
+
+
+@dataclass(frozen=True)
+class UpstreamPolicy:
+    connect_timeout: float = 5.0
+    read_timeout: float = 120.0
+    # Calls in flight at once; 0 leaves them unbounded.
+    max_concurrency: int = 0
+    # Calls waiting for a slot; past this they fail fast with `Overloaded`.
+    queue_limit: int = 64
+    queue_timeout: float = 10.0
+    # Repeats of a transient failure, for idempotent calls only.
+    retries: int = 0
+    retry_backoff: float = 0.1
+    max_backoff: float = 2.0
+    # Consecutive transient failures that open the circuit; 0 never opens it.
+    failure_threshold: int = 5
+    reset_timeout: float = 30.0
+
+    @classmethod
+    def for_llm(cls, valves) -> "UpstreamPolicy":
+        return cls(
+            connect_timeout=valves.HTTP_CONNECT_TIMEOUT,
+            read_timeout=valves.HTTP_READ_TIMEOUT,
+            max_concurrency=valves.LLM_MAX_CONCURRENCY,
+            queue_limit=valves.UPSTREAM_QUEUE_LIMIT,
+            queue_timeout=valves.UPSTREAM_QUEUE_TIMEOUT,
+            failure_threshold=valves.CIRCUIT_FAILURE_THRESHOLD,
+            reset_timeout=valves.CIRCUIT_RESET_SECONDS,
+        )
+
+    @classmethod
+    def for_vector_db(cls, valves) -> "UpstreamPolicy":
+        return cls(
+            connect_timeout=valves.VECTOR_DB_CONNECT_TIMEOUT,
+            read_timeout=valves.VECTOR_DB_READ_TIMEOUT,
+            max_concurrency=valves.VECTOR_DB_MAX_CONCURRENCY,
+            queue_limit=valves.UPSTREAM_QUEUE_LIMIT,
+            queue_timeout=valves.UPSTREAM_QUEUE_TIMEOUT,
+            retries=valves.VECTOR_DB_RETRIES,
+            retry_backoff=valves.VECTOR_DB_RETRY_BACKOFF,
+            failure_threshold=valves.CIRCUIT_FAILURE_THRESHOLD,
+            reset_timeout=valves.CIRCUIT_RESET_SECONDS,
+        )
+
+
+class _Waiter:
+    __slots__ = ("wake",)
+
+    def __init__(self, wake: Callable[[], Any]):
+        self.wake = wake
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Bulkhead:
+    """A counting semaphore with a bounded FIFO queue, shared by threads and
+    coroutines.
+
+    A caller finding the queue full, or not getting a slot within
+    `queue_timeout`, gets `Overloaded` instead of waiting. A released slot
+    goes straight to the longest waiter.
+    """
+
+    def __init__(self, limit: int = 0, queue_limit: int = 64, queue_timeout: float = 10.0):
+        self.limit = limit
+        self.queue_limit = queue_limit
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: Deque[_Waiter] = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _enter(self, wake: Callable[[], Any]) -> Optional[_Waiter]:
+        # Takes a slot and returns None, or queues a waiter; caller holds the lock.
+        if self.limit <= 0 or (self.active < self.limit and not self._waiters):
+            self.active += 1
+            return None
+        if len(self._waiters) >= self.queue_limit:
+            raise Overloaded(f"{len(self._waiters)} calls already waiting")
+        waiter = _Waiter(wake)
+        self._waiters.append(waiter)
+        return waiter
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        # True when the waiter left the queue before a slot was handed to it.
+        with self._lock:
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                return False
+            return True
+
+    def acquire(self):
+        event = threading.Event()
+        with self._lock:
+            waiter = self._enter(event.set)
+        if waiter is None or event.wait(self.queue_timeout):
+            return
+        if self._abandon(waiter):
+            raise Overloaded(f"no free slot within {self.queue_timeout}s")
+
+    async def aacquire(self):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            waiter = self._enter(lambda: loop.call_soon_threadsafe(_resolve, future))
+        if waiter is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if self._abandon(waiter):
+                raise Overloaded(f"no free slot within {self.queue_timeout}s")
+        except asyncio.CancelledError:
+            if not self._abandon(waiter):
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            if self._waiters and (self.limit <= 0 or self.active <= self.limit):
+                self._waiters.popleft().wake()
+            else:
+                self.active -= 1
+
+    def resize(self, limit: int, queue_limit: int, queue_timeout: float):
+        with self._lock:
+            self.limit, self.queue_limit, self.queue_timeout = limit, queue_limit, queue_timeout
+            while self._waiters and (limit <= 0 or self.active < limit):
+                self.active += 1
+                self._waiters.popleft().wake()
+
+
+class CircuitBreaker:
+    """Stops calls to an upstream after `failure_threshold` consecutive
+    transient failures.
+
+    While open, calls are refused for `reset_timeout` seconds; then one probe
+    is let through (half-open) and its outcome closes or reopens the circuit.
+    A probe that never reports back is replaced after another `reset_timeout`.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opens = 0
+        self._state = CLOSED
+        self._changed_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def retry_in(self) -> float:
+        return max(self._changed_at + self.reset_timeout - time.monotonic(), 0.0)
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.failure_threshold <= 0 or self._state == CLOSED:
+                return True
+            if time.monotonic() - self._changed_at < self.reset_timeout:
+                return False
+            self._state = HALF_OPEN
+            self._changed_at = time.monotonic()
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._state = CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._state == HALF_OPEN or (0 < self.failure_threshold <= self.failures):
+                if self._state != OPEN:
+                    self.opens += 1
+                self._state = OPEN
+                self._changed_at = time.monotonic()
+
+
+class Upstream:
+    """Everything between a stage and one upstream service.
+
+    `call` and `acall` refuse fast while the circuit is open or the queue is
+    full, hold a concurrency slot for the attempt, retry transient failures
+    with full-jitter backoff when the policy allows retries, and report the
+    outcome to the breaker. Requests made inside pass `timeout` (requests)
+    or `client_timeout` (aiohttp) so each upstream keeps its own deadlines.
+    """
+
+    def __init__(self, name: str, policy: Optional[UpstreamPolicy] = None):
+        self.name = name
+        self.policy = policy or UpstreamPolicy()
+        self.bulkhead = Bulkhead(self.policy.max_concurrency, self.policy.queue_limit, self.policy.queue_timeout)
+        self.breaker = CircuitBreaker(self.policy.failure_threshold, self.policy.reset_timeout)
+        self.rejected: Dict[str, int] = {"circuit_open": 0, "overloaded": 0}
+        self.retries = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def configure(self, policy: UpstreamPolicy):
+        """Apply new limits, keeping the circuit state and counters."""
+        self.policy = policy
+        self.bulkhead.resize(policy.max_concurrency, policy.queue_limit, policy.queue_timeout)
+        self.breaker.failure_threshold = policy.failure_threshold
+        self.breaker.reset_timeout = policy.reset_timeout
+
+    @property
+    def timeout(self) -> Tuple[float, float]:
+        return (self.policy.connect_timeout, self.policy.read_timeout)
+
+    @property
+    def client_timeout(self) -> aiohttp.ClientTimeout:
+        return aiohttp.ClientTimeout(total=None, sock_connect=self.policy.connect_timeout, sock_read=self.policy.read_timeout)
+
+    def _count(self, counter: str, reason: str = ""):
+        with self._lock:
+            if counter == "rejected":
+                self.rejected[reason] += 1
+            else:
+                setattr(self, counter, getattr(self, counter) + 1)
+
+    def _admit(self):
+        if not self.breaker.allow():
+            self._count("rejected", "circuit_open")
+            raise CircuitOpen(f"{self.name} circuit is open, retrying in {self.breaker.retry_in():.0f}s")
+
+    def _overloaded(self, error: Overloaded) -> Overloaded:
+        self._count("rejected", "overloaded")
+        return Overloaded(f"{self.name} overloaded: {error}")
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.policy.max_backoff, self.policy.retry_backoff * 2 ** attempt))
+
+    def _failed(self, error: Exception, attempt: int) -> bool:
+        # Whether to retry; otherwise reports the outcome to the breaker.
+        if not is_transient(error):
+            self.breaker.record_success()  # the upstream answered
+            return False
+        if attempt < self.policy.retries:
+            self._count("retries")
+            return True
+        self._count("failures")
+        self.breaker.record_failure()
+        return False
+
+    def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        self._admit()
+        try:
+            self.bulkhead.acquire()
+        except Overloaded as e:
+            raise self._overloaded(e) from None
+        try:
+            attempt = 0
+            while True:
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception as e:
+                    if not self._failed(e, attempt):
+                        raise
+                    time.sleep(self._backoff(attempt))
+                    attempt += 1
+                else:
+                    self.breaker.record_success()
+                    return result
+        finally:
+            self.bulkhead.release()
+
+    async def acall(self, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        self._admit()
+        try:
+            await self.bulkhead.aacquire()
+        except Overloaded as e:
+            raise self._overloaded(e) from None
+        try:
+            attempt = 0
+            while True:
+                try:
+                    result = await fn(*args, **kwargs)
+                except Exception as e:
+                    if not self._failed(e, attempt):
+                        raise
+                    await asyncio.sleep(self._backoff(attempt))
+                    attempt += 1
+                else:
+                    self.breaker.record_success()
+                    return result
+        finally:
+            self.bulkhead.release()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            rejected = dict(self.rejected)
+            retries, failures = self.retries, self.failures
+        return {
+            "state": self.breaker.state,
+            "in_flight": self.bulkhead.active,
+            "queued": self.bulkhead.queued,
+            "rejected": rejected,
+            "retries": retries,
+            "failures": failures,
+            "opens": self.breaker.opens,
+        }
+
+    def prometheus_samples(self, pipeline: str) -> Dict[str, List[str]]:
+        snapshot = self.snapshot()
+        labels = f'pipeline="{pipeline}",upstream="{self.name}"'
+        samples = {
+            "pipeline_upstream_circuit_state": [f"pipeline_upstream_circuit_state{{{labels}}} {_STATE_VALUES[snapshot['state']]}"],
+            "pipeline_upstream_in_flight": [f"pipeline_upstream_in_flight{{{labels}}} {snapshot['in_flight']}"],
+            "pipeline_upstream_queued": [f"pipeline_upstream_queued{{{labels}}} {snapshot['queued']}"],
+            "pipeline_upstream_retries_total": [f"pipeline_upstream_retries_total{{{labels}}} {snapshot['retries']}"],
+            "pipeline_upstream_failures_total": [f"pipeline_upstream_failures_total{{{labels}}} {snapshot['failures']}"],
+        }
+        samples["pipeline_upstream_rejected_total"] = [
+            f'pipeline_upstream_rejected_total{{{labels},reason="{reason}"}} {count}'
+            for reason, count in snapshot["rejected"].items()
+        ]
+        return samples
@@ -0,0 +1,237 @@
+"""Cache of vector search results shared by every retrieval pipeline."""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from pipeline_core.cache import LRUCache, approx_size
+
+
+def _sizeof(obj: Any) -> int:
+    return len(obj) if isinstance(obj, bytes) else approx_size(obj)
+
+
+def encode_results(results: List[dict]) -> bytes:
+    return zlib.compress(json.dumps(results, separators=(",", ":")).encode("utf-8"), 1)
+
+
+def decode_results(blob: bytes) -> List[dict]:
+    return json.loads(zlib.decompress(blob))
+
+
+class DiskBackend:
+    """SQLite table of encoded results so warm entries survive restarts.
+
+    Rows are keyed on the search URL together with the payload digest, so
+    pipelines searching different databases never read each other's rows.
+    Once closed, lookups miss and writes are dropped, so a search still
+    holding a replaced cache finishes without error.
+    """
+
+    PRUNE_EVERY = 256
+
+    def __init__(self, path: str, max_entries: int = 100_000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._db: Optional[sqlite3.Connection] = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # Tables written before rows were keyed on the URL cannot tell URLs apart; start them over.
+        primary_key = [row[1] for row in self._db.execute("PRAGMA table_info(retrieval_cache)") if row[5]]
+        if primary_key == ["key"]:
+            self._db.execute("DROP TABLE retrieval_cache")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS retrieval_cache ("
+            "url TEXT NOT NULL, key TEXT NOT NULL, expires_at REAL, value BLOB NOT NULL, PRIMARY KEY (url, key))"
+        )
+        self.prune()
+
+    def get(self, url: str, key: str) -> Optional[Tuple[bytes, Optional[float]]]:
+        with self._lock:
+            if self._db is None:
+                return None
+            row = self._db.execute(
+                "SELECT value, expires_at FROM retrieval_cache WHERE url = ? AND key = ?", (url, key)
+            ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        return row[0], row[1]
+
+    def put(self, url: str, key: str, blob: bytes, ttl: Optional[float]):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            if self._db is None:
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO retrieval_cache (url, key, expires_at, value) VALUES (?, ?, ?, ?)",
+                (url, key, expires_at, blob),
+            )
+            self._writes += 1
+            prune = self._writes % self.PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        with self._lock:
+            if self._db is None:
+                return
+            self._db.execute("DELETE FROM retrieval_cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+            self._db.execute(
+                "DELETE FROM retrieval_cache WHERE rowid IN (SELECT rowid FROM retrieval_cache "
+                "ORDER BY COALESCE(expires_at, 1e300) DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def invalidate(self, url: Optional[str] = None):
+        with self._lock:
+            if self._db is None:
+                return
+            if url is None:
+                self._db.execute("DELETE FROM retrieval_cache")
+            else:
+                self._db.execute("DELETE FROM retrieval_cache WHERE url = ?", (url,))
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class RetrievalCache:
+    """LRU/TTL cache of parsed search `results`, optionally backed by SQLite.
+
+    Entries are keyed on the search URL, the request payload (query text and
+    any search parameters) and the index version, and stored as compressed
+    compact JSON so the byte budget holds many more result sets. Every hit
+    decodes a fresh copy, so callers may mutate what they get back.
+    """
+
+    _shared: Dict[tuple, "RetrievalCache"] = {}
+    _owners: Dict[str, tuple] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(
+        self,
+        max_entries: int = 4096,
+        ttl: Optional[float] = 600.0,
+        max_bytes: Optional[int] = 64 * 1024 * 1024,
+        disk_path: str = "",
+        disk_max_entries: int = 100_000,
+    ):
+        self.ttl = ttl
+        self.memory = LRUCache(max_entries=max_entries, ttl=ttl, max_bytes=max_bytes, sizeof=_sizeof)
+        self.disk = DiskBackend(disk_path, disk_max_entries) if disk_path else None
+        self.disk_hits = 0
+
+    @classmethod
+    def shared(
+        cls,
+        max_entries: int,
+        ttl: Optional[float],
+        max_bytes: Optional[int],
+        disk_path: str = "",
+        disk_max_entries: int = 100_000,
+        owner: str = "",
+    ) -> "RetrievalCache":
+        """Process-wide instance per configuration, so pipelines share entries.
+
+        `owner` (the pipeline) is moved off the instance it used before; one
+        no owner uses any more is dropped and its SQLite file closed.
+        """
+        config = (max_entries, ttl, max_bytes, disk_path, disk_max_entries)
+        with cls._shared_lock:
+            stale = cls._leave(owner) if cls._owners.get(owner) != config else []
+            cache = cls._shared.get(config)
+            if cache is None:
+                cache = cls._shared[config] = cls(*config)
+            cls._owners[owner] = config
+        for old in stale:
+            old.close()
+        return cache
+
+    @classmethod
+    def release(cls, owner: str = ""):
+        """Stop sharing on behalf of `owner`, closing what nobody uses."""
+        with cls._shared_lock:
+            stale = cls._leave(owner)
+        for old in stale:
+            old.close()
+
+    @classmethod
+    def _leave(cls, owner: str) -> List["RetrievalCache"]:
+        # Caller holds _shared_lock; returns instances left without owners.
+        config = cls._owners.pop(owner, None)
+        if config is None or config in cls._owners.values():
+            return []
+        cache = cls._shared.pop(config, None)
+        return [cache] if cache is not None else []
+
+    @classmethod
+    def from_valves(cls, valves, owner: str = "") -> Optional["RetrievalCache"]:
+        if not valves.RETRIEVAL_CACHE_ENABLED:
+            cls.release(owner)
+            return None
+        return cls.shared(
+            valves.RETRIEVAL_CACHE_MAX_ENTRIES,
+            valves.RETRIEVAL_CACHE_TTL,
+            valves.RETRIEVAL_CACHE_MAX_BYTES,
+            valves.RETRIEVAL_CACHE_DISK_PATH,
+            valves.RETRIEVAL_CACHE_DISK_MAX_ENTRIES,
+            owner=owner,
+        )
+
+    @staticmethod
+    def key(url: str, payload: dict, index_version: str = "") -> Tuple[str, str]:
+        canonical = json.dumps([payload, index_version], sort_keys=True, separators=(",", ":"))
+        return url, hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, url: str, payload: dict, index_version: str = "") -> Optional[List[dict]]:
+        key = self.key(url, payload, index_version)
+        blob = self.memory.get(key)
+        if blob is None and self.disk is not None:
+            stored = self.disk.get(*key)
+            if stored is not None:
+                blob, expires_at = stored
+                remaining = expires_at - time.time() if expires_at is not None else None
+                self.memory.set(key, blob, ttl=remaining)
+                self.disk_hits += 1
+        return decode_results(blob) if blob is not None else None
+
+    def put(self, url: str, payload: dict, results: List[dict], index_version: str = ""):
+        key = self.key(url, payload, index_version)
+        blob = encode_results(results)
+        self.memory.set(key, blob)
+        if self.disk is not None:
+            self.disk.put(*key, blob, self.ttl)
+
+    def invalidate(self, url: Optional[str] = None):
+        """Drop cached results for `url` (or everything), e.g. after a reindex."""
+        for key in self.memory.keys():
+            if url is None or key[0] == url:
+                self.memory.pop(key)
+        if self.disk is not None:
+            self.disk.invalidate(url)
+
+    def close(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.close()
+
+    def snapshot(self) -> dict:
+        # A disk hit is first recorded as a memory miss.
+        snapshot = self.memory.snapshot()
+        hits = snapshot["hits"] + self.disk_hits
+        misses = snapshot["misses"] - self.disk_hits
+        return {
+            **snapshot,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "disk_hits": self.disk_hits,
+        }
@@ -0,0 +1,126 @@
+"""Two-tier (exact + embedding similarity) cache for LLM query rewrites."""
+
+import re
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from pipeline_core.cache import LRUCache
+
+_WHITESPACE = re.compile(r"\s+")
+_EDGE_PUNCTUATION = " \t\n?!.,;:\"'"
+
+
+def normalize_question(text: str) -> str:
+    """Case-fold, collapse whitespace and trim edge punctuation."""
+    return _WHITESPACE.sub(" ", text.casefold()).strip(_EDGE_PUNCTUATION)
+
+
+class SemanticCache:
+    """Exact-match LRU/TTL tier with an optional cosine-similarity tier.
+
+    The exact tier is keyed on `(model_id, normalize_question(question))`.
+    When callers pass embeddings, each cached entry also owns a row of a
+    fixed `max_entries x dim` matrix, so a near-duplicate question is one
+    matrix-vector product away. Rows are released together with their exact
+    entry, which keeps the similarity tier inside the same entry budget.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 2048,
+        ttl: Optional[float] = 3600.0,
+        max_bytes: Optional[int] = 8 * 1024 * 1024,
+        similarity_threshold: float = 0.92,
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.semantic_hits = 0
+        self.semantic_misses = 0
+        self._lock = threading.RLock()
+        self._exact = LRUCache(max_entries=max_entries, ttl=ttl, max_bytes=max_bytes, on_evict=self._release_row)
+        self._matrix: Optional[np.ndarray] = None
+        self._row_keys: List[Optional[Tuple[str, str]]] = [None] * max_entries
+        self._rows = {}
+        self._free_rows = list(range(max_entries - 1, -1, -1))
+
+    @property
+    def stats(self):
+        return self._exact.stats
+
+    @staticmethod
+    def key(model_id: str, question: str) -> Tuple[str, str]:
+        return (model_id, normalize_question(question))
+
+    def _release_row(self, key):
+        row = self._rows.pop(key, None)
+        if row is not None:
+            self._row_keys[row] = None
+            self._matrix[row] = 0.0
+            self._free_rows.append(row)
+
+    @staticmethod
+    def _unit(embedding: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else vector
+
+    def get(self, model_id: str, question: str) -> Optional[str]:
+        # Always take our lock before the exact tier's so evictions that
+        # release matrix rows keep a single lock order.
+        with self._lock:
+            return self._exact.get(self.key(model_id, question))
+
+    def get_similar(self, model_id: str, embedding: Sequence[float]) -> Optional[str]:
+        with self._lock:
+            if self._matrix is None or not self._rows:
+                self.semantic_misses += 1
+                return None
+            query = self._unit(embedding)
+            if query.shape[0] != self._matrix.shape[1]:
+                self.semantic_misses += 1
+                return None
+            scores = self._matrix @ query
+            for row in np.argsort(scores)[::-1]:
+                key = self._row_keys[row]
+                if scores[row] < self.similarity_threshold:
+                    break
+                if key is None or key[0] != model_id:
+                    continue
+                value = self._exact.peek(key)
+                if value is not None:
+                    self._exact.touch(key)
+                    self.semantic_hits += 1
+                    return value
+            self.semantic_misses += 1
+            return None
+
+    def put(self, model_id: str, question: str, value: str, embedding: Optional[Sequence[float]] = None):
+        key = self.key(model_id, question)
+        with self._lock:
+            self._exact.set(key, value)
+            if embedding is None or key not in self._exact:
+                return
+            vector = self._unit(embedding)
+            if self._matrix is None:
+                self._matrix = np.zeros((len(self._row_keys), vector.shape[0]), dtype=np.float32)
+            elif vector.shape[0] != self._matrix.shape[1]:
+                return
+            row = self._rows.get(key)
+            if row is None:
+                if not self._free_rows:
+                    return
+                row = self._rows[key] = self._free_rows.pop()
+                self._row_keys[row] = key
+            self._matrix[row] = vector
+
+    def clear(self):
+        with self._lock:
+            self._exact.clear()
+
+    def snapshot(self) -> dict:
+        return {
+            **self._exact.snapshot(),
+            "semantic_hits": self.semantic_hits,
+            "semantic_misses": self.semantic_misses,
+        }
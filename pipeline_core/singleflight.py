@@ -0,0 +1,102 @@
+"""Coalescing of identical in-flight upstream calls."""
+
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from pipeline_core.metrics import current_span
+
+
+class _Call:
+    __slots__ = ("future", "waiters", "task")
+
+    def __init__(self):
+        self.future: concurrent.futures.Future = concurrent.futures.Future()
+        self.waiters = 1
+        self.task: Optional[asyncio.Future] = None
+
+
+class SingleFlight:
+    """Lets concurrent callers with the same key share one upstream call.
+
+    The first caller for a key runs the call; callers arriving while it is
+    in flight wait for its result or exception instead of starting their
+    own. Nothing is kept once the call finishes, so this is not a cache.
+
+    `do` is for threads and `ado` for coroutines, and the two share calls:
+    a thread can wait on a call started on the event loop and the other way
+    round. An async call runs as its own task, so one caller hitting its
+    deadline does not cancel it for the others; it is cancelled only when
+    every async caller has given up. `shared` counts the upstream calls
+    saved, and each one is also added to the waiting caller's current span
+    as `coalesced_calls`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.calls = 0
+        self.shared = 0
+
+    def _join(self, key: Hashable) -> Tuple[_Call, bool]:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+                return call, True
+            call.waiters += 1
+            self.shared += 1
+        span = current_span()
+        if span is not None:
+            span.add(coalesced_calls=1)
+        return call, False
+
+    def _finish(self, key: Hashable, call: _Call):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        call, leader = self._join(key)
+        if not leader:
+            return call.future.result()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.future.set_exception(e)
+            raise
+        else:
+            call.future.set_result(result)
+            return result
+        finally:
+            self._finish(key, call)
+
+    async def _arun(self, key: Hashable, call: _Call, fn: Callable[..., Awaitable[Any]], args, kwargs):
+        try:
+            call.future.set_result(await fn(*args, **kwargs))
+        except asyncio.CancelledError:
+            call.future.cancel()
+        except BaseException as e:
+            call.future.set_exception(e)
+        finally:
+            self._finish(key, call)
+
+    async def ado(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        call, leader = self._join(key)
+        if leader:
+            call.task = asyncio.ensure_future(self._arun(key, call, fn, args, kwargs))
+        try:
+            return await asyncio.shield(asyncio.wrap_future(call.future))
+        except asyncio.CancelledError:
+            with self._lock:
+                call.waiters -= 1
+                abandoned = call.waiters == 0
+            if abandoned and call.task is not None:
+                call.task.cancel()
+            raise
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"calls": self.calls, "shared": self.shared, "in_flight": len(self._calls)}
@@ -0,0 +1,130 @@
+"""Incremental parsing of OpenAI-style server-sent event streams.
+
+Both helpers accept the line iterators the HTTP clients already provide
+(`requests.Response.iter_lines()` or `aiohttp` response lines), so nothing is
+buffered beyond the event currently being read.
+"""
+
+import json
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, List, Optional, Union
+
+Line = Union[bytes, str]
+
+DONE = "[DONE]"
+
+
+class _EventBuffer:
+    def __init__(self):
+        self.data: List[str] = []
+
+    def feed(self, line: Line) -> Optional[str]:
+        """Consume one line; return the event data once an event is complete."""
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.rstrip("\r\n")
+        if not line:
+            return self.flush()
+        if line.startswith(":"):
+            return None
+        field, _, value = line.partition(":")
+        if field == "data":
+            self.data.append(value[1:] if value.startswith(" ") else value)
+        return None
+
+    def flush(self) -> Optional[str]:
+        if not self.data:
+            return None
+        data, self.data = "\n".join(self.data), []
+        return data
+
+
+def _delta_content(data: str) -> str:
+    chunk = json.loads(data)
+    choices = chunk.get("choices") or []
+    if not choices:
+        return ""
+    return (choices[0].get("delta") or {}).get("content") or ""
+
+
+def iter_sse_data(lines: Iterable[Line]) -> Iterator[str]:
+    """Yield the `data` payload of each event until the `[DONE]` sentinel."""
+    buffer = _EventBuffer()
+    for line in lines:
+        data = buffer.feed(line)
+        if data is None:
+            continue
+        if data == DONE:
+            return
+        yield data
+    data = buffer.flush()
+    if data is not None and data != DONE:
+        yield data
+
+
+def iter_content_deltas(lines: Iterable[Line]) -> Iterator[str]:
+    """Yield the non-empty `choices[0].delta.content` pieces of a chat stream."""
+    for data in iter_sse_data(lines):
+        content = _delta_content(data)
+        if content:
+            yield content
+
+
+async def aiter_sse_data(lines: AsyncIterable[Line]) -> AsyncIterator[str]:
+    buffer = _EventBuffer()
+    async for line in lines:
+        data = buffer.feed(line)
+        if data is None:
+            continue
+        if data == DONE:
+            return
+        yield data
+    data = buffer.flush()
+    if data is not None and data != DONE:
+        yield data
+
+
+async def aiter_content_deltas(lines: AsyncIterable[Line]) -> AsyncIterator[str]:
+    try:
+        async for data in aiter_sse_data(lines):
+            content = _delta_content(data)
+            if content:
+                yield content
+    finally:
+        aclose = getattr(lines, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+def first_line(deltas: Iterable[str]) -> str:
+    """Join streamed deltas up to the first non-empty line.
+
+    The rewrite prompt asks for a single phrase, so anything the model adds
+    after the first line break is not worth waiting for.
+    """
+    text = ""
+    try:
+        for delta in deltas:
+            text += delta
+            stripped = text.lstrip()
+            if "\n" in stripped:
+                return stripped.split("\n", 1)[0].strip()
+        return text.strip()
+    finally:
+        close = getattr(deltas, "close", None)
+        if close is not None:
+            close()
+
+
+async def afirst_line(deltas: AsyncIterable[str]) -> str:
+    text = ""
+    try:
+        async for delta in deltas:
+            text += delta
+            stripped = text.lstrip()
+            if "\n" in stripped:
+                return stripped.split("\n", 1)[0].strip()
+        return text.strip()
+    finally:
+        aclose = getattr(deltas, "aclose", None)
+        if aclose is not None:
+            await aclose()
@@ -0,0 +1,802 @@
+"""Composable request stages shared by the retrieval pipelines.
+
+A pipeline is a `Chain` of stages run in order over one `Turn`:
+
+    rewrite    question -> search phrasing        RewriteStage
+    retrieve   queries -> ranked hits             RetrieveStage
+    assemble   hits -> prompt context             AssembleStage
+    generate   context -> completion or stream    GenerateStage
+
+`SpeculativeRetrieveStage` overlaps a rewrite with a search of the raw
+question, `RerankStage` rescores the hits before they are assembled, and
+`ReplyStage` answers from the hits without an LLM. Stages keep
+no per-request state; what they share (pooled HTTP clients, caches, indexes,
+metrics) lives on `Services`, built from the pipeline's valves.
+
+Every stage has a blocking `run` for pipelines served from worker threads
+and an `arun` for pipelines on an event loop. The default `arun` calls `run`
+inline, so stages that wait on the network implement both.
+"""
+
+import asyncio
+import json
+import logging
+import weakref
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Generator, List, Optional, Sequence, Union
+
+from pipeline_core.aio import AsyncHTTPPool, aiter_lines
+from pipeline_core.bm25 import BM25Index, open_bm25
+from pipeline_core.chunk_store import ChunkStore, open_chunk_store
+from pipeline_core.context import ContextPacker
+from pipeline_core.event_loop import EventLoopThread
+from pipeline_core.http_pool import HTTPPool, PoolConfig
+from pipeline_core.local_index import LocalSearchClient, build_local_search
+from pipeline_core.metrics import configure_logging, get_metrics, register_family, serve_metrics
+from pipeline_core.model_list import ModelListCache, cache_key, default_cache_path
+from pipeline_core.rerank import Reranker, get_reranker, passage, rerank
+from pipeline_core.resilience import Upstream, UpstreamPolicy
+from pipeline_core.retrieval_cache import RetrievalCache
+from pipeline_core.semantic_cache import SemanticCache, normalize_question
+from pipeline_core.singleflight import SingleFlight
+from pipeline_core.sse import afirst_line, aiter_content_deltas, iter_content_deltas
+from pipeline_core.tokenizer import get_tokenizer
+from pipeline_core.valves import (
+    ContextValves,
+    LLMValves,
+    ModelListValves,
+    RerankValves,
+    RetrievalCacheValves,
+    RewriteValves,
+    VectorSearchValves,
+)
+from pipeline_core.vector_search import VectorSearchClient, reciprocal_rank_fusion, unique_queries
+
+
+def release_on_loop(loop: asyncio.AbstractEventLoop, response):
+    """Release an aiohttp `response` from any thread, unless its loop is gone."""
+    if not loop.is_closed():
+        loop.call_soon_threadsafe(response.release)
+
+
+# Open WebUI request fields the inference server does not accept.
+SCRUBBED_FIELDS = ("user", "chat_id", "title")
+
+# Counters of each cache's `snapshot()` exported as pipeline_cache_<field>_total.
+CACHE_COUNTERS = ("hits", "misses", "evictions")
+for _counter in CACHE_COUNTERS:
+    register_family(f"pipeline_cache_{_counter}_total", "counter", f"Cache {_counter} per pipeline and cache.")
+
+
+def completion_payload(body: dict, model_id: str, content: str) -> dict:
+    """The chat request `body` asking `model_id` a single user message."""
+    payload = {**body, "model": model_id}
+    for key in SCRUBBED_FIELDS:
+        payload.pop(key, None)
+    payload["messages"] = [{"role": "user", "content": content}]
+    payload["stream"] = bool(body.get("stream"))
+    return payload
+
+
+@dataclass
+class Turn:
+    """One request as it moves through the stages."""
+
+    user_message: str
+    model_id: str
+    messages: List[dict]
+    body: dict
+    question: str = ""  # what is searched and asked; the rewrite once there is one
+    results: List[dict] = field(default_factory=list)
+    context: Optional[dict] = None
+    output: Any = None  # what `pipe` returns, set by the last stage
+
+    def __post_init__(self):
+        self.question = self.question or self.user_message
+
+
+class Services:
+    """Clients, caches and indexes shared by a pipeline's stages.
+
+    What gets built follows the valve groups the pipeline's `Valves` mixes
+    in. `start`, `reconfigure` and `close` belong in on_startup,
+    on_valves_updated and on_shutdown; the first two take the pipeline's
+    current valves, since the server replaces the object on every update.
+    """
+
+    def __init__(self, name: str, valves, event_loop: bool = False):
+        self.name = name
+        self.valves = valves
+        self.event_loop = event_loop
+        self.logger = logging.getLogger(name)
+        self.metrics = get_metrics(name)
+        self.http = HTTPPool(PoolConfig.from_valves(valves))
+        self.ahttp = AsyncHTTPPool(PoolConfig.from_valves(valves))
+        # Event loop serving the sync `pipe` wrapper of async pipelines.
+        self.loop = EventLoopThread(name=f"{name}-loop")
+        self.index_version = getattr(valves, "RETRIEVAL_CACHE_INDEX_VERSION", "")
+        self.rewrite_cache: Optional[SemanticCache] = None
+        self.rewrite_cache_config: Optional[tuple] = None
+        self.retrieval_cache: Optional[RetrievalCache] = None
+        self.vector_search: Union[VectorSearchClient, LocalSearchClient, None] = None
+        self.lexical: Optional[BM25Index] = None
+        self.chunks: Optional[ChunkStore] = None
+        # Kept across rebuilds so their counts cover the pipeline's lifetime.
+        self.rewrite_flight = SingleFlight()
+        self.search_flight = SingleFlight()
+        # Deadlines, limits and circuit state per upstream; also kept across rebuilds.
+        self.llm: Optional[Upstream] = None
+        if isinstance(valves, LLMValves):
+            self.llm = Upstream("llm", UpstreamPolicy.for_llm(valves))
+        self.vector_db: Optional[Upstream] = None
+        if isinstance(valves, VectorSearchValves):
+            self.vector_db = Upstream("vector_db", UpstreamPolicy.for_vector_db(valves))
+        self.metrics.add_collector("upstreams", self.upstream_samples)
+        self.metrics.add_collector("caches", self.cache_samples)
+        # Loaded in `start` so the tokenizer and reranker never delay __init__.
+        self._tokenizer = None
+        self._reranker: Optional[Reranker] = None
+        self.build()
+
+        self.model_list: Optional[ModelListCache] = None
+        if isinstance(valves, ModelListValves):
+            # Served from the on-disk copy until the background refresh
+            # started in `start` reaches the inference server.
+            self.model_list = self.build_model_list()
+            self.model_list.load()
+
+    def build(self):
+        if isinstance(self.valves, RewriteValves):
+            # Rebuilt only when its own valves change, so unrelated updates keep warm entries.
+            config = (
+                self.valves.REWRITE_CACHE_MAX_ENTRIES,
+                self.valves.REWRITE_CACHE_TTL,
+                self.valves.REWRITE_CACHE_MAX_BYTES,
+                self.valves.REWRITE_CACHE_SIMILARITY,
+            )
+            if config != self.rewrite_cache_config:
+                max_entries, ttl, max_bytes, similarity_threshold = config
+                self.rewrite_cache = SemanticCache(
+                    max_entries=max_entries,
+                    ttl=ttl,
+                    max_bytes=max_bytes,
+                    similarity_threshold=similarity_threshold,
+                )
+                self.rewrite_cache_config = config
+        if isinstance(self.valves, RetrievalCacheValves):
+            self.refresh_retrieval_cache()
+        if isinstance(self.valves, VectorSearchValves):
+            self.chunks = self.build_chunk_store()
+            previous, self.vector_search = self.vector_search, self.build_vector_search()
+            if isinstance(previous, VectorSearchClient):
+                previous.close()
+            self.lexical = self.build_lexical_index()
+
+    async def start(self, valves):
+        await self.reconfigure(valves)
+        self.http.open()
+        if self.event_loop:
+            self.loop.start()
+
+    async def reconfigure(self, valves):
+        self.valves = valves
+        configure_logging(self.logger, valves.LOG_LEVEL)
+        serve_metrics(valves.METRICS_PORT, valves.METRICS_HOST, owner=self.name)
+        self.http.reconfigure(PoolConfig.from_valves(valves))
+        await self.ahttp.reconfigure(PoolConfig.from_valves(valves))
+        if self.llm is not None:
+            self.llm.configure(UpstreamPolicy.for_llm(valves))
+        if self.vector_db is not None:
+            self.vector_db.configure(UpstreamPolicy.for_vector_db(valves))
+        self.build()
+        # Loading reads files and warms the ONNX session up; keep it off the server's loop.
+        tokenizer = None
+        if isinstance(valves, ContextValves):
+            tokenizer = await asyncio.to_thread(self.load_tokenizer)
+        reranker = None
+        if isinstance(valves, RerankValves) and valves.RERANK_ENABLED:
+            reranker = await asyncio.to_thread(self.load_reranker)
+        self._tokenizer, self._reranker = tokenizer, reranker
+        self.restart_model_list()
+
+    async def close(self):
+        if self.model_list is not None:
+            self.model_list.stop()
+        self.logger.info("HTTP pool: %s, async HTTP pool: %s", self.http.stats.snapshot(), self.ahttp.stats.snapshot())
+        for name, cache in self.caches().items():
+            self.logger.info("Cache %s: %s", name, cache.snapshot())
+        self.logger.info("Coalesced rewrites: %s, searches: %s", self.rewrite_flight.snapshot(), self.search_flight.snapshot())
+        for upstream in self.upstreams():
+            self.logger.info("Upstream %s: %s", upstream.name, upstream.snapshot())
+        serve_metrics(0, owner=self.name)
+        RetrievalCache.release(owner=self.name)
+        if isinstance(self.vector_search, VectorSearchClient):
+            self.vector_search.close()
+        self.http.close()
+        await self.ahttp.close()
+        self.loop.stop()
+
+    def upstreams(self) -> List[Upstream]:
+        return [upstream for upstream in (self.llm, self.vector_db) if upstream is not None]
+
+    def upstream_samples(self) -> dict:
+        samples = {}
+        for upstream in self.upstreams():
+            for family, lines in upstream.prometheus_samples(self.metrics.pipeline).items():
+                samples.setdefault(family, []).extend(lines)
+        return samples
+
+    def caches(self) -> dict:
+        caches = {"rewrite": self.rewrite_cache, "retrieval": self.retrieval_cache, "chunks": self.chunks}
+        return {name: cache for name, cache in caches.items() if cache is not None}
+
+    def cache_samples(self) -> dict:
+        samples = {}
+        for name, cache in self.caches().items():
+            snapshot = cache.snapshot()
+            labels = f'pipeline="{self.metrics.pipeline}",cache="{name}"'
+            for counter in CACHE_COUNTERS:
+                family = f"pipeline_cache_{counter}_total"
+                samples.setdefault(family, []).append(f"{family}{{{labels}}} {snapshot.get(counter, 0)}")
+        return samples
+
+    def refresh_retrieval_cache(self):
+        self.retrieval_cache = RetrievalCache.from_valves(self.valves, owner=self.name)
+        if self.retrieval_cache is not None and self.valves.RETRIEVAL_CACHE_INDEX_VERSION != self.index_version:
+            self.retrieval_cache.invalidate(self.valves.VECTOR_DB_URL)
+        self.index_version = self.valves.RETRIEVAL_CACHE_INDEX_VERSION
+
+    def llm_headers(self) -> dict:
+        return {
+            "Authorization": f"Bearer {self.valves.OPENAI_API_KEY}",
+            "Content-Type": "application/json"
+        }
+
+    def vector_db_headers(self) -> dict:
+        return {
+            "Content-Type": "application/json",
+            "User-Agent": "insomnia/2023.5.8"
+        }
+
+    def build_vector_search(self) -> Union[VectorSearchClient, LocalSearchClient]:
+        if self.valves.VECTOR_BACKEND == "local":
+            has_llm = isinstance(self.valves, LLMValves)
+            try:
+                return build_local_search(
+                    self.valves.LOCAL_INDEX_PATH,
+                    self.valves.EMBEDDING_MODEL,
+                    self.valves.EMBEDDING_API_BASE_URL or (self.valves.OPENAI_API_BASE_URL if has_llm else ""),
+                    self.http,
+                    self.ahttp,
+                    headers=self.llm_headers() if has_llm else None,
+                    top_k=self.valves.LOCAL_INDEX_TOP_K,
+                    nprobe=self.valves.LOCAL_INDEX_NPROBE,
+                )
+            except (OSError, ValueError, KeyError) as e:
+                # Missing, unreadable or malformed: a bad index must not take the pipeline down.
+                self.logger.warning("Local index unavailable, searching %s: %s", self.valves.VECTOR_DB_URL, e)
+        return VectorSearchClient(
+            self.valves.VECTOR_DB_URL,
+            self.http,
+            self.ahttp,
+            batch_url=self.valves.VECTOR_DB_BATCH_URL,
+            cache=self.retrieval_cache,
+            index_version=getattr(self.valves, "RETRIEVAL_CACHE_INDEX_VERSION", ""),
+            max_concurrency=self.valves.VECTOR_DB_MAX_CONCURRENCY,
+            headers=self.vector_db_headers(),
+            flight=self.search_flight if self.valves.COALESCE_REQUESTS else None,
+            upstream=self.vector_db,
+            chunks=self.chunks,
+        )
+
+    def build_chunk_store(self) -> Optional[ChunkStore]:
+        if not self.valves.CHUNK_STORE_PATH:
+            return None
+        try:
+            chunks = open_chunk_store(self.valves.CHUNK_STORE_PATH)
+        except OSError as e:
+            self.logger.warning("Chunk store unavailable, asking %s for full hits: %s", self.valves.VECTOR_DB_URL, e)
+            return None
+        chunks.resize_cache(self.valves.CHUNK_CACHE_MAX_ENTRIES)
+        return chunks
+
+    def build_lexical_index(self) -> Optional[BM25Index]:
+        if not self.valves.HYBRID_BM25:
+            return None
+        try:
+            return open_bm25(self.valves.BM25_INDEX_PATH or self.valves.LOCAL_INDEX_PATH)
+        except OSError as e:
+            self.logger.warning("BM25 index unavailable, using vector search only: %s", e)
+            return None
+
+    def load_tokenizer(self):
+        return get_tokenizer(self.valves.TOKENIZER_ID or self.valves.MODEL_ID)
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            self._tokenizer = self.load_tokenizer()
+        return self._tokenizer
+
+    def load_reranker(self) -> Reranker:
+        return get_reranker(self.valves.RERANK_MODEL, self.valves.RERANK_MAX_LENGTH, self.valves.RERANK_THREADS)
+
+    @property
+    def reranker(self) -> Reranker:
+        if self._reranker is None:
+            self._reranker = self.load_reranker()
+        return self._reranker
+
+    def build_model_list(self) -> ModelListCache:
+        return ModelListCache(
+            self.get_openai_models,
+            self.valves.MODEL_LIST_CACHE_PATH or default_cache_path(self.name),
+            key=cache_key(self.valves.OPENAI_API_BASE_URL, self.valves.OPENAI_API_KEY),
+            ttl=self.valves.MODEL_LIST_TTL,
+        )
+
+    def restart_model_list(self):
+        if self.model_list is None:
+            return
+        self.model_list.stop()
+        self.model_list = self.build_model_list()
+        self.model_list.load()
+        self.model_list.start()
+
+    def pipelines(self) -> List[dict]:
+        if not self.model_list.models and self.model_list.last_error:
+            return [
+                {
+                    "id": "error",
+                    "name": "Could not fetch models from OpenAI, please update the API Key in the valves.",
+                },
+            ]
+        return self.model_list.models
+
+    def get_openai_models(self) -> List[dict]:
+        if not self.valves.OPENAI_API_KEY:
+            return []
+        with self.metrics.stage("model_list"):
+            response = self.http.get(
+                f"{self.valves.OPENAI_API_BASE_URL}/models",
+                headers=self.llm_headers(),
+                timeout=(self.valves.HTTP_CONNECT_TIMEOUT, self.valves.MODEL_LIST_TIMEOUT),
+            )
+            response.raise_for_status()
+
+            models = response.json()
+            return [
+                {
+                    "id": model["id"],
+                    "name": model["name"] if "name" in model else model["id"],
+                }
+                for model in models["data"]
+            ]
+
+
+class Stage:
+    name = "stage"
+
+    def run(self, turn: Turn, services: Services):
+        raise NotImplementedError
+
+    async def arun(self, turn: Turn, services: Services):
+        self.run(turn, services)
+
+
+class Chain:
+    """Stages run in order over one turn; returns the turn's output."""
+
+    def __init__(self, *stages: Stage):
+        self.stages = list(stages)
+
+    def run(self, turn: Turn, services: Services) -> Any:
+        for stage in self.stages:
+            stage.run(turn, services)
+        return turn.output
+
+    async def arun(self, turn: Turn, services: Services) -> Any:
+        for stage in self.stages:
+            await stage.arun(turn, services)
+        return turn.output
+
+
+class RetrieveStage(Stage):
+    """Searches for the turn's question, plus the raw user message with
+    `multi_query`. Hits of several queries, and BM25 hits when the
+    pipeline has a lexical index, are fused by reciprocal rank. When the
+    vector search fails, the turn goes on with the BM25 hits alone, or with
+    no context."""
+
+    name = "retrieval"
+
+    def __init__(self, multi_query: bool = False):
+        self.multi_query = multi_query
+
+    def queries(self, turn: Turn) -> List[str]:
+        extra = [turn.user_message] if self.multi_query else []
+        return unique_queries([turn.question, *extra]) or [turn.question]
+
+    def lexical_search(self, queries: Sequence[str], services: Services) -> List[List[dict]]:
+        if services.lexical is None:
+            return []
+        return [services.lexical.search(query, services.valves.BM25_TOP_K) for query in queries]
+
+    def degrade(self, error: Exception, span, services: Services):
+        span.fail(error)
+        span.attributes["degraded"] = True
+        services.logger.warning("Vector search failed, continuing without its hits: %s", error)
+
+    def search(self, queries: List[str], services: Services) -> List[dict]:
+        with services.metrics.stage(self.name, queries=len(queries)) as span:
+            lexical = self.lexical_search(queries, services)
+            try:
+                if len(queries) == 1 and not lexical:
+                    return services.vector_search.search(queries[0])
+                vector = services.vector_search.search_many(queries)
+            except Exception as e:
+                self.degrade(e, span, services)
+                vector = []
+            return reciprocal_rank_fusion(vector + lexical, k=services.valves.RRF_K)
+
+    async def asearch(self, queries: List[str], services: Services) -> List[dict]:
+        with services.metrics.stage(self.name, queries=len(queries)) as span:
+            lexical = self.lexical_search(queries, services)
+            try:
+                if len(queries) == 1 and not lexical:
+                    return await services.vector_search.asearch(queries[0])
+                vector = await services.vector_search.asearch_many(queries)
+            except Exception as e:
+                self.degrade(e, span, services)
+                vector = []
+            return reciprocal_rank_fusion(vector + lexical, k=services.valves.RRF_K)
+
+    def run(self, turn: Turn, services: Services):
+        turn.results = self.search(self.queries(turn), services)
+
+    async def arun(self, turn: Turn, services: Services):
+        turn.results = await self.asearch(self.queries(turn), services)
+
+
+class RewriteStage(Stage):
+    """Rephrases the question for search with the LLM, behind the rewrite cache.
+
+    `prompt` is formatted with the user's `question`. A question whose BM25
+    confidence reaches `lexical_confidence` already singles out a document
+    and is searched as asked. A failed rewrite keeps the original question.
+    """
+
+    name = "rewrite"
+
+    def __init__(self, prompt: str, lexical_confidence: float = 0.0):
+        self.prompt = prompt
+        self.lexical_confidence = lexical_confidence
+
+    def skips(self, turn: Turn, services: Services) -> bool:
+        if services.lexical is None or self.lexical_confidence <= 0:
+            return False
+        with services.metrics.stage("lexical_probe") as span:
+            confidence = services.lexical.confidence(turn.user_message)
+            span.attributes["confidence"] = round(confidence, 3)
+        return confidence >= self.lexical_confidence
+
+    def payload(self, turn: Turn, services: Services) -> dict:
+        return {
+            "messages": [{"role": "user", "content": self.prompt.format(question=turn.user_message)}],
+            "model": turn.model_id,
+            "stream": services.valves.STREAM_REWRITE,
+        }
+
+    async def aexternal_llm(self, turn: Turn, services: Services) -> str:
+        payload = self.payload(turn, services)
+
+        async def request() -> str:
+            async with services.ahttp.session.post(
+                f"{services.valves.OPENAI_API_BASE_URL}/chat/completions",
+                json=payload,
+                headers=services.llm_headers(),
+                timeout=services.llm.client_timeout,
+            ) as response:
+                response.raise_for_status()
+                if payload.get("stream"):
+                    return await afirst_line(aiter_content_deltas(response.content))
+                data = await response.json(content_type=None)
+            return data["choices"][0]["message"]["content"]
+
+        try:
+            return await services.llm.acall(request)
+        except Exception as e:
+            return f"Error: {e}"
+
+    async def aembed(self, text: str, services: Services) -> Optional[List[float]]:
+        payload = {"model": services.valves.REWRITE_CACHE_EMBEDDING_MODEL, "input": text}
+
+        async def request() -> List[float]:
+            async with services.ahttp.session.post(
+                f"{services.valves.OPENAI_API_BASE_URL}/embeddings",
+                json=payload,
+                headers=services.llm_headers(),
+                timeout=services.llm.client_timeout,
+            ) as response:
+                response.raise_for_status()
+                data = await response.json(content_type=None)
+            return data["data"][0]["embedding"]
+
+        try:
+            return await services.llm.acall(request)
+        except Exception as e:
+            services.logger.warning("Error embedding query: %s", e)
+            return None
+
+    async def arewrite(self, turn: Turn, services: Services) -> str:
+        with services.metrics.stage(self.name) as span:
+            fine_tuned_message = await self._acached_rewrite(turn, services, span)
+            if fine_tuned_message.startswith("Error:"):
+                span.error = fine_tuned_message
+            return fine_tuned_message
+
+    async def acoalesced_llm(self, turn: Turn, services: Services) -> str:
+        # Concurrent requests for the same question, as the rewrite cache
+        # keys it, share one `aexternal_llm` call.
+        if not services.valves.COALESCE_REQUESTS:
+            return await self.aexternal_llm(turn, services)
+        key = (turn.model_id, normalize_question(turn.user_message), services.valves.STREAM_REWRITE)
+        return await services.rewrite_flight.ado(key, self.aexternal_llm, turn, services)
+
+    async def _acached_rewrite(self, turn: Turn, services: Services, span) -> str:
+        # `aexternal_llm` behind the rewrite cache: a hit skips the LLM call.
+        if not services.valves.REWRITE_CACHE_ENABLED:
+            return await self.acoalesced_llm(turn, services)
+
+        cache = services.rewrite_cache
+        cached = cache.get(turn.model_id, turn.user_message)
+        if cached is not None:
+            span.attributes["cache"] = "exact"
+            return cached
+
+        embedding = None
+        if services.valves.REWRITE_CACHE_EMBEDDING_MODEL:
+            embedding = await self.aembed(turn.user_message, services)
+            if embedding is not None:
+                cached = cache.get_similar(turn.model_id, embedding)
+                if cached is not None:
+                    span.attributes["cache"] = "semantic"
+                    cache.put(turn.model_id, turn.user_message, cached)
+                    return cached
+
+        span.attributes["cache"] = "miss"
+
+        fine_tuned_message = await self.acoalesced_llm(turn, services)
+        if not fine_tuned_message.startswith("Error:"):
+            cache.put(turn.model_id, turn.user_message, fine_tuned_message, embedding)
+        return fine_tuned_message
+
+    async def arun(self, turn: Turn, services: Services):
+        if self.skips(turn, services):
+            return
+        fine_tuned_message = await self.arewrite(turn, services)
+        if not fine_tuned_message.startswith("Error:"):
+            turn.question = fine_tuned_message
+        services.logger.debug("Fine-tuned message: %s", turn.question)
+
+    def run(self, turn: Turn, services: Services):
+        services.loop.run(self.arun(turn, services))
+
+
+class SpeculativeRetrieveStage(Stage):
+    """Rewrite and retrieval with the raw-question search started up front.
+
+    The raw question is searched while the rewrite is in flight and the
+    rewrite's hits are fused in afterwards. A rewrite slower than `deadline`
+    seconds is cancelled and the raw-question hits are used on their own.
+    """
+
+    name = "speculative_retrieval"
+
+    def __init__(self, rewrite: RewriteStage, retrieve: RetrieveStage, deadline: float):
+        self.rewrite = rewrite
+        self.retrieve = retrieve
+        self.deadline = deadline
+
+    async def arun(self, turn: Turn, services: Services):
+        if self.rewrite.skips(turn, services):
+            await self.retrieve.arun(turn, services)
+            return
+
+        user_message = turn.user_message
+        raw_search = asyncio.create_task(self.retrieve.asearch([user_message], services))
+        rewrite = asyncio.create_task(self.rewrite.arewrite(turn, services))
+
+        try:
+            fine_tuned_message = await asyncio.wait_for(rewrite, self.deadline)
+        except asyncio.TimeoutError:
+            services.logger.info("Rewrite exceeded %ss, using the raw question", self.deadline)
+            fine_tuned_message = None
+        except BaseException:
+            raw_search.cancel()
+            raise
+
+        raw_results = await raw_search
+        if not fine_tuned_message or fine_tuned_message.startswith("Error:"):
+            turn.results = raw_results
+            return
+
+        turn.question = fine_tuned_message
+        services.logger.debug("Fine-tuned message: %s", fine_tuned_message)
+        results = raw_results
+        if fine_tuned_message.strip() != user_message.strip():
+            rewrite_results = await self.retrieve.asearch([fine_tuned_message], services)
+            results = reciprocal_rank_fusion([rewrite_results, raw_results], k=services.valves.RRF_K)
+        turn.results = results
+
+    def run(self, turn: Turn, services: Services):
+        services.loop.run(self.arun(turn, services))
+
+
+class RerankStage(Stage):
+    """Rescores the first RERANK_TOP_N hits against the user's question and
+    keeps the best RERANK_TOP_K, when RERANK_ENABLED.
+
+    All candidates go through the reranker as one batch. When its measured
+    cost per pair says N would overrun RERANK_BUDGET_MS, fewer are scored,
+    never below K; hits come best-first from retrieval, so the tail is cut.
+    With `reorder_only` no hit is dropped and the top retrieved hit stays
+    first, so an `AssembleStage` packing the top hit's article packs the one
+    retrieval ranked first; the scores only order its chunks for the budget.
+    The async path scores on a worker thread to keep the event loop free.
+    """
+
+    name = "rerank"
+
+    def __init__(self, reorder_only: bool = False):
+        self.reorder_only = reorder_only
+
+    def run(self, turn: Turn, services: Services):
+        valves = services.valves
+        if not valves.RERANK_ENABLED or len(turn.results) < 2:
+            return
+        reranker = services.reranker
+        top_n = valves.RERANK_TOP_N
+        capacity = reranker.capacity(valves.RERANK_BUDGET_MS / 1000)
+        if capacity:
+            top_n = min(top_n, max(capacity, valves.RERANK_TOP_K))
+        candidates = turn.results[:top_n]
+        with services.metrics.stage(self.name, candidates=len(candidates), reranker=reranker.name) as span:
+            if self.reorder_only:
+                scores = reranker.score(turn.user_message, [passage(hit) for hit in candidates])
+                scored = [{**hit, "rerank_score": float(score)} for hit, score in zip(candidates, scores)]
+                ranked = sorted(scored[1:], key=lambda hit: hit["rerank_score"], reverse=True)
+                turn.results = scored[:1] + ranked + turn.results[top_n:]
+            else:
+                turn.results = rerank(reranker, turn.user_message, candidates, valves.RERANK_TOP_K)
+            span.attributes["kept"] = len(turn.results)
+
+    async def arun(self, turn: Turn, services: Services):
+        if services.valves.RERANK_ENABLED and len(turn.results) > 1:
+            await asyncio.to_thread(self.run, turn, services)
+
+
+class AssembleStage(Stage):
+    """Packs the hits into the prompt context; options go to `ContextPacker`."""
+
+    name = "context_assembly"
+
+    def __init__(self, **packer_options):
+        self.packer_options = packer_options
+
+    def run(self, turn: Turn, services: Services):
+        packer = ContextPacker(services.valves.CONTEXT_TOKEN_BUDGET, services.tokenizer, **self.packer_options)
+        with services.metrics.stage(self.name) as span:
+            packed = packer.pack(turn.results)
+            span.add(tokens=packed.packed_tokens)
+            span.attributes.update(dropped_tokens=packed.dropped_tokens, dropped_chunks=packed.dropped_chunks)
+        services.logger.debug("Packed context: %s", packed.stats())
+        turn.context = packed.as_context()
+        if services.logger.isEnabledFor(logging.DEBUG):
+            services.logger.debug("Retrieved context: %s", json.dumps(turn.context, indent=2))
+
+
+class GenerateStage(Stage):
+    """Asks the model the message `prompt(turn)` builds; a streamed answer
+    is forwarded as content deltas and a failure is returned as an
+    "Error: ..." string."""
+
+    name = "completion"
+
+    def __init__(self, prompt: Callable[[Turn], str]):
+        self.prompt = prompt
+
+    def payload(self, turn: Turn) -> dict:
+        return completion_payload(turn.body, turn.model_id, self.prompt(turn))
+
+    def stream_content(self, response) -> Generator[str, None, None]:
+        try:
+            yield from iter_content_deltas(response.iter_lines())
+        finally:
+            response.close()
+
+    async def astream_content(self, response) -> AsyncIterator[str]:
+        # Released however the stream ends: drained, failed, or closed early by the caller.
+        async with response:
+            async for content in aiter_content_deltas(aiter_lines(response)):
+                yield content
+
+    def run(self, turn: Turn, services: Services):
+        payload = self.payload(turn)
+        services.logger.debug("Payload: %s", payload)
+
+        def request():
+            response = services.http.post(
+                f"{services.valves.OPENAI_API_BASE_URL}/chat/completions",
+                json=payload,
+                headers=services.llm_headers(),
+                stream=True,
+                timeout=services.llm.timeout,
+            )
+            response.raise_for_status()
+            return response
+
+        with services.metrics.stage(self.name) as span:
+            try:
+                # The concurrency slot covers the request up to the response
+                # headers; a stream then drains on the server's schedule.
+                response = services.llm.call(request)
+
+                if turn.body.get("stream"):
+                    turn.output = services.metrics.drain(self.stream_content(response))
+                else:
+                    data = response.json()
+                    span.add(tokens=(data.get("usage") or {}).get("completion_tokens", 0))
+                    turn.output = data
+            except Exception as e:
+                span.fail(e)
+                turn.output = f"Error: {e}"
+
+    async def arun(self, turn: Turn, services: Services):
+        payload = self.payload(turn)
+        services.logger.debug("Payload: %s", payload)
+
+        async def request():
+            response = await services.ahttp.session.post(
+                f"{services.valves.OPENAI_API_BASE_URL}/chat/completions",
+                json=payload,
+                headers=services.llm_headers(),
+                timeout=services.llm.client_timeout,
+            )
+            try:
+                response.raise_for_status()
+            except Exception:
+                response.release()
+                raise
+            return response
+
+        with services.metrics.stage(self.name) as span:
+            try:
+                response = await services.llm.acall(request)
+
+                if turn.body.get("stream"):
+                    turn.output = services.metrics.adrain(self.astream_content(response))
+                    # A stream dropped before its first item never runs its own
+                    # cleanup; release the connection when it is collected.
+                    weakref.finalize(turn.output, release_on_loop, asyncio.get_running_loop(), response)
+                else:
+                    async with response:
+                        data = await response.json(content_type=None)
+                    span.add(tokens=(data.get("usage") or {}).get("completion_tokens", 0))
+                    turn.output = data
+            except Exception as e:
+                span.fail(e)
+                turn.output = f"Error: {e}"
+
+
+class ReplyStage(Stage):
+    """Answers with `reply(turn)`, for pipelines that return retrieved text
+    without asking a model."""
+
+    name = "reply"
+
+    def __init__(self, reply: Callable[[Turn], Any]):
+        self.reply = reply
+
+    def run(self, turn: Turn, services: Services):
+        turn.output = self.reply(turn)
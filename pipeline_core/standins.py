@@ -0,0 +1,295 @@
+"""Local stand-ins for the vector search service and the OpenAI-compatible
+inference server, for tests and benchmarks.
+
+    python -m pipeline_core.standins --port 5000 --openai-port 8000
+
+serves `/search` (`{"query": ...}` -> `{"results": [...]}`) and
+`/search/batch` (`{"queries": [...]}` -> `{"results": [[...], ...]}`) over a
+small in-memory corpus, ranking documents by term overlap with the query,
+and `/v1/models` and `/v1/chat/completions` on the second port.
+"""
+
+import argparse
+import collections
+import json
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Sequence
+
+_TOKEN = re.compile(r"\w+")
+
+SAMPLE_CORPUS = [
+    {"id": "madonna-0", "document": "Madonna Louise Ciccone was born on August 16, 1958, in Bay City, Michigan.", "metadata": {"title": "Madonna", "url": "https://en.wikipedia.org/wiki/Madonna", "chunk": 0}},
+    {"id": "madonna-1", "document": "Madonna is an American singer, songwriter and actress, referred to as the Queen of Pop.", "metadata": {"title": "Madonna", "url": "https://en.wikipedia.org/wiki/Madonna", "chunk": 1}},
+    {"id": "python-0", "document": "Python is a high-level, general-purpose programming language created by Guido van Rossum.", "metadata": {"title": "Python (programming language)", "url": "https://en.wikipedia.org/wiki/Python_(programming_language)", "chunk": 0}},
+    {"id": "python-1", "document": "Python was first released in 1991 and emphasizes code readability.", "metadata": {"title": "Python (programming language)", "url": "https://en.wikipedia.org/wiki/Python_(programming_language)", "chunk": 1}},
+    {"id": "eiffel-0", "document": "The Eiffel Tower is a wrought-iron lattice tower on the Champ de Mars in Paris, France.", "metadata": {"title": "Eiffel Tower", "url": "https://en.wikipedia.org/wiki/Eiffel_Tower", "chunk": 0}},
+    {"id": "eiffel-1", "document": "The Eiffel Tower was completed in 1889 as the centrepiece of the World's Fair.", "metadata": {"title": "Eiffel Tower", "url": "https://en.wikipedia.org/wiki/Eiffel_Tower", "chunk": 1}},
+]
+
+
+def _terms(text: str) -> set:
+    return set(_TOKEN.findall(text.lower()))
+
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients that stop reading early, like a rewrite cut at its first
+        # line, or close idle keep-alive connections are not server errors.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _StandInServer:
+    """Threaded HTTP server run in the background; subclasses answer
+    requests in `do_GET` and `do_POST`."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self._server = _QuietHTTPServer((host, port), self._handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def do_GET(self, handler):
+        handler.reply(404, {"error": "not found"})
+
+    def do_POST(self, handler, body: dict):
+        handler.reply(404, {"error": "not found"})
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                server.do_GET(self)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                server.do_POST(self, json.loads(self.rfile.read(length) or b"{}"))
+
+            def reply(self, status: int, obj: dict):
+                data = json.dumps(obj).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def start_chunked(self, content_type: str):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+            def write_chunk(self, data: bytes):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class StandInSearchServer(_StandInServer):
+    """Threaded HTTP search server over `corpus`, started in the background.
+
+    `latency` seconds are slept before every response to mimic a remote
+    service; set `batch=False` to emulate a server without `/search/batch`.
+    A payload with `"fields"` gets only those fields of each hit, as asked
+    for by clients that read the text from a chunk store. The bodies of the
+    last `record` search requests are kept in `search_requests`.
+    """
+
+    def __init__(
+        self,
+        corpus: Optional[List[dict]] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        top_k: int = 5,
+        latency: float = 0.0,
+        batch: bool = True,
+        record: int = 256,
+    ):
+        self.corpus = corpus if corpus is not None else SAMPLE_CORPUS
+        self.top_k = top_k
+        self.latency = latency
+        self.batch = batch
+        self.requests = 0
+        self.search_requests = collections.deque(maxlen=record)
+        self._doc_terms = [_terms(doc["metadata"].get("title", "") + " " + doc["document"]) for doc in self.corpus]
+        super().__init__(host, port)
+
+    @property
+    def url(self) -> str:
+        return f"{self.base_url}/search"
+
+    @property
+    def batch_url(self) -> str:
+        return f"{self.base_url}/search/batch"
+
+    def search(self, query: str) -> List[dict]:
+        terms = _terms(query)
+        scored = [
+            (len(terms & doc_terms) / (len(doc_terms) or 1), i)
+            for i, doc_terms in enumerate(self._doc_terms)
+            if terms & doc_terms
+        ]
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [
+            {
+                "document": self.corpus[i]["document"],
+                "metadata": {**self.corpus[i]["metadata"], "id": self.corpus[i]["id"]},
+                "score": score,
+            }
+            for score, i in scored[: self.top_k]
+        ]
+
+    def project(self, hits: List[dict], fields: Optional[List[str]]) -> List[dict]:
+        """Only `fields` of each hit, with `id` taken from its metadata."""
+        if not fields:
+            return hits
+        return [{field: hit["metadata"]["id"] if field == "id" else hit.get(field) for field in fields} for hit in hits]
+
+    def do_POST(self, handler, body: dict):
+        self.requests += 1
+        self.search_requests.append(body)
+        if self.latency:
+            time.sleep(self.latency)
+        fields = body.get("fields")
+        if handler.path == "/search":
+            handler.reply(200, {"results": self.project(self.search(body.get("query", "")), fields)})
+        elif handler.path == "/search/batch" and self.batch:
+            handler.reply(200, {"results": [self.project(self.search(query), fields) for query in body.get("queries", [])]})
+        else:
+            handler.reply(404, {"error": "not found"})
+
+
+class StandInOpenAIServer(_StandInServer):
+    """OpenAI-compatible `/v1/models` and `/v1/chat/completions`.
+
+    A completion echoes the text after the last ": " of the last message,
+    which for the prompts these pipelines send is the user's question, so a
+    rewrite comes back unchanged. `latency` seconds pass before the first
+    byte and `token_latency` between streamed words. The bodies of the last
+    `record` completion requests are kept in `chat_requests`.
+    """
+
+    def __init__(
+        self,
+        models: Sequence[str] = ("standin",),
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        token_latency: float = 0.0,
+        record: int = 256,
+    ):
+        self.models = list(models)
+        self.latency = latency
+        self.token_latency = token_latency
+        self.requests = 0
+        self.chat_requests = collections.deque(maxlen=record)
+        super().__init__(host, port)
+
+    @property
+    def api_url(self) -> str:
+        return f"{self.base_url}/v1"
+
+    def reply_text(self, messages: List[dict]) -> str:
+        content = messages[-1].get("content", "") if messages else ""
+        if not isinstance(content, str):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        return content.rsplit(": ", 1)[-1].strip()
+
+    def do_GET(self, handler):
+        if handler.path.endswith("/models"):
+            handler.reply(200, {"object": "list", "data": [{"id": model, "object": "model"} for model in self.models]})
+        else:
+            handler.reply(404, {"error": "not found"})
+
+    def do_POST(self, handler, body: dict):
+        if not handler.path.endswith("/chat/completions"):
+            handler.reply(404, {"error": "not found"})
+            return
+        self.requests += 1
+        self.chat_requests.append(body)
+        if self.latency:
+            time.sleep(self.latency)
+        text = self.reply_text(body.get("messages", []))
+        model = body.get("model", self.models[0])
+        if not body.get("stream"):
+            message = {"role": "assistant", "content": text}
+            handler.reply(200, {"object": "chat.completion", "model": model, "choices": [{"index": 0, "message": message, "finish_reason": "stop"}]})
+            return
+        handler.start_chunked("text/event-stream")
+        for i, word in enumerate(text.split(" ")):
+            if i and self.token_latency:
+                time.sleep(self.token_latency)
+            delta = {"content": word if i == 0 else f" {word}"}
+            chunk = {"object": "chat.completion.chunk", "model": model, "choices": [{"index": 0, "delta": delta}]}
+            handler.write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        handler.write_chunk(b"data: [DONE]\n\n")
+        handler.write_chunk(b"")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--corpus", help="JSON list of {id, document, metadata} records")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--openai-port", type=int, help="also serve the OpenAI-compatible API on this port")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds before the first completion byte")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds between streamed words")
+    args = parser.parse_args()
+
+    corpus = None
+    if args.corpus:
+        with open(args.corpus) as f:
+            corpus = json.load(f)
+    servers = [StandInSearchServer(corpus, args.host, args.port, args.top_k, args.latency)]
+    print(f"Serving {servers[0].url} and {servers[0].batch_url}")
+    if args.openai_port is not None:
+        servers.append(StandInOpenAIServer(
+            host=args.host, port=args.openai_port, latency=args.llm_latency, token_latency=args.token_latency,
+        ))
+        print(f"Serving {servers[1].api_url}")
+    for server in servers[1:]:
+        server.start()
+    try:
+        servers[0]._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            server._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Local token counting, loaded once per tokenizer id.
+
+`get_tokenizer` tries, in order, a Hugging Face `tokenizers` tokenizer (a
+`tokenizer.json` file, or a directory holding one), a `tiktoken` encoding for
+the name whose BPE file is already in tiktoken's local cache, and finally a
+character-based estimate. Nothing is downloaded: loading runs on the request
+path, where a hub or blob-store round trip would stall it. The backends are
+optional imports so pipelines keep working without them, just with
+approximate counts.
+"""
+
+import functools
+import hashlib
+import logging
+import os
+import tempfile
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+TIKTOKEN_BLOBS = "https://openaipublic.blob.core.windows.net/encodings"
+# BPE file each tiktoken encoding is built from.
+TIKTOKEN_FILES = {
+    "r50k_base": "r50k_base",
+    "p50k_base": "p50k_base",
+    "p50k_edit": "p50k_base",
+    "cl100k_base": "cl100k_base",
+    "o200k_base": "o200k_base",
+    "o200k_harmony": "o200k_base",
+}
+
+
+def approx_tokens(text: str) -> int:
+    """Cheap token estimate (about four characters per token)."""
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text: str, budget: int, count_tokens: Callable[[str], int] = approx_tokens) -> str:
+    """Longest prefix of `text`, cut at a word boundary, within `budget` tokens."""
+    if count_tokens(text) <= budget:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[:middle]) <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    prefix = text[:low]
+    cut = prefix.rfind(" ")
+    return prefix[:cut] if cut > 0 else prefix
+
+
+class ApproxTokenizer:
+    name = "approx"
+
+    def count(self, text: str) -> int:
+        return approx_tokens(text)
+
+    def truncate(self, text: str, budget: int) -> str:
+        return truncate_to_tokens(text, budget, approx_tokens)
+
+
+class _EncodingTokenizer:
+    """Shared logic for backends exposing encode/decode of token ids."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = functools.lru_cache(maxsize=8192)(self._count)
+
+    def _count(self, text: str) -> int:
+        return len(self.encode(text))
+
+    def truncate(self, text: str, budget: int) -> str:
+        ids = self.encode(text)
+        if len(ids) <= budget:
+            return text
+        return self.decode(ids[:max(budget, 0)])
+
+
+class HFTokenizer(_EncodingTokenizer):
+    def __init__(self, name: str):
+        from tokenizers import Tokenizer
+
+        super().__init__(name)
+        path = os.path.join(name, "tokenizer.json") if os.path.isdir(name) else name
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"no tokenizer.json at {name!r}")
+        self._tokenizer = Tokenizer.from_file(path)
+
+    def encode(self, text: str) -> list:
+        return self._tokenizer.encode(text, add_special_tokens=False).ids
+
+    def decode(self, ids: list) -> str:
+        return self._tokenizer.decode(ids)
+
+
+def tiktoken_cache_path(encoding: str) -> str:
+    """Where tiktoken caches the BPE file of `encoding` once fetched."""
+    cache_dir = os.environ.get("TIKTOKEN_CACHE_DIR", os.environ.get("DATA_GYM_CACHE_DIR"))
+    if cache_dir is None:
+        cache_dir = os.path.join(tempfile.gettempdir(), "data-gym-cache")
+    if not cache_dir or encoding not in TIKTOKEN_FILES:
+        return ""
+    blob = f"{TIKTOKEN_BLOBS}/{TIKTOKEN_FILES[encoding]}.tiktoken"
+    return os.path.join(cache_dir, hashlib.sha1(blob.encode()).hexdigest())
+
+
+class TiktokenTokenizer(_EncodingTokenizer):
+    def __init__(self, name: str):
+        import tiktoken
+        from tiktoken.model import encoding_name_for_model
+
+        super().__init__(name)
+        encoding = encoding_name_for_model(name)
+        path = tiktoken_cache_path(encoding)
+        if not path or not os.path.isfile(path):
+            raise FileNotFoundError(f"{encoding} is not in the local tiktoken cache; set TIKTOKEN_CACHE_DIR")
+        self._encoding = tiktoken.get_encoding(encoding)
+
+    def encode(self, text: str) -> list:
+        return self._encoding.encode(text, disallowed_special=())
+
+    def decode(self, ids: list) -> str:
+        return self._encoding.decode(ids)
+
+
+@functools.lru_cache(maxsize=8)
+def get_tokenizer(name: str):
+    """Return the best available tokenizer for `name`, cached per name."""
+    if name:
+        errors = []
+        for backend in (HFTokenizer, TiktokenTokenizer):
+            try:
+                return backend(name)
+            except Exception as e:
+                errors.append(f"{backend.__name__}: {e}")
+        logger.warning("No local tokenizer for %r, estimating token counts (%s)", name, "; ".join(errors))
+    return ApproxTokenizer()
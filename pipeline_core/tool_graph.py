@@ -0,0 +1,105 @@
+"""LangGraph pieces of the tool-calling pipelines.
+
+This module imports `langgraph` and `langchain_core` at import time, so
+pipelines import it on first use rather than at module load; a server that
+loads the pipeline but never routes a chat to it does not pay for them.
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Callable, Sequence
+
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.graph import MessagesState, START, StateGraph
+from langgraph.prebuilt import ToolNode, tools_condition
+
+
+class ToolLoopState(MessagesState):
+    steps: int  # reasoner calls so far in this run
+    deadline: float  # wall-clock time after which the run is cut short
+    transcript: str  # transcript_digest of the chat as the server will send it next turn
+
+
+def transcript_digest(messages: Sequence) -> str:
+    """Digest of the role and text of each message, to tell a chat resumed
+    as it was left from one whose earlier messages were edited or
+    regenerated."""
+    digest = hashlib.sha1()
+    for message in messages:
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        digest.update(json.dumps([message.type, content.strip()]).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class BoundedMemorySaver(InMemorySaver):
+    """In-memory checkpointer holding only the latest checkpoint of recent chats.
+
+    Resuming a chat needs nothing but its newest checkpoint, so older ones
+    and the blobs they alone referenced are dropped on every put. Once more
+    than `max_threads` chats are resident the least recently used is evicted;
+    its next turn is re-seeded from the history the server sends.
+    """
+
+    def __init__(self, max_threads: int = 256):
+        super().__init__()
+        self.max_threads = max_threads
+        self._recent: "OrderedDict[str, None]" = OrderedDict()
+        self._recent_lock = threading.Lock()
+
+    def _touch(self, thread_id: str):
+        with self._recent_lock:
+            self._recent[thread_id] = None
+            self._recent.move_to_end(thread_id)
+            evicted = []
+            while len(self._recent) > max(1, self.max_threads):
+                evicted.append(self._recent.popitem(last=False)[0])
+        for stale in evicted:
+            super().delete_thread(stale)
+
+    def get_tuple(self, config):
+        thread_id = config["configurable"]["thread_id"]
+        if thread_id in self.storage:
+            self._touch(thread_id)
+        return super().get_tuple(config)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        saved = super().put(config, checkpoint, metadata, new_versions)
+        thread_id = saved["configurable"]["thread_id"]
+        checkpoint_ns = saved["configurable"]["checkpoint_ns"]
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        for checkpoint_id in [key for key in checkpoints if key != checkpoint["id"]]:
+            del checkpoints[checkpoint_id]
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+        live = {(thread_id, checkpoint_ns, channel, version) for channel, version in checkpoint["channel_versions"].items()}
+        for key in [key for key in self.blobs if key[:2] == (thread_id, checkpoint_ns) and key not in live]:
+            del self.blobs[key]
+        self._touch(thread_id)
+        return saved
+
+    def delete_thread(self, thread_id: str):
+        with self._recent_lock:
+            self._recent.pop(thread_id, None)
+        super().delete_thread(thread_id)
+
+
+def compile_tool_graph(reasoner: Callable, tools: Sequence, checkpointer):
+    """The reasoner -> tools loop over `ToolLoopState`, checkpointed per chat."""
+    builder = StateGraph(ToolLoopState)
+
+    # Add nodes
+    builder.add_node("reasoner", reasoner)
+    builder.add_node("tools", ToolNode(tools))  # for the tools
+
+    # Add edges
+    builder.add_edge(START, "reasoner")
+    builder.add_conditional_edges(
+        "reasoner",
+        # If the latest message (result) from node reasoner is a tool call -> tools_condition routes to tools
+        # If the latest message (result) from node reasoner is a not a tool call -> tools_condition routes to END
+        tools_condition,
+    )
+    builder.add_edge("tools", "reasoner")
+
+    return builder.compile(checkpointer=checkpointer)
@@ -0,0 +1,99 @@
+"""Tool execution for agent pipelines: per-tool deadlines, concurrency limits
+and memoized results."""
+
+import asyncio
+import contextlib
+import json
+import weakref
+from typing import Any, Callable, Dict, List, Optional
+
+from pipeline_core.cache import LRUCache
+from pipeline_core.metrics import Metrics, register_family
+
+_MISSING = object()
+
+register_family("pipeline_tool_cache_hits_total", "counter", "Tool calls answered from the tool's result cache.")
+register_family("pipeline_tool_cache_misses_total", "counter", "Tool calls not found in the tool's result cache.")
+register_family("pipeline_tool_cache_hit_ratio", "gauge", "Share of a tool's cached lookups that were hits.")
+
+
+def canonical_args(kwargs: dict) -> str:
+    """Order-independent key for a tool call's arguments."""
+    return json.dumps(kwargs, sort_keys=True, separators=(",", ":"), default=str)
+
+
+class ToolRunner:
+    """Runs blocking tool functions off the event loop under per-tool limits.
+
+    Each tool name gets its own semaphore, so a slow search cannot starve the
+    arithmetic tools, and every call is bounded by `timeout`. A call that
+    times out returns an error string the model can read; its worker thread
+    is left to finish in the background.
+
+    Tools registered with `memoize` answer repeated calls with the same
+    arguments from a per-tool LRU, without taking a slot or a thread. Only
+    successful results are stored.
+    """
+
+    def __init__(self, timeout: float = 30.0, max_concurrency: int = 4, metrics: Optional[Metrics] = None):
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.metrics = metrics
+        # Semaphores belong to the loop they were made on; the pipeline's
+        # loop is replaced on restart, so each loop gets its own set.
+        self._slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self.caches: Dict[str, LRUCache] = {}
+
+    def memoize(self, name: str, max_entries: int = 1024, ttl: Optional[float] = None):
+        """Cache results of tool `name`; pure tools pass no `ttl`."""
+        self.caches[name] = LRUCache(max_entries=max_entries, ttl=ttl)
+
+    def cache_stats(self) -> Dict[str, dict]:
+        return {name: cache.snapshot() for name, cache in self.caches.items()}
+
+    def prometheus_samples(self, pipeline: str) -> Dict[str, List[str]]:
+        samples: Dict[str, List[str]] = {}
+        for name, snapshot in self.cache_stats().items():
+            labels = f'pipeline="{pipeline}",tool="{name}"'
+            for family, value in (
+                ("pipeline_tool_cache_hits_total", snapshot["hits"]),
+                ("pipeline_tool_cache_misses_total", snapshot["misses"]),
+                ("pipeline_tool_cache_hit_ratio", snapshot["hit_rate"]),
+            ):
+                samples.setdefault(family, []).append(f"{family}{{{labels}}} {value}")
+        return samples
+
+    def slots(self, name: str) -> asyncio.Semaphore:
+        loop_slots = self._slots.setdefault(asyncio.get_running_loop(), {})
+        slots = loop_slots.get(name)
+        if slots is None:
+            slots = loop_slots[name] = asyncio.Semaphore(max(1, self.max_concurrency))
+        return slots
+
+    def _stage(self, name: str):
+        if self.metrics is None:
+            return contextlib.nullcontext()
+        return self.metrics.stage("tool", tool=name)
+
+    async def arun(self, name: str, fn: Callable[..., Any], kwargs: dict) -> Any:
+        cache = self.caches.get(name)
+        key = canonical_args(kwargs) if cache is not None else None
+        with self._stage(name) as span:
+            if cache is not None:
+                result = cache.get(key, _MISSING)
+                if span is not None:
+                    span.attributes["cache"] = "miss" if result is _MISSING else "hit"
+                if result is not _MISSING:
+                    return result
+            async with self.slots(name):
+                try:
+                    result = await asyncio.wait_for(asyncio.to_thread(fn, **kwargs), self.timeout)
+                except asyncio.TimeoutError as e:
+                    if span is not None:
+                        span.fail(e)
+                    return f"Error: `{name}` timed out after {self.timeout:g}s"
+            if cache is not None:
+                cache.set(key, result)
+            return result
@@ -0,0 +1,101 @@
+"""Valve groups shared by the retrieval pipelines.
+
+A pipeline's `Valves` mixes in the groups it uses and adds its own fields:
+
+    class Valves(LLMValves, HTTPValves, VectorSearchValves, ObservabilityValves):
+        MY_SETTING: bool = True
+
+`stages.Services` builds the clients and caches for the groups present.
+"""
+
+from pydantic import BaseModel
+
+
+class LLMValves(BaseModel):
+    OPENAI_API_BASE_URL: str = "http://192.168.88.193:8000/v1"
+    OPENAI_API_KEY: str = ""
+    MODEL_ID: str = "qwen32b-coder"
+    LLM_MAX_CONCURRENCY: int = 32  # LLM calls in flight at once; 0 is unbounded
+
+
+class HTTPValves(BaseModel):
+    HTTP_POOL_CONNECTIONS: int = 10
+    HTTP_POOL_MAXSIZE: int = 10  # kept-alive connections per upstream host
+    HTTP_POOL_BLOCK: bool = False
+    HTTP_KEEP_ALIVE: bool = True
+    HTTP_CONNECT_TIMEOUT: float = 5.0
+    HTTP_READ_TIMEOUT: float = 120.0
+    COALESCE_REQUESTS: bool = True  # identical concurrent rewrites and searches share one upstream call
+    UPSTREAM_QUEUE_LIMIT: int = 64  # calls waiting past an upstream's concurrency limit; more fail fast
+    UPSTREAM_QUEUE_TIMEOUT: float = 10.0
+    CIRCUIT_FAILURE_THRESHOLD: int = 5  # consecutive upstream failures that stop calls to it; 0 never stops
+    CIRCUIT_RESET_SECONDS: float = 30.0  # wait before probing a stopped upstream again
+
+
+class RewriteValves(BaseModel):
+    STREAM_REWRITE: bool = True  # stream the rewrite and stop at its first line
+    REWRITE_CACHE_ENABLED: bool = True
+    REWRITE_CACHE_MAX_ENTRIES: int = 2048
+    REWRITE_CACHE_TTL: float = 3600.0
+    REWRITE_CACHE_MAX_BYTES: int = 8 * 1024 * 1024
+    REWRITE_CACHE_EMBEDDING_MODEL: str = ""  # set to enable the similarity tier
+    REWRITE_CACHE_SIMILARITY: float = 0.92
+
+
+class RetrievalCacheValves(BaseModel):
+    RETRIEVAL_CACHE_ENABLED: bool = True
+    RETRIEVAL_CACHE_MAX_ENTRIES: int = 4096
+    RETRIEVAL_CACHE_TTL: float = 600.0
+    RETRIEVAL_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    RETRIEVAL_CACHE_DISK_PATH: str = ""  # SQLite file; empty keeps the cache in memory only
+    RETRIEVAL_CACHE_DISK_MAX_ENTRIES: int = 100_000  # rows kept in the SQLite file
+    RETRIEVAL_CACHE_INDEX_VERSION: str = ""  # change after rebuilding the index
+
+
+class VectorSearchValves(BaseModel):
+    VECTOR_DB_URL: str = "http://192.168.88.23:5000/search"
+    VECTOR_DB_BATCH_URL: str = ""  # empty sends one request per query, concurrently
+    RRF_K: int = 60
+    VECTOR_DB_CONNECT_TIMEOUT: float = 2.0
+    VECTOR_DB_READ_TIMEOUT: float = 10.0
+    VECTOR_DB_MAX_CONCURRENCY: int = 32  # searches in flight at once; 0 is unbounded
+    VECTOR_DB_RETRIES: int = 2  # repeats of a search that hit a connection error, timeout or 5xx
+    VECTOR_DB_RETRY_BACKOFF: float = 0.1  # base of the jittered exponential backoff, in seconds
+    VECTOR_BACKEND: str = "remote"  # "local" searches LOCAL_INDEX_PATH in-process instead of VECTOR_DB_URL
+    LOCAL_INDEX_PATH: str = ""  # directory from `python -m pipeline_core.local_index build`
+    LOCAL_INDEX_TOP_K: int = 5
+    LOCAL_INDEX_NPROBE: int = 8  # IVF lists scanned per query, when the index has them; at least 1
+    EMBEDDING_API_BASE_URL: str = ""  # OpenAI-compatible /embeddings host; empty uses OPENAI_API_BASE_URL
+    EMBEDDING_MODEL: str = ""  # empty uses the model the index was built with
+    HYBRID_BM25: bool = False  # fuse BM25 keyword hits into every search
+    BM25_INDEX_PATH: str = ""  # directory from `python -m pipeline_core.bm25 build`; empty uses LOCAL_INDEX_PATH
+    BM25_TOP_K: int = 5
+    CHUNK_STORE_PATH: str = ""  # directory from `python -m pipeline_core.chunk_store build`; searches then return ids and scores only
+    CHUNK_CACHE_MAX_ENTRIES: int = 4096  # decoded chunks kept in memory
+
+
+class RerankValves(BaseModel):
+    RERANK_ENABLED: bool = False  # rescore the retrieved hits before they reach the prompt
+    RERANK_MODEL: str = ""  # cross-encoder directory with model.onnx and tokenizer.json; empty reranks by term overlap
+    RERANK_TOP_N: int = 20  # hits scored; retrieve at least this many for reranking to pay off
+    RERANK_TOP_K: int = 5  # best hits kept
+    RERANK_BUDGET_MS: float = 50.0  # fewer hits are scored when N would take longer; 0 scores all N
+    RERANK_MAX_LENGTH: int = 256  # tokens per question and passage pair
+    RERANK_THREADS: int = 0  # onnxruntime intra-op threads; 0 uses its default
+
+
+class ContextValves(BaseModel):
+    CONTEXT_TOKEN_BUDGET: int = 6000  # tokens of retrieved text in the prompt
+    TOKENIZER_ID: str = ""  # tokenizer.json file or directory, or a tiktoken model name; empty uses MODEL_ID
+
+
+class ObservabilityValves(BaseModel):
+    LOG_LEVEL: str = "WARNING"  # DEBUG logs payloads and retrieved context
+    METRICS_PORT: int = 0  # serve Prometheus /metrics on this port when set
+    METRICS_HOST: str = "127.0.0.1"  # interface the metrics port listens on; 0.0.0.0 for all
+
+
+class ModelListValves(BaseModel):
+    MODEL_LIST_CACHE_PATH: str = ""  # JSON file; empty uses ~/.cache/pipelines/<pipeline>-models.json
+    MODEL_LIST_TTL: float = 300.0  # seconds between background refreshes
+    MODEL_LIST_TIMEOUT: float = 5.0
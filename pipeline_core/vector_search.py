@@ -0,0 +1,262 @@
+"""Vector DB search client with multi-query batching and rank fusion."""
+
+import asyncio
+import copy
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+from pipeline_core.aio import AsyncHTTPPool
+from pipeline_core.chunk_store import ChunkStore
+from pipeline_core.http_pool import HTTPPool
+from pipeline_core.resilience import Upstream
+from pipeline_core.retrieval_cache import RetrievalCache
+from pipeline_core.singleflight import SingleFlight
+
+DEFAULT_HEADERS = {
+    "Content-Type": "application/json",
+    "User-Agent": "insomnia/2023.5.8"
+}
+
+# Hit fields asked for when the text comes from a local chunk store.
+COMPACT_FIELDS = ["id", "score"]
+
+
+def hit_id(hit: dict) -> str:
+    """Stable document id of a search hit, used to deduplicate across queries."""
+    metadata = hit.get("metadata") or {}
+    for field in ("id", "doc_id", "chunk_id"):
+        value = hit.get(field, metadata.get(field))
+        if value is not None:
+            return str(value)
+    digest = hashlib.sha1(f"{metadata.get('title', '')}\0{hit.get('document', '')}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def reciprocal_rank_fusion(result_lists: Sequence[List[dict]], k: int = 60, limit: Optional[int] = None) -> List[dict]:
+    """Merge ranked hit lists, scoring each document by sum(1 / (k + rank)).
+
+    Hits are deduplicated by `hit_id`; the first occurrence is kept and gets
+    the fused score under `rrf_score`.
+    """
+    scores: Dict[str, float] = {}
+    hits: Dict[str, dict] = {}
+    for results in result_lists:
+        for rank, hit in enumerate(results, start=1):
+            doc_id = hit_id(hit)
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+            hits.setdefault(doc_id, hit)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    if limit is not None:
+        ranked = ranked[:limit]
+    return [{**hits[doc_id], "rrf_score": scores[doc_id]} for doc_id in ranked]
+
+
+def unique_queries(queries: Sequence[str]) -> List[str]:
+    seen = set()
+    unique = []
+    for query in queries:
+        query = (query or "").strip()
+        if query and query not in seen:
+            seen.add(query)
+            unique.append(query)
+    return unique
+
+
+class VectorSearchClient:
+    """Searches `url` with `{"query": ...}` payloads, one or many at a time.
+
+    Several queries are sent as one `{"queries": [...]}` POST to `batch_url`
+    when the server has a batch endpoint (answering `{"results": [[...], ...]}`
+    in query order), and as concurrent single requests otherwise. Results go
+    through the shared retrieval cache per query, so only misses hit the wire.
+    With a `flight`, identical single-query searches already in flight, from
+    this request or a concurrent one, share one POST; each caller gets its
+    own copy of the hits. Concurrent single requests run on the client's
+    thread pool, `max_concurrency` wide (0 takes the executor's default),
+    which `close` shuts down. With an `upstream`, POSTs take its deadlines,
+    concurrency limit, retries and circuit breaker; non-2xx answers raise.
+    With `chunks`, payloads ask for `"fields": ["id", "score"]` and the text
+    of each hit is read from the local chunk store; servers that ignore
+    `fields` still work, as full hits pass through.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        http: HTTPPool,
+        ahttp: Optional[AsyncHTTPPool] = None,
+        batch_url: str = "",
+        cache: Optional[RetrievalCache] = None,
+        index_version: str = "",
+        max_concurrency: int = 8,
+        headers: Optional[dict] = None,
+        flight: Optional[SingleFlight] = None,
+        upstream: Optional[Upstream] = None,
+        chunks: Optional[ChunkStore] = None,
+    ):
+        self.url = url
+        self.http = http
+        self.ahttp = ahttp
+        self.batch_url = batch_url
+        self.cache = cache
+        self.index_version = index_version
+        self.max_concurrency = max_concurrency
+        self.headers = headers or DEFAULT_HEADERS
+        self.flight = flight
+        self.upstream = upstream
+        self.chunks = chunks
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._closed = False
+
+    def close(self):
+        with self._executor_lock:
+            self._closed = True
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            # Searches already submitted finish; their callers are still waiting.
+            executor.shutdown(wait=False)
+
+    def _map_searches(self, queries: List[str]) -> List[List[dict]]:
+        with self._executor_lock:
+            if self._closed:
+                # Replaced by a rebuild while this request was running.
+                return [self._search(query) for query in queries]
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_concurrency if self.max_concurrency > 0 else None,
+                    thread_name_prefix="vector-search",
+                )
+            # `map` submits every query before returning, so a `close` after
+            # the lock is released cannot reject them.
+            searches = self._executor.map(self._search, queries)
+        return list(searches)
+
+    def _payload(self, query: str) -> dict:
+        if self.chunks is None:
+            return {"query": query}
+        return {"query": query, "fields": COMPACT_FIELDS}
+
+    def _batch_payload(self, queries: List[str]) -> dict:
+        if self.chunks is None:
+            return {"queries": queries}
+        return {"queries": queries, "fields": COMPACT_FIELDS}
+
+    def _resolve(self, results: List[dict]) -> List[dict]:
+        # Cached and coalesced results stay compact; text is filled in per caller.
+        if self.chunks is None:
+            return results
+        return self.chunks.resolve(results)
+
+    def _cached(self, payload: dict) -> Optional[List[dict]]:
+        if self.cache is None:
+            return None
+        return self.cache.get(self.url, payload, self.index_version)
+
+    def _store(self, payload: dict, results: List[dict]):
+        if self.cache is not None:
+            self.cache.put(self.url, payload, results, self.index_version)
+
+    def _split_cached(self, queries: List[str]):
+        results: List[Optional[List[dict]]] = [self._cached(self._payload(query)) for query in queries]
+        missing = [i for i, hit in enumerate(results) if hit is None]
+        return results, missing
+
+    def _flight_key(self, query: str):
+        return (self.url, self.index_version, query)
+
+    def _post(self, url: str, payload: dict) -> dict:
+        if self.upstream is None:
+            return self.http.post(url, json=payload, headers=self.headers).json()
+
+        def post() -> dict:
+            response = self.http.post(url, json=payload, headers=self.headers, timeout=self.upstream.timeout)
+            response.raise_for_status()
+            return response.json()
+
+        return self.upstream.call(post)
+
+    async def _apost(self, url: str, payload: dict) -> dict:
+        if self.upstream is None:
+            async with self.ahttp.session.post(url, json=payload, headers=self.headers) as response:
+                return await response.json(content_type=None)
+
+        async def post() -> dict:
+            async with self.ahttp.session.post(
+                url, json=payload, headers=self.headers, timeout=self.upstream.client_timeout
+            ) as response:
+                response.raise_for_status()
+                return await response.json(content_type=None)
+
+        return await self.upstream.acall(post)
+
+    def _fetch(self, payload: dict) -> List[dict]:
+        results = self._post(self.url, payload).get('results', [])
+        self._store(payload, results)
+        return results
+
+    def _search(self, query: str) -> List[dict]:
+        payload = self._payload(query)
+        results = self._cached(payload)
+        if results is None:
+            if self.flight is None:
+                return self._fetch(payload)
+            # Coalesced callers share one result object.
+            results = copy.deepcopy(self.flight.do(self._flight_key(query), self._fetch, payload))
+        return results
+
+    def search(self, query: str) -> List[dict]:
+        return self._resolve(self._search(query))
+
+    def search_many(self, queries: Sequence[str]) -> List[List[dict]]:
+        queries = list(queries)
+        results, missing = self._split_cached(queries)
+        if not missing:
+            return [self._resolve(hits) for hits in results]
+        if self.batch_url:
+            payload = self._batch_payload([queries[i] for i in missing])
+            for i, hits in zip(missing, self._post(self.batch_url, payload).get('results', [])):
+                results[i] = hits
+                self._store(self._payload(queries[i]), hits)
+        elif len(missing) == 1:
+            results[missing[0]] = self._search(queries[missing[0]])
+        else:
+            for i, hits in zip(missing, self._map_searches([queries[i] for i in missing])):
+                results[i] = hits
+        return [self._resolve(hits or []) for hits in results]
+
+    async def _afetch(self, payload: dict) -> List[dict]:
+        results = (await self._apost(self.url, payload)).get('results', [])
+        self._store(payload, results)
+        return results
+
+    async def _asearch(self, query: str) -> List[dict]:
+        payload = self._payload(query)
+        results = self._cached(payload)
+        if results is None:
+            if self.flight is None:
+                return await self._afetch(payload)
+            results = copy.deepcopy(await self.flight.ado(self._flight_key(query), self._afetch, payload))
+        return results
+
+    async def asearch(self, query: str) -> List[dict]:
+        return self._resolve(await self._asearch(query))
+
+    async def asearch_many(self, queries: Sequence[str]) -> List[List[dict]]:
+        queries = list(queries)
+        results, missing = self._split_cached(queries)
+        if not missing:
+            return [self._resolve(hits) for hits in results]
+        if self.batch_url:
+            payload = self._batch_payload([queries[i] for i in missing])
+            data = await self._apost(self.batch_url, payload)
+            for i, hits in zip(missing, data.get('results', [])):
+                results[i] = hits
+                self._store(self._payload(queries[i]), hits)
+        else:
+            fetched = await asyncio.gather(*(self._asearch(queries[i]) for i in missing))
+            for i, hits in zip(missing, fetched):
+                results[i] = hits
+        return [self._resolve(hits or []) for hits in results]
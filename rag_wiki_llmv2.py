@@ -1,24 +1,49 @@
 from typing import List, Union, Generator, Iterator
 from pydantic import BaseModel
 import os
-import requests
-import json
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))  # shared pipeline_core package
+
+from pipeline_core.stages import AssembleStage, Chain, GenerateStage, RerankStage, RetrieveStage, Services, Turn
+from pipeline_core.valves import (
+    ContextValves,
+    HTTPValves,
+    LLMValves,
+    ModelListValves,
+    ObservabilityValves,
+    RerankValves,
+    RetrievalCacheValves,
+    VectorSearchValves,
+)
+
+
+def completion_prompt(turn: Turn) -> str:
+    # Construct the final question with the retrieved context
+    return f"Context: {turn.context['document']}\nQuestion: {turn.user_message}"
+
 
 class OpenAIChatMessage(BaseModel):
     role: str
     content: str
 
 class Pipeline:
-    class Valves(BaseModel):
-        OPENAI_API_BASE_URL: str = "http://192.168.88.193:8000/v1"
-        OPENAI_API_KEY: str = ""
-        VECTOR_DB_URL: str = "http://192.168.88.23:5000/search"
-        MODEL_ID: str = "qwen32b-coder"  # Added model_id as a variable
+    class Valves(
+        LLMValves,
+        HTTPValves,
+        RetrievalCacheValves,
+        VectorSearchValves,
+        RerankValves,
+        ContextValves,
+        ObservabilityValves,
+        ModelListValves,
+    ):
+        pass
 
     def __init__(self):
         self.type = "manifold"
         self.name = "OpenAI Pipeline with Vector Database"
-        
+
         self.valves = self.Valves(
             OPENAI_API_KEY=os.getenv(
                 "OPENAI_API_KEY", "your-openai-api-key-here"
@@ -29,119 +54,42 @@ class Pipeline:
             VECTOR_DB_URL="http://192.168.88.23:5000/search"
         )
 
-        self.pipelines = self.get_openai_models()
+        self.services = Services(__name__, self.valves)
+        self.metrics = self.services.metrics
+        # Only the best hit goes into the prompt.
+        self.chain = Chain(
+            RetrieveStage(),
+            RerankStage(),
+            AssembleStage(group_by_title=False, max_chunks=1),
+            GenerateStage(completion_prompt),
+        )
 
     async def on_startup(self):
         print(f"on_startup:{__name__}")
+        # Saved valves may have replaced the defaults since __init__.
+        await self.services.start(self.valves)
 
     async def on_shutdown(self):
         print(f"on_shutdown:{__name__}")
+        await self.services.close()
 
     async def on_valves_updated(self):
         print(f"on_valves_updated:{__name__}")
-        self.pipelines = self.get_openai_models()
-
-    def get_openai_models(self):
-        if self.valves.OPENAI_API_KEY:
-            try:
-                headers = {
-                    "Authorization": f"Bearer {self.valves.OPENAI_API_KEY}",
-                    "Content-Type": "application/json"
-                }
-
-                response = requests.get(
-                    f"{self.valves.OPENAI_API_BASE_URL}/models", headers=headers
-                )
-
-                models = response.json()
-                return [
-                    {
-                        "id": model["id"],
-                        "name": model["name"] if "name" in model else model["id"],
-                    }
-                    for model in models["data"]
-                ]
-
-            except Exception as e:
-                print(f"Error fetching models: {e}")
-                return [
-                    {
-                        "id": "error",
-                        "name": "Could not fetch models from OpenAI, please update the API Key in the valves.",
-                    },
-                ]
-        else:
-            return []
+        await self.services.reconfigure(self.valves)
+
+    @property
+    def pipelines(self) -> List[dict]:
+        return self.services.pipelines()
 
     def query_vector_database(self, user_message: str) -> dict:
-        headers = {
-            "Content-Type": "application/json",
-            "User-Agent": "insomnia/2023.5.8"
-        }
-        payload = {"query": user_message}
-
-        response = requests.post(self.valves.VECTOR_DB_URL, json=payload, headers=headers)
-        results = response.json().get('results', [])
-
-        if results:
-            first_result = results[0]
-            document = first_result.get('document', "No information found")
-            metadata = first_result.get('metadata', {})
-            return {
-                "document": document,
-                "metadata": metadata
-            }
-        else:
-            return {
-                "document": "No information found",
-                "metadata": {}
-            }
+        # Kept from before the stages for callers that search outside a chat turn.
+        turn = Turn(user_message, self.valves.MODEL_ID, [], {})
+        for stage in self.chain.stages[:-1]:
+            stage.run(turn, self.services)
+        return turn.context
 
     def pipe(
         self, user_message: str, model_id: str, messages: List[dict], body: dict
     ) -> Union[str, Generator, Iterator]:
-        print(f"pipe:{__name__}")
-
-        print(messages)
-        print(user_message)
-
-        # Query the vector database to get context
-        context = self.query_vector_database(user_message)
-        print(f"Retrieved context: {json.dumps(context, indent=2)}")
-
-        headers = {
-            "Authorization": f"Bearer {self.valves.OPENAI_API_KEY}",
-            "Content-Type": "application/json"
-        }
-
-        payload = {**body, "model": model_id}
-
-        if "user" in payload:
-            del payload["user"]
-        if "chat_id" in payload:
-            del payload["chat_id"]
-        if "title" in payload:
-            del payload["title"]
-
-        # Construct the final question with the retrieved context
-        final_question = f"Context: {context['document']}\nQuestion: {user_message}"
-        payload["messages"] = [{"role": "user", "content": final_question}]
-
-        print(payload)
-
-        try:
-            response = requests.post(
-                f"{self.valves.OPENAI_API_BASE_URL}/chat/completions",
-                json=payload,
-                headers=headers,
-                stream=True,
-            )
-
-            response.raise_for_status()
-
-            if body.get("stream"):
-                return response.iter_lines()
-            else:
-                return response.json()
-        except Exception as e:
-            return f"Error: {e}"
+        with self.metrics.stage("pipe"):
+            return self.chain.run(Turn(user_message, model_id, messages, body), self.services)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The pipelines import `pipeline_core` from the directory they are served from.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
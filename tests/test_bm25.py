@@ -0,0 +1,72 @@
+import math
+from collections import Counter
+
+import pytest
+
+from pipeline_core.bm25 import BM25Index, open_bm25, tokenize
+from pipeline_core.standins import SAMPLE_CORPUS
+from pipeline_core.vector_search import reciprocal_rank_fusion
+
+RECORDS = [{"document": doc["document"], "metadata": {**doc["metadata"], "id": doc["id"]}} for doc in SAMPLE_CORPUS]
+
+
+@pytest.fixture
+def index(tmp_path) -> BM25Index:
+    return BM25Index.build(str(tmp_path), RECORDS)
+
+
+def reference_scores(query, k1=1.2, b=0.75):
+    documents = [Counter(tokenize(record["document"])) for record in RECORDS]
+    avgdl = sum(sum(doc.values()) for doc in documents) / len(documents)
+    scores = []
+    for doc in documents:
+        score = 0.0
+        for term in dict.fromkeys(tokenize(query)):
+            df = sum(term in other for other in documents)
+            if not doc[term]:
+                continue
+            idf = math.log1p((len(documents) - df + 0.5) / (df + 0.5))
+            tf = doc[term]
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * sum(doc.values()) / avgdl))
+        scores.append(score)
+    return scores
+
+
+def test_tokenize_drops_stopwords_and_case():
+    assert tokenize("Where was the Eiffel Tower BUILT?") == ["eiffel", "tower", "built"]
+
+
+def test_scores_match_okapi_bm25(index):
+    query = "Madonna born Michigan tower"
+    assert index.scores(query).tolist() == pytest.approx(reference_scores(query), rel=1e-5)
+
+
+def test_search_returns_matching_rows_best_first(index):
+    hits = index.search("Madonna Bay City Michigan", k=3)
+    assert hits[0]["metadata"]["id"] == "madonna-0"
+    assert all(hit["bm25_score"] > 0 for hit in hits)
+    assert [hit["bm25_score"] for hit in hits] == sorted((hit["bm25_score"] for hit in hits), reverse=True)
+
+
+def test_query_of_unknown_or_stop_words_finds_nothing(index):
+    assert index.search("what is it") == []
+    assert index.search("zyxwv") == []
+    assert index.confidence("zyxwv") == 0.0
+
+
+def test_confidence_is_higher_for_a_decisive_match(index):
+    decisive = index.confidence("Ciccone Bay City Michigan")
+    vague = index.confidence("Madonna zyxwv qwerty")
+    assert 0.0 <= vague < decisive <= 1.0
+
+
+def test_open_bm25_is_shared(index, tmp_path):
+    assert open_bm25(str(tmp_path)) is open_bm25(str(tmp_path))
+
+
+def test_fusion_ranks_hits_found_by_both_retrievers_first():
+    vector = [{"document": "a", "metadata": {"id": "a"}}, {"document": "b", "metadata": {"id": "b"}}]
+    lexical = [{"document": "b", "metadata": {"id": "b"}}, {"document": "c", "metadata": {"id": "c"}}]
+    fused = reciprocal_rank_fusion([vector, lexical], k=60)
+    assert [hit["metadata"]["id"] for hit in fused] == ["b", "a", "c"]
+    assert fused[0]["rrf_score"] == pytest.approx(1 / 62 + 1 / 61)
@@ -0,0 +1,54 @@
+from pipeline_core.chunk_store import ChunkStore, chunk_id, open_chunk_store
+
+RECORDS = [
+    {"id": "madonna-0", "document": "Madonna was born in Bay City.", "metadata": {"title": "Madonna", "chunk": 0}},
+    {"document": "Ünïcode tëxt survives the round trip.", "metadata": {"doc_id": 42}},
+    {"document": "", "metadata": {}},
+]
+
+
+def test_chunk_ids_come_from_the_record_its_metadata_or_its_row():
+    assert [chunk_id(record, row) for row, record in enumerate(RECORDS)] == ["madonna-0", "42", "2"]
+
+
+def test_built_store_returns_every_chunk_by_row(tmp_path):
+    store = ChunkStore.build(str(tmp_path), RECORDS)
+    assert len(store) == 3
+    for row, record in enumerate(RECORDS):
+        assert store.chunk(row) == {"document": record["document"], "metadata": record["metadata"]}
+    assert store.hit(0, {"score": 0.5}) == {**store.chunk(0), "score": 0.5}
+
+
+def test_resolve_fills_compact_hits_and_drops_unknown_ids(tmp_path):
+    store = ChunkStore.build(str(tmp_path), RECORDS)
+    full = {"document": "already here", "metadata": {}}
+    resolved = store.resolve([{"id": "42", "score": 0.9}, {"id": "missing", "score": 0.8}, full, {"chunk_id": "madonna-0"}])
+    assert [hit["document"] for hit in resolved] == [RECORDS[1]["document"], "already here", RECORDS[0]["document"]]
+    assert resolved[0]["score"] == 0.9
+    assert store.snapshot()["unknown_ids"] == 1
+
+
+def test_repeated_reads_come_from_the_hot_chunk_cache(tmp_path):
+    store = ChunkStore.build(str(tmp_path), RECORDS, cache_entries=1)
+    store.chunk(0)
+    store.chunk(0)
+    store.chunk(1)
+    snapshot = store.snapshot()
+    assert snapshot["hits"] == 1 and snapshot["misses"] == 2
+    assert snapshot["cached"] == 1 and snapshot["evictions"] == 1
+
+
+def test_in_memory_store_matches_the_mapped_one(tmp_path):
+    mapped = ChunkStore.build(str(tmp_path), RECORDS)
+    memory = ChunkStore.from_records(RECORDS)
+    assert [memory.chunk(row) for row in range(3)] == [mapped.chunk(row) for row in range(3)]
+
+
+def test_store_of_empty_chunks_opens(tmp_path):
+    store = ChunkStore.build(str(tmp_path), [{"document": ""}])
+    assert store.chunk(0) == {"document": "", "metadata": {}}
+
+
+def test_open_chunk_store_is_shared(tmp_path):
+    ChunkStore.build(str(tmp_path), RECORDS)
+    assert open_chunk_store(str(tmp_path)) is open_chunk_store(str(tmp_path))
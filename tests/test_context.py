@@ -0,0 +1,70 @@
+from pipeline_core.context import NO_INFORMATION, ContextPacker
+from pipeline_core.tokenizer import ApproxTokenizer, get_tokenizer, truncate_to_tokens
+
+
+def hit(title, chunk, document, score):
+    return {"document": document, "metadata": {"title": title, "url": f"https://x/{title}", "chunk": chunk}, "score": score}
+
+
+class WordTokenizer:
+    """One token per word, so budgets in the tests read as word counts."""
+
+    def count(self, text):
+        return len(text.split())
+
+    def truncate(self, text, budget):
+        return " ".join(text.split()[:budget])
+
+
+HITS = [
+    hit("Madonna", 1, "singer songwriter actress queen of pop", 0.9),
+    hit("Eiffel", 0, "iron lattice tower in paris", 0.8),
+    hit("Madonna", 0, "born in bay city michigan", 0.7),
+]
+
+
+def test_packs_the_top_hits_article_in_document_order():
+    packed = ContextPacker(tokenizer=WordTokenizer()).pack(HITS)
+    assert packed.document == "Chapter_1: born in bay city michigan | Chapter_2: singer songwriter actress queen of pop"
+    assert packed.metadata == {"title": "Madonna", "url": "https://x/Madonna"}
+    assert packed.packed_chunks == 2 and packed.dropped_chunks == 0
+
+
+def test_lower_scored_chunk_is_dropped_when_the_budget_runs_out():
+    packer = ContextPacker(token_budget=8, tokenizer=WordTokenizer(), min_truncated_tokens=4)
+    packed = packer.pack(HITS)
+    assert packed.document == "Chapter_1: singer songwriter actress queen of pop"
+    assert packed.dropped_chunks == 1 and packed.dropped_tokens == 5
+    assert packed.packed_tokens <= 8
+
+
+def test_first_chunk_is_truncated_rather_than_leaving_the_context_empty():
+    packed = ContextPacker(token_budget=4, tokenizer=WordTokenizer()).pack(HITS)
+    assert packed.document == "Chapter_1: singer songwriter actress"
+    assert packed.dropped_tokens == 3 + 5 and packed.dropped_chunks == 1
+
+
+def test_max_chunks_without_grouping_keeps_the_best_hit_only():
+    packed = ContextPacker(tokenizer=WordTokenizer(), group_by_title=False, max_chunks=1).pack(HITS)
+    assert packed.document == "singer songwriter actress queen of pop"
+
+
+def test_no_hits_means_no_information():
+    packed = ContextPacker().pack([])
+    assert packed.document == NO_INFORMATION and packed.metadata == {}
+
+
+def test_truncation_cuts_at_a_word_boundary_within_the_budget():
+    text = "alpha beta gamma delta epsilon"
+    cut = truncate_to_tokens(text, 3)
+    assert text.startswith(cut) and not cut.endswith(" ")
+    assert ApproxTokenizer().count(cut) <= 3
+
+
+def test_unknown_tokenizer_falls_back_to_the_estimate_without_downloading(tmp_path, caplog, monkeypatch):
+    monkeypatch.setenv("TIKTOKEN_CACHE_DIR", str(tmp_path))
+    get_tokenizer.cache_clear()
+    assert isinstance(get_tokenizer("gpt-4o"), ApproxTokenizer)
+    assert isinstance(get_tokenizer(str(tmp_path / "missing")), ApproxTokenizer)
+    assert "estimating token counts" in caplog.text
+    get_tokenizer.cache_clear()
@@ -0,0 +1,69 @@
+"""The async completion stream gives its connection back however it ends."""
+
+import asyncio
+import gc
+
+import pytest
+
+import rag_v4
+from pipeline_core.stages import GenerateStage, Turn
+from pipeline_core.standins import StandInOpenAIServer
+
+QUESTION = "question: one two three four five six seven eight"
+
+
+@pytest.fixture
+def services(tmp_path):
+    llm = StandInOpenAIServer(token_latency=0.01).start()
+    pipeline = rag_v4.Pipeline()
+    pipeline.valves.OPENAI_API_BASE_URL = llm.api_url
+    pipeline.valves.MODEL_LIST_CACHE_PATH = str(tmp_path / "models.json")
+    asyncio.run(pipeline.on_startup())
+    yield pipeline.services
+    asyncio.run(pipeline.on_shutdown())
+    llm.stop()
+
+
+async def open_stream(services) -> Turn:
+    turn = Turn(QUESTION, "standin", [], {"stream": True})
+    await GenerateStage(lambda turn: turn.question).arun(turn, services)
+    return turn
+
+
+def acquired(services) -> int:
+    async def count():
+        return len(services.ahttp.session.connector._acquired)
+
+    return services.loop.run(count())
+
+
+def test_drained_stream_releases_its_connection(services):
+    async def drain():
+        turn = await open_stream(services)
+        return "".join([delta async for delta in turn.output])
+
+    assert services.loop.run(drain()) == "one two three four five six seven eight"
+    assert acquired(services) == 0
+
+
+def test_stream_closed_early_releases_its_connection(services):
+    async def first_delta():
+        turn = await open_stream(services)
+        delta = await turn.output.__anext__()
+        await turn.output.aclose()
+        return delta
+
+    assert services.loop.run(first_delta()) == "one"
+    assert acquired(services) == 0
+
+
+def test_stream_dropped_unread_releases_its_connection(services):
+    async def drop():
+        turn = await open_stream(services)
+        turn.output = None
+        gc.collect()
+        await asyncio.sleep(0.01)
+
+    for _ in range(3):
+        services.loop.run(drop())
+    assert acquired(services) == 0
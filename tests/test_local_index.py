@@ -0,0 +1,91 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from pipeline_core.embeddings import HASHING, HashingEmbedder
+from pipeline_core.local_index import LocalSearchClient, LocalVectorIndex, open_index, top_k
+from pipeline_core.standins import SAMPLE_CORPUS
+
+RECORDS = [{"document": doc["document"], "metadata": {**doc["metadata"], "id": doc["id"]}} for doc in SAMPLE_CORPUS]
+
+
+def build(path, nlist=0) -> LocalVectorIndex:
+    embeddings = HashingEmbedder().embed([record["document"] for record in RECORDS])
+    return LocalVectorIndex.build(str(path), RECORDS, embeddings, HASHING, nlist=nlist)
+
+
+def ids(hits):
+    return [hit["metadata"]["id"] for hit in hits]
+
+
+def test_top_k_orders_the_best_columns_first():
+    scores = np.array([[0.1, 0.9, 0.5, 0.7]])
+    assert top_k(scores, 3).tolist() == [[1, 3, 2]]
+    assert top_k(scores, 10).shape == (1, 4)
+
+
+def test_exact_search_finds_the_document_sharing_the_query_terms(tmp_path):
+    index = build(tmp_path)
+    client = LocalSearchClient(index, HashingEmbedder(), top_k=3)
+    hits = client.search("Madonna Louise Ciccone was born in Bay City, Michigan")
+    assert ids(hits)[0] == "madonna-0"
+    assert len(hits) == 3
+    assert hits[0]["score"] >= hits[1]["score"] >= hits[2]["score"]
+    assert hits[0]["document"] == RECORDS[0]["document"]
+
+
+def test_ivf_probing_every_list_matches_exact_search(tmp_path):
+    exact = build(tmp_path / "exact")
+    ivf = build(tmp_path / "ivf", nlist=3)
+    assert ivf.manifest["nlist"] == 3
+    queries = HashingEmbedder().embed(["Eiffel Tower in Paris", "Python programming language"])
+    expected = [ids(hits) for hits in exact.search_vectors(queries, k=len(RECORDS))]
+    probed = [ids(hits) for hits in ivf.search_vectors(queries, k=len(RECORDS), nprobe=3)]
+    assert probed == expected
+    # Fewer lists score a subset of the rows.
+    assert all(len(hits) <= len(RECORDS) for hits in ivf.search_vectors(queries, k=len(RECORDS), nprobe=1))
+
+
+def test_ivf_probes_at_least_one_list(tmp_path):
+    ivf = build(tmp_path, nlist=3)
+    queries = HashingEmbedder().embed(["Eiffel Tower in Paris"])
+    assert ivf.search_vectors(queries, k=2, nprobe=0) == ivf.search_vectors(queries, k=2, nprobe=1)
+    assert ivf.search_vectors(queries, k=2, nprobe=-1)[0]
+
+
+def test_batched_async_search_matches_one_by_one(tmp_path):
+    client = LocalSearchClient(build(tmp_path), HashingEmbedder(), top_k=2)
+    queries = ["Where was Madonna born?", "How tall is the Eiffel Tower?"]
+    batched = asyncio.run(client.asearch_many(queries))
+    assert [ids(hits) for hits in batched] == [ids(client.search(query)) for query in queries]
+    assert asyncio.run(client.asearch_many([])) == []
+
+
+def test_open_index_is_shared_until_rebuilt(tmp_path):
+    build(tmp_path)
+    assert open_index(str(tmp_path)) is open_index(str(tmp_path))
+
+
+def test_records_and_embeddings_must_line_up(tmp_path):
+    with pytest.raises(ValueError):
+        LocalVectorIndex.build(str(tmp_path), RECORDS[:1], np.ones((2, 4)), HASHING)
+
+
+@pytest.mark.parametrize("damaged, content", [("manifest.json", "{not json"), ("embeddings.npy", "not an array")])
+def test_malformed_index_falls_back_to_the_search_server(tmp_path, caplog, damaged, content):
+    import rag_wiki_llmv2
+    from pipeline_core.stages import Services
+    from pipeline_core.vector_search import VectorSearchClient
+
+    build(tmp_path / "index")
+    (tmp_path / "index" / damaged).write_text(content)
+    valves = rag_wiki_llmv2.Pipeline.Valves(
+        VECTOR_BACKEND="local",
+        LOCAL_INDEX_PATH=str(tmp_path / "index"),
+        MODEL_LIST_CACHE_PATH=str(tmp_path / "models.json"),
+        RETRIEVAL_CACHE_ENABLED=False,
+    )
+    services = Services("local-index-fallback", valves)
+    assert isinstance(services.vector_search, VectorSearchClient)
+    assert "Local index unavailable" in caplog.text
@@ -0,0 +1,53 @@
+import logging
+import socket
+import urllib.request
+
+from pipeline_core.metrics import configure_logging, get_metrics, serve_metrics
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def scrape(port: int) -> str:
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+        return response.read().decode("utf-8")
+
+
+def test_metrics_are_served_on_loopback_and_follow_port_changes():
+    get_metrics("metrics-test")
+    first, second = free_port(), free_port()
+    server = serve_metrics(first, owner="metrics-test")
+    try:
+        assert server.server_address[0] == "127.0.0.1"
+        assert "# TYPE pipeline_stage_seconds histogram" in scrape(first)
+        assert serve_metrics(first, owner="metrics-test") is server
+
+        moved = serve_metrics(second, owner="metrics-test")
+        assert moved is not server
+        assert "pipeline_stage_seconds" in scrape(second)
+        assert server.socket.fileno() == -1  # the old port was closed
+    finally:
+        serve_metrics(0, owner="metrics-test")
+
+
+def test_port_clash_is_logged_instead_of_raised(caplog):
+    with socket.socket() as taken:
+        taken.bind(("127.0.0.1", 0))
+        taken.listen()
+        port = taken.getsockname()[1]
+        with caplog.at_level(logging.WARNING):
+            assert serve_metrics(port, owner="metrics-clash") is None
+    assert "Cannot serve metrics" in caplog.text
+    serve_metrics(0, owner="metrics-clash")
+
+
+def test_log_level_valve_is_applied_and_a_bad_one_falls_back_to_info(caplog):
+    logger = logging.getLogger("metrics-test-logging")
+    configure_logging(logger, "debug")
+    assert logger.level == logging.DEBUG
+    configure_logging(logger, "LOUD")
+    assert logger.level == logging.INFO
+    assert "Unknown LOG_LEVEL 'LOUD'" in caplog.text
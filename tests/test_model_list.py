@@ -0,0 +1,18 @@
+from pipeline_core.model_list import ModelListCache, cache_key
+
+MODELS = [{"id": "standin", "name": "standin"}]
+
+
+def test_saved_list_is_not_served_for_another_api_key(tmp_path):
+    path = str(tmp_path / "models.json")
+    saved = ModelListCache(lambda: MODELS, path, key=cache_key("http://llm/v1", "key-a"))
+    assert saved.refresh()
+    assert saved.models == MODELS
+
+    assert ModelListCache(lambda: [], path, key=cache_key("http://llm/v1", "key-a")).load() == MODELS
+    assert ModelListCache(lambda: [], path, key=cache_key("http://llm/v1", "key-b")).load() == []
+    assert ModelListCache(lambda: [], path, key=cache_key("http://other/v1", "key-a")).load() == []
+
+
+def test_cache_key_does_not_contain_the_api_key():
+    assert "secret-key" not in cache_key("http://llm/v1", "secret-key")
@@ -0,0 +1,146 @@
+"""The pipelines built from shared stages, run against the stand-in servers."""
+
+import asyncio
+import importlib
+import json
+
+import pytest
+
+from pipeline_core.standins import StandInOpenAIServer, StandInSearchServer
+
+QUESTION = "Where was Madonna born?"
+DOCUMENT = "Madonna Louise Ciccone was born on August 16, 1958, in Bay City, Michigan."
+METADATA = {"title": "Madonna", "url": "https://en.wikipedia.org/wiki/Madonna", "chunk": 0, "id": "madonna-0"}
+SUFFIX = " \n Provide also the source  from the metadata, title and url"
+REWRITE_PROMPT = (
+    "you are wikipedia engine helper, Fine-tune and reformulate this question to find the right wikipedia "
+    "article to answer this question, include as much keywords as possible from the question, provide only "
+    f"the phrase no more explanation: {QUESTION}"
+)
+RAG_V4_PROMPT = (
+    f"Context: Chapter_1: {DOCUMENT} | Chapter_2: Madonna is an American singer, songwriter and actress, "
+    "referred to as the Queen of Pop. Metadata : {'title': 'Madonna', 'url': 'https://en.wikipedia.org/wiki/Madonna'} "
+    f"\nQuestion: {QUESTION}{SUFFIX}"
+)
+# Open WebUI's request body; user, chat_id and title must not reach the model.
+BODY = {"model": "standin", "messages": [], "user": {"id": 1}, "chat_id": "chat-1", "title": False}
+
+
+@pytest.fixture(scope="module")
+def servers():
+    search = StandInSearchServer().start()
+    llm = StandInOpenAIServer().start()
+    yield search, llm
+    search.stop()
+    llm.stop()
+
+
+@pytest.fixture
+def start(servers, tmp_path):
+    search, llm = servers
+    started = []
+
+    def start(name: str):
+        pipeline = importlib.import_module(name).Pipeline()
+        valves = {
+            "OPENAI_API_BASE_URL": llm.api_url,
+            "OPENAI_API_KEY": "standin",
+            "VECTOR_DB_URL": search.url,
+            "MODEL_LIST_CACHE_PATH": str(tmp_path / f"{name}-models.json"),
+            "RETRIEVAL_CACHE_ENABLED": False,
+        }
+        for valve, value in valves.items():
+            if hasattr(pipeline.valves, valve):
+                setattr(pipeline.valves, valve, value)
+        asyncio.run(pipeline.on_startup())
+        started.append(pipeline)
+        search.search_requests.clear()
+        llm.chat_requests.clear()
+        return pipeline
+
+    yield start
+    for pipeline in started:
+        asyncio.run(pipeline.on_shutdown())
+
+
+@pytest.fixture
+def run(servers, start):
+    search, llm = servers
+
+    def run(name: str, stream: bool):
+        pipeline = start(name)
+        reply = pipeline.pipe(QUESTION, "standin", [{"role": "user", "content": QUESTION}], {**BODY, "stream": stream})
+        if not isinstance(reply, (str, dict)):
+            reply = "".join(reply)
+        return reply, list(search.search_requests), list(llm.chat_requests)
+
+    return run
+
+
+def completion(reply) -> str:
+    return reply["choices"][0]["message"]["content"] if isinstance(reply, dict) else reply
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_rag_v4(run, stream):
+    reply, searches, chats = run("rag_v4", stream)
+    assert [chat["messages"] for chat in chats] == [
+        [{"role": "user", "content": REWRITE_PROMPT}],
+        [{"role": "user", "content": RAG_V4_PROMPT}],
+    ]
+    assert all(chat["model"] == "standin" for chat in chats)
+    assert chats[-1]["stream"] is stream
+    assert not {"user", "chat_id", "title"} & set(chats[-1])
+    assert {"query": QUESTION} in searches
+    assert completion(reply) == QUESTION + SUFFIX
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_rag_wiki_llmv2(run, stream):
+    reply, searches, chats = run("rag_wiki_llmv2", stream)
+    assert chats == [
+        {"model": "standin", "messages": [{"role": "user", "content": f"Context: {DOCUMENT}\nQuestion: {QUESTION}"}], "stream": stream}
+    ]
+    assert searches == [{"query": QUESTION}]
+    assert completion(reply) == QUESTION
+
+
+def test_wiki_ragv2(run):
+    reply, searches, chats = run("wiki_ragv2", False)
+    assert searches == [{"query": QUESTION}]
+    assert chats == []
+    assert reply == DOCUMENT
+
+
+def test_wiki_ragv3(run):
+    reply, searches, chats = run("wiki_ragv3", False)
+    assert searches == [{"query": QUESTION}]
+    assert chats == []
+    assert json.loads(reply) == {"document": DOCUMENT, "metadata": METADATA}
+
+
+def test_rag_v4_query_vector_database(servers, start):
+    search, llm = servers
+    pipeline = start("rag_v4")
+    context = pipeline.query_vector_database(QUESTION, ["Madonna singer"])
+    assert context["document"].startswith(f"Chapter_1: {DOCUMENT}")
+    assert context["metadata"] == {"title": "Madonna", "url": METADATA["url"]}
+    assert {"query": QUESTION} in search.search_requests
+    assert not llm.chat_requests
+
+
+def test_rag_v4_external_llm(servers, start):
+    search, llm = servers
+    pipeline = start("rag_v4")
+    assert pipeline.external_llm(QUESTION, "standin") == QUESTION
+    assert [chat["messages"] for chat in llm.chat_requests] == [[{"role": "user", "content": REWRITE_PROMPT}]]
+    pipeline.valves.OPENAI_API_BASE_URL = "http://127.0.0.1:1/v1"
+    assert pipeline.external_llm(QUESTION, "standin").startswith("Error:")
+
+
+def test_rag_wiki_llmv2_query_vector_database(servers, start):
+    search, llm = servers
+    pipeline = start("rag_wiki_llmv2")
+    assert pipeline.query_vector_database(QUESTION)["document"] == DOCUMENT
+    assert list(search.search_requests) == [{"query": QUESTION}]
+    assert not llm.chat_requests
@@ -0,0 +1,90 @@
+import asyncio
+import threading
+
+import pytest
+
+import rag_v4
+from pipeline_core.rerank import OVERLAP, OverlapScorer, Reranker, get_reranker, passage, rerank
+from pipeline_core.stages import RerankStage, Turn
+
+QUESTION = "When was the Eiffel Tower built?"
+
+
+def hit(title, document):
+    return {"document": document, "metadata": {"title": title}}
+
+
+HITS = [
+    hit("Madonna", "Madonna is an American singer."),
+    hit("Eiffel Tower", "The Eiffel Tower was built from 1887 to 1889."),
+    hit("Python", "Python is a programming language."),
+    hit("Eiffel Tower", "Gustave Eiffel's company built the tower."),
+]
+
+
+def test_missing_model_falls_back_to_term_overlap(tmp_path, caplog):
+    assert isinstance(get_reranker(""), OverlapScorer)
+    assert isinstance(get_reranker(str(tmp_path / "no-model")), OverlapScorer)
+    assert "reranking by term overlap" in caplog.text
+    assert get_reranker(OVERLAP).name == OVERLAP
+
+
+def test_overlap_rerank_keeps_the_best_k_by_score():
+    best = rerank(OverlapScorer(), QUESTION, HITS, 2)
+    assert [result["metadata"]["title"] for result in best] == ["Eiffel Tower", "Eiffel Tower"]
+    assert best[0]["rerank_score"] >= best[1]["rerank_score"] > 0
+    assert passage(HITS[0]) == "Madonna\nMadonna is an American singer."
+
+
+def test_capacity_follows_the_measured_cost_per_pair():
+    reranker = Reranker()
+    assert reranker.capacity(0.05) == 0
+    reranker.seconds_per_pair = 0.01
+    assert reranker.capacity(0.05) == 5
+    assert reranker.capacity(0) == 0
+
+
+@pytest.fixture
+def services(tmp_path):
+    pipeline = rag_v4.Pipeline()
+    pipeline.valves.MODEL_LIST_CACHE_PATH = str(tmp_path / "models.json")
+    pipeline.valves.RERANK_ENABLED = True
+    pipeline.valves.RERANK_TOP_K = 2
+    yield pipeline.services
+    asyncio.run(pipeline.services.close())
+
+
+def test_stage_keeps_the_top_k(services):
+    turn = Turn(QUESTION, "m", [], {}, results=list(HITS))
+    RerankStage().run(turn, services)
+    assert [result["metadata"]["title"] for result in turn.results] == ["Eiffel Tower", "Eiffel Tower"]
+
+
+def test_reorder_only_keeps_every_hit_and_the_top_one_first(services):
+    turn = Turn(QUESTION, "m", [], {}, results=list(HITS))
+    RerankStage(reorder_only=True).run(turn, services)
+    assert len(turn.results) == len(HITS)
+    assert turn.results[0]["metadata"]["title"] == "Madonna"
+    assert sorted(result["document"] for result in turn.results) == sorted(result["document"] for result in HITS)
+    scores = [result["rerank_score"] for result in turn.results[1:]]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_disabled_stage_leaves_the_hits_alone(services):
+    services.valves.RERANK_ENABLED = False
+    turn = Turn(QUESTION, "m", [], {}, results=list(HITS))
+    RerankStage().run(turn, services)
+    assert turn.results == HITS
+
+
+def test_reconfigure_loads_the_reranker_off_the_event_loop(services, monkeypatch):
+    threads = []
+    monkeypatch.setattr(services, "load_reranker", lambda: threads.append(threading.current_thread()) or OverlapScorer())
+
+    async def reconfigure():
+        await services.reconfigure(services.valves)
+        return threading.current_thread()
+
+    loop_thread = asyncio.run(reconfigure())
+    assert threads and threads[0] is not loop_thread
+    assert isinstance(services.reranker, OverlapScorer)
@@ -0,0 +1,158 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from pipeline_core.resilience import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    Bulkhead,
+    CircuitBreaker,
+    CircuitOpen,
+    Overloaded,
+    Upstream,
+    UpstreamPolicy,
+)
+
+
+def test_breaker_opens_after_threshold_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CLOSED and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.opens == 1
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+
+def test_half_open_probe_closes_or_reopens_the_circuit():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    assert breaker.allow() and breaker.state == HALF_OPEN
+    breaker.record_failure()
+    assert breaker.state == OPEN and breaker.opens == 2
+    time.sleep(0.02)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+
+def test_zero_threshold_never_opens():
+    breaker = CircuitBreaker(failure_threshold=0)
+    for _ in range(10):
+        breaker.record_failure()
+    assert breaker.allow()
+
+
+def test_bulkhead_refuses_past_its_queue_limit():
+    bulkhead = Bulkhead(limit=1, queue_limit=0, queue_timeout=1)
+    bulkhead.acquire()
+    with pytest.raises(Overloaded):
+        bulkhead.acquire()
+    bulkhead.release()
+    bulkhead.acquire()
+    assert bulkhead.active == 1
+
+
+def test_bulkhead_times_out_a_queued_caller():
+    bulkhead = Bulkhead(limit=1, queue_limit=4, queue_timeout=0.02)
+    bulkhead.acquire()
+    with pytest.raises(Overloaded):
+        bulkhead.acquire()
+    assert bulkhead.queued == 0
+
+
+def test_bulkhead_hands_a_released_slot_to_the_waiter():
+    bulkhead = Bulkhead(limit=1, queue_limit=4, queue_timeout=5)
+    bulkhead.acquire()
+    acquired = threading.Event()
+
+    def waiter():
+        bulkhead.acquire()
+        acquired.set()
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    while bulkhead.queued == 0:
+        time.sleep(0.001)
+    bulkhead.release()
+    thread.join(5)
+    assert acquired.is_set()
+    assert bulkhead.active == 1
+
+
+def test_bulkhead_bounds_coroutines():
+    bulkhead = Bulkhead(limit=2, queue_limit=8, queue_timeout=5)
+    peak = 0
+
+    async def work():
+        nonlocal peak
+        await bulkhead.aacquire()
+        try:
+            peak = max(peak, bulkhead.active)
+            await asyncio.sleep(0.01)
+        finally:
+            bulkhead.release()
+
+    async def main():
+        await asyncio.gather(*(work() for _ in range(6)))
+
+    asyncio.run(main())
+    assert peak == 2
+    assert bulkhead.active == 0
+
+
+def test_upstream_opens_on_transient_failures_and_refuses_fast():
+    upstream = Upstream("test", UpstreamPolicy(failure_threshold=2, reset_timeout=60))
+    calls = []
+
+    def down():
+        calls.append(1)
+        raise ConnectionError("refused")
+
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            upstream.call(down)
+    with pytest.raises(CircuitOpen):
+        upstream.call(down)
+    assert len(calls) == 2
+    assert upstream.snapshot()["rejected"]["circuit_open"] == 1
+
+
+def test_upstream_answers_that_are_not_transient_keep_the_circuit_closed():
+    upstream = Upstream("test", UpstreamPolicy(failure_threshold=1))
+
+    def rejects():
+        raise ValueError("bad request")
+
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            upstream.call(rejects)
+    assert upstream.breaker.state == CLOSED
+
+
+def test_upstream_retries_transient_failures_when_allowed():
+    upstream = Upstream("test", UpstreamPolicy(retries=2, retry_backoff=0.001))
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise asyncio.TimeoutError()
+        return "ok"
+
+    assert asyncio.run(upstream.acall(flaky)) == "ok"
+    assert upstream.snapshot()["retries"] == 2
+    assert upstream.bulkhead.active == 0
@@ -0,0 +1,65 @@
+from pipeline_core.retrieval_cache import RetrievalCache
+
+PAYLOAD = {"query": "eiffel tower"}
+RESULTS_A = [{"document": "from a", "metadata": {"title": "A"}}]
+RESULTS_B = [{"document": "from b", "metadata": {"title": "B"}}]
+
+
+def test_disk_rows_are_kept_apart_per_url(tmp_path):
+    path = str(tmp_path / "retrieval.sqlite")
+    cache = RetrievalCache(disk_path=path)
+    cache.put("http://a/search", PAYLOAD, RESULTS_A)
+    cache.put("http://b/search", PAYLOAD, RESULTS_B)
+    cache.disk.close()
+
+    # A fresh process only has the disk rows.
+    restarted = RetrievalCache(disk_path=path)
+    assert restarted.get("http://b/search", PAYLOAD) == RESULTS_B
+    assert restarted.get("http://a/search", PAYLOAD) == RESULTS_A
+    assert restarted.get("http://c/search", PAYLOAD) is None
+    assert restarted.disk_hits == 2
+
+
+def test_invalidate_drops_only_that_url(tmp_path):
+    path = str(tmp_path / "retrieval.sqlite")
+    cache = RetrievalCache(disk_path=path)
+    cache.put("http://a/search", PAYLOAD, RESULTS_A)
+    cache.put("http://b/search", PAYLOAD, RESULTS_B)
+    cache.invalidate("http://a/search")
+    cache.disk.close()
+
+    restarted = RetrievalCache(disk_path=path)
+    assert restarted.get("http://a/search", PAYLOAD) is None
+    assert restarted.get("http://b/search", PAYLOAD) == RESULTS_B
+
+
+def test_replaced_shared_cache_is_dropped_and_closed(tmp_path):
+    first_path, second_path = str(tmp_path / "first.sqlite"), str(tmp_path / "second.sqlite")
+    first = RetrievalCache.shared(16, 60.0, None, first_path, owner="pipeline-a")
+    assert RetrievalCache.shared(16, 60.0, None, first_path, owner="pipeline-b") is first
+    assert RetrievalCache.shared(16, 60.0, None, first_path, owner="pipeline-a") is first
+
+    second = RetrievalCache.shared(16, 60.0, None, second_path, owner="pipeline-a")
+    assert second is not first
+    # pipeline-b still uses the first cache.
+    first.put("http://a/search", PAYLOAD, RESULTS_A)
+    assert first.get("http://a/search", PAYLOAD) == RESULTS_A
+
+    RetrievalCache.release(owner="pipeline-b")
+    assert first.disk._db is None
+    assert first.get("http://a/search", PAYLOAD) is None
+    first.put("http://a/search", PAYLOAD, RESULTS_A)  # a search still holding it finishes quietly
+    assert (16, 60.0, None, first_path, 100_000) not in RetrievalCache._shared
+
+    RetrievalCache.release(owner="pipeline-a")
+    assert second.disk._db is None
+    assert (16, 60.0, None, second_path, 100_000) not in RetrievalCache._shared
+
+
+def test_disk_row_limit_is_applied(tmp_path):
+    cache = RetrievalCache(disk_path=str(tmp_path / "retrieval.sqlite"), disk_max_entries=2)
+    for n in range(5):
+        cache.put("http://a/search", {"query": str(n)}, RESULTS_A)
+    cache.disk.prune()
+    assert cache.disk._db.execute("SELECT COUNT(*) FROM retrieval_cache").fetchone()[0] == 2
+    cache.close()
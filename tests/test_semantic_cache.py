@@ -0,0 +1,68 @@
+import time
+
+from pipeline_core.semantic_cache import SemanticCache, normalize_question
+
+
+def test_exact_tier_matches_normalized_questions_per_model():
+    cache = SemanticCache()
+    cache.put("m", "Where was Madonna born?", "madonna birthplace")
+    assert cache.get("m", "  where WAS madonna   born ") == "madonna birthplace"
+    assert cache.get("other-model", "Where was Madonna born?") is None
+    assert normalize_question(" Hello,   World?! ") == "hello, world"
+
+
+def test_similar_question_hits_above_the_threshold_only():
+    cache = SemanticCache(similarity_threshold=0.9)
+    cache.put("m", "Where was Madonna born?", "madonna birthplace", embedding=[1.0, 0.0, 0.0])
+    assert cache.get_similar("m", [0.99, 0.05, 0.0]) == "madonna birthplace"
+    assert cache.get_similar("m", [0.0, 1.0, 0.0]) is None
+    assert cache.get_similar("other-model", [1.0, 0.0, 0.0]) is None
+    assert cache.snapshot()["semantic_hits"] == 1
+    assert cache.snapshot()["semantic_misses"] == 2
+
+
+def test_embedding_of_another_dimension_is_a_miss():
+    cache = SemanticCache()
+    cache.put("m", "q", "rewrite", embedding=[1.0, 0.0])
+    assert cache.get_similar("m", [1.0, 0.0, 0.0]) is None
+
+
+def test_evicted_entry_releases_its_similarity_row():
+    cache = SemanticCache(max_entries=1, similarity_threshold=0.9)
+    cache.put("m", "first", "one", embedding=[1.0, 0.0])
+    cache.put("m", "second", "two", embedding=[0.0, 1.0])
+    assert cache.get("m", "first") is None
+    assert cache.get_similar("m", [1.0, 0.0]) is None
+    assert cache.get_similar("m", [0.0, 1.0]) == "two"
+    assert cache.snapshot()["evictions"] == 1
+
+
+def test_entries_expire_after_the_ttl():
+    cache = SemanticCache(ttl=0.01)
+    cache.put("m", "q", "rewrite", embedding=[1.0, 0.0])
+    time.sleep(0.02)
+    assert cache.get("m", "q") is None
+    assert cache.get_similar("m", [1.0, 0.0]) is None
+
+
+def test_value_over_the_byte_budget_is_not_stored():
+    cache = SemanticCache(max_bytes=64)
+    cache.put("m", "q", "x" * 1000, embedding=[1.0, 0.0])
+    assert cache.get("m", "q") is None
+    assert cache.get_similar("m", [1.0, 0.0]) is None
+
+
+def test_rewrite_cache_survives_unrelated_valve_updates(tmp_path):
+    import rag_v4
+
+    pipeline = rag_v4.Pipeline()
+    pipeline.valves.MODEL_LIST_CACHE_PATH = str(tmp_path / "models.json")
+    services = pipeline.services
+    cache = services.rewrite_cache
+    cache.put("m", "q", "rewrite")
+    pipeline.valves.CONTEXT_TOKEN_BUDGET = 512
+    services.build()
+    assert services.rewrite_cache is cache
+    pipeline.valves.REWRITE_CACHE_TTL = 60.0
+    services.build()
+    assert services.rewrite_cache is not cache
@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from pipeline_core.singleflight import SingleFlight
+
+
+def test_concurrent_async_calls_with_one_key_run_once():
+    flight = SingleFlight()
+    runs = []
+
+    async def search(query):
+        runs.append(query)
+        await asyncio.sleep(0.05)
+        return [query]
+
+    async def main():
+        return await asyncio.gather(*(flight.ado("q", search, "q") for _ in range(5)))
+
+    assert asyncio.run(main()) == [["q"]] * 5
+    assert runs == ["q"]
+    assert flight.snapshot() == {"calls": 1, "shared": 4, "in_flight": 0}
+
+
+def test_distinct_keys_are_not_coalesced():
+    flight = SingleFlight()
+
+    async def echo(value):
+        await asyncio.sleep(0.01)
+        return value
+
+    async def main():
+        return await asyncio.gather(flight.ado("a", echo, 1), flight.ado("b", echo, 2))
+
+    assert asyncio.run(main()) == [1, 2]
+    assert flight.snapshot()["shared"] == 0
+
+
+def test_waiters_get_the_leaders_exception():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream said no")
+
+    async def main():
+        return await asyncio.gather(*(flight.ado("k", fail) for _ in range(3)), return_exceptions=True)
+
+    errors = asyncio.run(main())
+    assert all(isinstance(error, ValueError) for error in errors)
+
+
+def test_one_caller_cancelled_does_not_cancel_the_shared_call():
+    flight = SingleFlight()
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def main():
+        impatient = asyncio.ensure_future(flight.ado("k", slow))
+        patient = asyncio.ensure_future(flight.ado("k", slow))
+        await asyncio.sleep(0.01)
+        impatient.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await impatient
+        return await patient
+
+    assert asyncio.run(main()) == "done"
+
+
+def test_threads_share_a_call_and_nothing_is_kept_afterwards():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    runs = []
+
+    def fetch():
+        runs.append(1)
+        started.set()
+        release.wait(5)
+        return "result"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("k", fetch)))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=lambda: results.append(flight.do("k", fetch)))
+    follower.start()
+    while flight.snapshot()["shared"] == 0:
+        time.sleep(0.001)
+    release.set()
+    leader.join()
+    follower.join()
+    assert results == ["result", "result"]
+    assert len(runs) == 1
+
+    # Not a cache: a later call runs again.
+    assert flight.do("k", lambda: "fresh") == "fresh"
@@ -0,0 +1,77 @@
+import asyncio
+import json
+
+from pipeline_core.sse import afirst_line, aiter_content_deltas, first_line, iter_content_deltas, iter_sse_data
+
+
+def event(content=None, **delta) -> bytes:
+    if content is not None:
+        delta["content"] = content
+    return f"data: {json.dumps({'choices': [{'index': 0, 'delta': delta}]})}".encode("utf-8")
+
+
+STREAM = [
+    b": keep-alive comment",
+    b"",
+    event(role="assistant"),
+    b"",
+    event("Bay"),
+    b"",
+    event(" City"),
+    b"",
+    event(""),
+    b"",
+    b"data: [DONE]",
+    b"",
+    event("after done"),
+    b"",
+]
+
+
+def test_content_deltas_skip_comments_roles_and_empty_pieces_and_stop_at_done():
+    assert list(iter_content_deltas(STREAM)) == ["Bay", " City"]
+
+
+def test_multiline_data_is_joined_and_a_trailing_event_is_flushed():
+    lines = ["data: first", "data: second", "", "event: ignored", "data:last"]
+    assert list(iter_sse_data(lines)) == ["first\nsecond", "last"]
+
+
+def test_crlf_lines_and_str_lines_parse_like_bytes():
+    lines = [line.decode("utf-8") + "\r\n" for line in STREAM]
+    assert list(iter_content_deltas(lines)) == ["Bay", " City"]
+
+
+def test_async_deltas_match_and_close_the_source():
+    closed = []
+
+    async def lines():
+        try:
+            for line in STREAM:
+                yield line
+        finally:
+            closed.append(True)
+
+    async def collect():
+        return [content async for content in aiter_content_deltas(lines())]
+
+    assert asyncio.run(collect()) == ["Bay", " City"]
+    assert closed == [True]
+
+
+def test_first_line_stops_reading_at_the_first_line_break():
+    read = []
+
+    def deltas():
+        for delta in ["\n  Madonna", " birthplace\nand more", "never read"]:
+            read.append(delta)
+            yield delta
+
+    assert first_line(deltas()) == "Madonna birthplace"
+    assert "never read" not in read
+
+    async def adeltas():
+        for delta in ["Eiffel ", "Tower"]:
+            yield delta
+
+    assert asyncio.run(afirst_line(adeltas())) == "Eiffel Tower"
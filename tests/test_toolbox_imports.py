@@ -0,0 +1,17 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded on the first chat, never when the server imports the module.
+DEFERRED = ("aiohttp", "requests", "langchain", "langchain_core", "langchain_community", "langchain_openai", "langgraph")
+
+
+def test_import_defers_network_and_langchain_libraries():
+    probe = (
+        "import sys, toolbox_v23; "
+        f"print(sorted({{name.split('.')[0] for name in sys.modules}} & set({DEFERRED!r})))"
+    )
+    completed = subprocess.run([sys.executable, "-c", probe], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert completed.stdout.strip() == "[]"
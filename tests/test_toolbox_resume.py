@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("langgraph")
+pytest.importorskip("langchain_openai")
+
+import toolbox_v23
+from pipeline_core.standins import StandInOpenAIServer
+
+CHAT = {"configurable": {"thread_id": "chat-1"}}
+
+
+@pytest.fixture
+def pipeline():
+    llm = StandInOpenAIServer(models=["standin"]).start()
+    pipeline = toolbox_v23.Pipeline()
+    pipeline.valves.INFERENCE_SERVER_URL = llm.api_url
+    pipeline.valves.MODEL_NAME = "standin"
+    yield pipeline
+    asyncio.run(pipeline.on_shutdown())
+    llm.stop()
+
+
+def ask(pipeline, messages):
+    return "".join(pipeline.pipe(messages[-1]["content"], "standin", messages, {"chat_id": "chat-1"}))
+
+
+def stored(pipeline):
+    return pipeline.loop.run(pipeline.get_graph().aget_state(CHAT)).values["messages"]
+
+
+def two_turns(pipeline):
+    first = [{"role": "user", "content": "first: alpha"}]
+    first.append({"role": "assistant", "content": ask(pipeline, first)})
+    second = first + [{"role": "user", "content": "second: beta"}]
+    second.append({"role": "assistant", "content": ask(pipeline, second)})
+    return second
+
+
+def test_unchanged_chat_resumes_from_checkpoint(pipeline):
+    history = two_turns(pipeline)
+    assert [message["content"] for message in history[1::2]] == ["alpha", "beta"]
+    # The first turn's messages are still the checkpointed objects, not a re-seed.
+    first_id = stored(pipeline)[0].id
+    ask(pipeline, history + [{"role": "user", "content": "third: gamma"}])
+    messages = stored(pipeline)
+    assert messages[0].id == first_id
+    assert [message.content for message in messages] == ["first: alpha", "alpha", "second: beta", "beta", "third: gamma", "gamma"]
+
+
+def test_edited_earlier_message_reseeds_the_chat(pipeline):
+    history = two_turns(pipeline)
+    first_id = stored(pipeline)[0].id
+    history[0] = {"role": "user", "content": "first: edited"}
+    ask(pipeline, history + [{"role": "user", "content": "third: gamma"}])
+    messages = stored(pipeline)
+    assert messages[0].id != first_id
+    assert [message.content for message in messages] == ["first: edited", "alpha", "second: beta", "beta", "third: gamma", "gamma"]
+
+
+def test_regenerated_reply_reseeds_the_chat(pipeline):
+    history = two_turns(pipeline)
+    history[1] = {"role": "assistant", "content": "a regenerated answer"}
+    ask(pipeline, history + [{"role": "user", "content": "third: gamma"}])
+    assert stored(pipeline)[1].content == "a regenerated answer"
@@ -0,0 +1,53 @@
+import asyncio
+import time
+
+from pipeline_core.metrics import prometheus_text
+from pipeline_core.tools import ToolRunner
+
+
+def add(a, b):
+    return a + b
+
+
+def test_memoized_calls_export_hits_misses_and_ratio_per_tool():
+    runner = ToolRunner()
+    runner.memoize("add")
+    runner.memoize("search", ttl=60)
+
+    async def calls():
+        for _ in range(3):
+            assert await runner.arun("add", add, {"a": 1, "b": 2}) == 3
+        await runner.arun("search", add, {"a": "x", "b": "y"})
+
+    asyncio.run(calls())
+    samples = runner.prometheus_samples("tools-test")
+    assert 'pipeline_tool_cache_hits_total{pipeline="tools-test",tool="add"} 2' in samples["pipeline_tool_cache_hits_total"]
+    assert 'pipeline_tool_cache_misses_total{pipeline="tools-test",tool="add"} 1' in samples["pipeline_tool_cache_misses_total"]
+    ratios = samples["pipeline_tool_cache_hit_ratio"]
+    assert f'pipeline_tool_cache_hit_ratio{{pipeline="tools-test",tool="add"}} {2 / 3}' in ratios
+    assert 'pipeline_tool_cache_hit_ratio{pipeline="tools-test",tool="search"} 0.0' in ratios
+
+
+def test_slots_survive_a_loop_restart():
+    # The toolbox keeps its runner when its event loop is stopped and started again.
+    runner = ToolRunner(max_concurrency=1)
+
+    def slow_add(a, b):
+        time.sleep(0.01)
+        return a + b
+
+    async def contended():
+        return await asyncio.gather(*(runner.arun("add", slow_add, {"a": i, "b": 1}) for i in range(3)))
+
+    assert asyncio.run(contended()) == [1, 2, 3]
+    assert asyncio.run(contended()) == [1, 2, 3]
+
+
+def test_toolbox_exports_tool_cache_metrics():
+    import toolbox_v23
+
+    pipeline = toolbox_v23.Pipeline()
+    asyncio.run(pipeline.tool_runner.arun("add", pipeline.add, {"a": 1, "b": 2}))
+    text = prometheus_text()
+    assert "# TYPE pipeline_tool_cache_hit_ratio gauge" in text
+    assert 'pipeline_tool_cache_misses_total{pipeline="toolbox_v23",tool="add"} 1' in text
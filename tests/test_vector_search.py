@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+
+from pipeline_core.http_pool import HTTPPool
+from pipeline_core.singleflight import SingleFlight
+from pipeline_core.standins import StandInSearchServer
+from pipeline_core.vector_search import VectorSearchClient
+
+QUERIES = ["Where was Madonna born?", "Eiffel Tower in Paris", "Python programming language"]
+
+
+@pytest.fixture(scope="module")
+def server():
+    server = StandInSearchServer(latency=0.05, batch=False).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def http():
+    http = HTTPPool()
+    yield http
+    http.close()
+
+
+def test_coalesced_callers_get_their_own_hits(server, http):
+    client = VectorSearchClient(server.url, http, flight=SingleFlight())
+    requests = server.requests
+    replies = [None] * 4
+
+    def search(i):
+        replies[i] = client.search(QUERIES[0])
+
+    threads = [threading.Thread(target=search, args=(i,)) for i in range(len(replies))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert server.requests - requests < len(replies)
+    assert all(reply == replies[0] for reply in replies)
+    replies[0][0]["metadata"]["title"] = "edited"
+    assert all(reply[0]["metadata"]["title"] != "edited" for reply in replies[1:])
+    assert len({id(reply) for reply in replies}) == len(replies)
+
+
+def test_search_many_reuses_one_pool_sized_by_max_concurrency(server, http):
+    client = VectorSearchClient(server.url, http, max_concurrency=2)
+    first = client.search_many(QUERIES)
+    executor = client._executor
+    assert executor is not None and executor._max_workers == 2
+    assert client.search_many(QUERIES) == first
+    assert client._executor is executor
+
+    client.close()
+    assert client._executor is None
+    # A request still holding the replaced client finishes in its own thread.
+    assert client.search_many(QUERIES) == first
+    assert client._executor is None
+
+
+def test_services_size_the_pool_from_the_valves_and_close_replaced_clients(tmp_path):
+    import rag_wiki_llmv2
+    from pipeline_core.stages import Services
+
+    valves = rag_wiki_llmv2.Pipeline.Valves(
+        VECTOR_DB_MAX_CONCURRENCY=3,
+        MODEL_LIST_CACHE_PATH=str(tmp_path / "models.json"),
+        RETRIEVAL_CACHE_ENABLED=False,
+    )
+    services = Services("vector-search-pool", valves)
+    previous = services.vector_search
+    assert previous.max_concurrency == 3
+    services.build()
+    assert services.vector_search is not previous
+    assert previous._closed
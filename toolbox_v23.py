@@ -8,24 +8,72 @@ description: A pipeline for using tools with LangChain and LangGraph.
 requirements: langchain, langchain_community, langgraph
 """
 
-from typing import List, Union, Generator, Iterator
+from typing import AsyncIterator, Callable, List, Union, Generator, Iterator
 from pydantic import BaseModel
-from langchain_openai import ChatOpenAI
-from langgraph.graph import MessagesState, StateGraph, START
-from langchain_core.messages import HumanMessage, SystemMessage
-from langgraph.prebuilt import tools_condition
-from langgraph.prebuilt import ToolNode
+import asyncio
+import functools
+import logging
 import os
+import sys
+import threading
 import time
-import random
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))  # shared pipeline_core package
+
+from pipeline_core.event_loop import EventLoopThread
+from pipeline_core.cache import LRUCache
+from pipeline_core.metrics import get_metrics, serve_metrics
+from pipeline_core.tokenizer import get_tokenizer
+from pipeline_core.tools import ToolRunner
+
+logger = logging.getLogger(__name__)
+
+# LangChain, LangGraph and the graph itself are loaded on the first chat (or
+# in on_startup with PRELOAD_GRAPH), not when the server imports this module.
+
+TRUNCATED = " [truncated]"
+SYSTEM_PROMPT = "You are a helpful assistant tasked with using search and performing arithmetic on a set of inputs."
+FINAL_PROMPT = "The tool budget for this question is used up. Answer now with the information you already have."
 
 
 class Pipeline:
 
+    # Deterministic tools are memoized without expiry, search tools with a TTL.
+    PURE_TOOLS = ("add", "multiply", "divide")
+    SEARCH_TOOLS = ("DuckDuckGoSearchRun",)
+    # Valves the tool runner is built from; other updates keep it and its caches.
+    TOOL_RUNNER_VALVES = (
+        "TOOL_TIMEOUT_SECONDS",
+        "TOOL_MAX_CONCURRENCY",
+        "TOOL_CACHE_ENABLED",
+        "TOOL_CACHE_MAX_ENTRIES",
+        "SEARCH_CACHE_TTL",
+    )
+    # Valves a compiled graph depends on; each combination gets its own graph.
+    GRAPH_VALVES = ("INFERENCE_SERVER_URL", "MODEL_NAME", "TOKENIZER_ID", "CHECKPOINT_PATH")
+    GRAPH_CACHE_ENTRIES = 4
+
     class Valves(BaseModel):
         INFERENCE_SERVER_URL: str
         MODEL_NAME: str
         TOOL_SERVER_URL: str
+        METRICS_PORT: int = 0  # serve Prometheus /metrics on this port when set
+        METRICS_HOST: str = "127.0.0.1"  # interface the metrics port listens on; 0.0.0.0 for all
+        TOOL_PROGRESS: bool = True  # emit a progress line when the reasoner calls a tool
+        TOOL_TIMEOUT_SECONDS: float = 30.0  # per tool call; the model sees an error on expiry
+        TOOL_MAX_CONCURRENCY: int = 4  # concurrent calls allowed per tool
+        TOOL_CACHE_ENABLED: bool = True
+        TOOL_CACHE_MAX_ENTRIES: int = 1024  # per tool
+        SEARCH_CACHE_TTL: float = 900.0  # search results go stale; pure tools never expire
+        MAX_TOOL_STEPS: int = 6  # reasoner turns allowed to call tools before it must answer
+        GRAPH_DEADLINE_SECONDS: float = 90.0  # wall-clock cap for one run
+        STATE_TOKEN_BUDGET: int = 6000  # prompt tokens before old tool results are compacted
+        COMPACTED_TOOL_TOKENS: int = 64  # what is kept of a compacted tool result
+        TOKENIZER_ID: str = ""  # tokenizer.json file or directory, or a tiktoken model name; empty uses MODEL_NAME
+        CHECKPOINT_PATH: str = ""  # SQLite file for chat checkpoints; empty keeps them in memory
+        CHECKPOINT_MAX_CHATS: int = 256  # chats kept resident by the in-memory checkpointer
+        PRELOAD_GRAPH: bool = False  # compile the graph in on_startup instead of on the first chat
 
     def __init__(self):
         self.valves = self.Valves(
@@ -36,27 +84,18 @@ class Pipeline:
             }
         )
 
-        self.llm = ChatOpenAI(
-            model=self.valves.MODEL_NAME,
-            openai_api_key="EMPTY",
-            openai_api_base=self.valves.INFERENCE_SERVER_URL,
-            max_tokens=3000,
-            temperature=0.7,
-        )
-
-        self.tools = [
-            self.add,
-            self.multiply,
-            self.divide,
-            self.DuckDuckGoSearchRun
-        ]
-
-        self.llm_with_tools = self.llm.bind_tools(self.tools)
+        self.metrics = get_metrics(__name__)
+        self.loop = EventLoopThread(name=f"{__name__}-loop")
+        self.tool_runner = self.build_tool_runner()
+        self.tool_runner_key = self.valve_key(self.TOOL_RUNNER_VALVES)
+        self.metrics.add_collector("tools", self.tool_samples)
 
-        # System message
-        self.sys_msg = SystemMessage(content="You are a helpful assistant tasked with using search and performing arithmetic on a set of inputs.")
-
-        self.graph = self.build_graph()
+        # Built with the first graph; see get_graph.
+        self.tools = None
+        self.checkpoint_path = self.valves.CHECKPOINT_PATH
+        self.checkpointer = None
+        self.graphs = LRUCache(max_entries=self.GRAPH_CACHE_ENTRIES)
+        self.graph_lock = threading.Lock()
 
     def add(self, a: int, b: int) -> int:
         """Adds a and b.
@@ -85,25 +124,64 @@ class Pipeline:
         """
         return a / b
 
-    def create_content_stream(self, content: str, chunk_size: int = 6) -> Generator[str, None, None]:
-        current_chunk = ''
-        current_size = 0
-
-        for char in content:
-            if current_size + len(char) > chunk_size and current_chunk:
-                yield current_chunk
-                time.sleep(random.uniform(0.005, 0.01))  # Random delay to simulate typing
-                current_chunk = ''
-                current_size = 0
-            
-            current_chunk += char
-            current_size += len(char)
-
-        if current_chunk:
-            yield current_chunk
-            time.sleep(random.uniform(0.005, 0.01))  # Random delay after the last chunk too
-
-
+    def build_tool_runner(self) -> ToolRunner:
+        runner = ToolRunner(
+            timeout=self.valves.TOOL_TIMEOUT_SECONDS,
+            max_concurrency=self.valves.TOOL_MAX_CONCURRENCY,
+            metrics=self.metrics,
+        )
+        if self.valves.TOOL_CACHE_ENABLED:
+            for name in self.PURE_TOOLS:
+                runner.memoize(name, self.valves.TOOL_CACHE_MAX_ENTRIES)
+            for name in self.SEARCH_TOOLS:
+                runner.memoize(name, self.valves.TOOL_CACHE_MAX_ENTRIES, ttl=self.valves.SEARCH_CACHE_TTL)
+        return runner
+
+    def tool_samples(self) -> dict:
+        return self.tool_runner.prometheus_samples(self.metrics.pipeline)
+
+    def limited_tool(self, fn: Callable):
+        from langchain_core.tools import StructuredTool
+
+        # The async path runs tool calls of one reasoner step concurrently
+        # (ToolNode gathers them), each under the runner's deadline and slots.
+        name = fn.__name__
+
+        async def acall(**kwargs):
+            return await self.tool_runner.arun(name, fn, kwargs)
+
+        return StructuredTool.from_function(func=fn, coroutine=acall, name=name)
+
+    def tool_progress(self, name: str) -> str:
+        return f"\n\n_Calling `{name}`..._\n\n"
+
+    async def astream_graph(self, graph, inputs: dict, config: dict, turn: list) -> AsyncIterator[str]:
+        from langchain_core.messages import AIMessage
+        from pipeline_core.tool_graph import transcript_digest
+
+        # Message streaming yields the reasoner's tokens as the model produces
+        # them; tool-call turns surface as a progress line instead of a stall.
+        reply = []
+        try:
+            async for chunk, metadata in graph.astream(inputs, config, stream_mode="messages"):
+                if metadata.get("langgraph_node") != "reasoner" or not isinstance(chunk, AIMessage):
+                    continue
+                if self.valves.TOOL_PROGRESS:
+                    for call in getattr(chunk, "tool_call_chunks", None) or chunk.tool_calls:
+                        if call.get("name"):
+                            reply.append(self.tool_progress(call["name"]))
+                            yield reply[-1]
+                if chunk.content:
+                    reply.append(chunk.content if isinstance(chunk.content, str) else str(chunk.content))
+                    yield reply[-1]
+            # The server sends this turn back as history next time, with what
+            # was streamed as the assistant message; a mismatch re-seeds the chat.
+            transcript = transcript_digest(turn + [AIMessage(content="".join(reply))])
+            await graph.aupdate_state(config, {"transcript": transcript})
+        finally:
+            thread_id = config["configurable"]["thread_id"]
+            if thread_id.startswith("oneshot-"):
+                await self.checkpointer.adelete_thread(thread_id)
 
     def DuckDuckGoSearchRun(self) -> str:
         """
@@ -113,46 +191,217 @@ class Pipeline:
             str: The result of the search.
         """
         return "Madonna was born in 1958"
-    
-    def reasoner(self, state: MessagesState):
-        return {"messages": [self.llm_with_tools.invoke([self.sys_msg] + state["messages"])]}
+
+    def message_tokens(self, tokenizer, message) -> int:
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        return tokenizer.count(content)
+
+    def compact_tool_results(self, tokenizer, messages: list) -> list:
+        """Truncate old tool results, oldest first, until the state fits the budget.
+
+        Results of the latest tool turn are kept whole. Returned messages keep
+        their ids, so the graph's reducer replaces them in place and the state
+        stays compacted for later steps.
+        """
+        from langchain_core.messages import ToolMessage
+
+        total = sum(self.message_tokens(tokenizer, message) for message in messages)
+        if total <= self.valves.STATE_TOKEN_BUDGET:
+            return []
+        latest = len(messages)
+        while latest > 0 and isinstance(messages[latest - 1], ToolMessage):
+            latest -= 1
+        compacted = []
+        for message in messages[:latest]:
+            if total <= self.valves.STATE_TOKEN_BUDGET:
+                break
+            if not isinstance(message, ToolMessage):
+                continue
+            tokens = self.message_tokens(tokenizer, message)
+            if tokens <= self.valves.COMPACTED_TOOL_TOKENS or str(message.content).endswith(TRUNCATED):
+                continue
+            content = tokenizer.truncate(str(message.content), self.valves.COMPACTED_TOOL_TOKENS) + TRUNCATED
+            compacted.append(message.model_copy(update={"content": content}))
+            total -= tokens - self.message_tokens(tokenizer, compacted[-1])
+        return compacted
+
+    async def reasoner(self, llm, llm_with_tools, tokenizer, state: dict):
+        from langchain_core.messages import AIMessage, SystemMessage
+
+        step = state.get("steps", 0) + 1
+        deadline = state.get("deadline") or time.time() + self.valves.GRAPH_DEADLINE_SECONDS
+        compacted = self.compact_tool_results(tokenizer, state["messages"])
+        replaced = {message.id: message for message in compacted}
+        messages = [replaced.get(message.id, message) for message in state["messages"]]
+        # Past the step cap the model is asked to answer without tools, which
+        # also ends the reasoner -> tools cycle.
+        system = SystemMessage(content=SYSTEM_PROMPT)
+        if step > self.valves.MAX_TOOL_STEPS:
+            prompt = [system] + messages + [SystemMessage(content=FINAL_PROMPT)]
+        else:
+            llm, prompt = llm_with_tools, [system] + messages
+
+        with self.metrics.stage("reasoner", step=step) as span:
+            span.attributes["prompt_tokens"] = sum(self.message_tokens(tokenizer, message) for message in prompt)
+            span.attributes["compacted"] = len(compacted)
+            try:
+                message = await asyncio.wait_for(llm.ainvoke(prompt), max(0.0, deadline - time.time()))
+            except asyncio.TimeoutError as e:
+                span.fail(e)
+                message = AIMessage(content=f"Stopped: the {self.valves.GRAPH_DEADLINE_SECONDS:g}s time limit was reached before an answer was ready.")
+            usage = getattr(message, "usage_metadata", None) or {}
+            span.add(tokens=usage.get("output_tokens", 0))
+        return {"messages": compacted + [message], "steps": step}
+
+    async def build_checkpointer(self):
+        # Runs on the pipeline's event loop, which the SQLite saver binds to.
+        from pipeline_core.tool_graph import BoundedMemorySaver
+
+        if self.valves.CHECKPOINT_PATH:
+            try:
+                import aiosqlite
+                from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+                # The connection starts lazily, on first use.
+                return AsyncSqliteSaver(aiosqlite.connect(self.valves.CHECKPOINT_PATH))
+            except ImportError as e:
+                logger.warning("SQLite checkpoints unavailable, keeping them in memory: %s", e)
+        return BoundedMemorySaver(max_threads=self.valves.CHECKPOINT_MAX_CHATS)
+
+    def history_messages(self, user_message: str, messages: List[dict]) -> list:
+        """Earlier turns of the chat as LangChain messages, without the new one."""
+        from langchain_core.messages import AIMessage, HumanMessage
+
+        if messages and messages[-1].get("role") == "user":
+            messages = messages[:-1]
+        history = []
+        for message in messages:
+            content = message.get("content") or ""
+            if isinstance(content, list):
+                content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+            if message.get("role") == "user":
+                history.append(HumanMessage(content=content))
+            elif message.get("role") == "assistant":
+                history.append(AIMessage(content=content))
+        return history
+
+    async def turn_inputs(self, graph, config: dict, history: list, user_message: str) -> list:
+        """Messages to feed the graph for this turn.
+
+        A chat whose checkpoint was left with exactly the earlier messages the
+        server sent, roles and text alike, only gets the new question
+        appended; its tool results and reasoning are reused. Anything else (a
+        new, evicted or interrupted chat, or one with an edited or regenerated
+        message) is re-seeded from the history the server sent.
+        """
+        from langchain_core.messages import HumanMessage
+        from pipeline_core.tool_graph import transcript_digest
+
+        state = await graph.aget_state(config)
+        stored = state.values.get("messages", [])
+        if stored and state.values.get("transcript") == transcript_digest(history):
+            return [HumanMessage(content=user_message)]
+        if stored:
+            await self.checkpointer.adelete_thread(config["configurable"]["thread_id"])
+        return history + [HumanMessage(content=user_message)]
 
     def build_graph(self):
-        builder = StateGraph(MessagesState)
-
-        # Add nodes
-        builder.add_node("reasoner", self.reasoner)
-        builder.add_node("tools", ToolNode(self.tools))  # for the tools
-
-        # Add edges
-        builder.add_edge(START, "reasoner")
-        builder.add_conditional_edges(
-            "reasoner",
-            # If the latest message (result) from node reasoner is a tool call -> tools_condition routes to tools
-            # If the latest message (result) from node reasoner is a not a tool call -> tools_condition routes to END
-            tools_condition,
+        from langchain_openai import ChatOpenAI
+        from pipeline_core.tool_graph import compile_tool_graph
+
+        if self.tools is None:
+            self.tools = [
+                self.limited_tool(self.add),
+                self.limited_tool(self.multiply),
+                self.limited_tool(self.divide),
+                self.limited_tool(self.DuckDuckGoSearchRun)
+            ]
+        if self.checkpointer is None:
+            self.checkpointer = self.loop.run(self.build_checkpointer())
+
+        llm = ChatOpenAI(
+            model=self.valves.MODEL_NAME,
+            openai_api_key="EMPTY",
+            openai_api_base=self.valves.INFERENCE_SERVER_URL,
+            max_tokens=3000,
+            temperature=0.7,
         )
-        builder.add_edge("tools", "reasoner")
-
-        return builder.compile()
+        # Loaded here, off the event loop, so the reasoner never waits on it.
+        tokenizer = get_tokenizer(self.valves.TOKENIZER_ID or self.valves.MODEL_NAME)
+        reasoner = functools.partial(self.reasoner, llm, llm.bind_tools(self.tools), tokenizer)
+        return compile_tool_graph(reasoner, self.tools, self.checkpointer)
+
+    def valve_key(self, names) -> tuple:
+        return tuple(getattr(self.valves, name) for name in names)
+
+    def get_graph(self):
+        """The compiled graph for the current valves, built on first use."""
+        key = self.valve_key(self.GRAPH_VALVES)
+        graph = self.graphs.peek(key)
+        if graph is None:
+            with self.graph_lock:
+                graph = self.graphs.peek(key)
+                if graph is None:
+                    with self.metrics.stage("build_graph"):
+                        graph = self.build_graph()
+                    self.graphs.set(key, graph)
+        return graph
 
     async def on_startup(self):
-        pass
+        serve_metrics(self.valves.METRICS_PORT, self.valves.METRICS_HOST, owner=__name__)
+        if self.valves.PRELOAD_GRAPH:
+            await asyncio.to_thread(self.get_graph)
 
     async def on_shutdown(self):
-        pass
+        logger.info("Tool cache: %s", self.tool_runner.cache_stats())
+        serve_metrics(0, owner=__name__)
+        self.close_checkpointer()
+        self.loop.stop()
+
+    async def on_valves_updated(self):
+        serve_metrics(self.valves.METRICS_PORT, self.valves.METRICS_HOST, owner=__name__)
+        tool_runner_key = self.valve_key(self.TOOL_RUNNER_VALVES)
+        if tool_runner_key != self.tool_runner_key:
+            self.tool_runner = self.build_tool_runner()
+            self.tool_runner_key = tool_runner_key
+        if self.valves.CHECKPOINT_PATH != self.checkpoint_path:
+            # Graphs compiled against the old checkpointer go with it.
+            with self.graph_lock:
+                self.close_checkpointer()
+                self.checkpoint_path = self.valves.CHECKPOINT_PATH
+                self.checkpointer = None
+                self.graphs.clear()
+        elif self.checkpointer is not None and hasattr(self.checkpointer, "max_threads"):
+            self.checkpointer.max_threads = self.valves.CHECKPOINT_MAX_CHATS
+
+    def close_checkpointer(self):
+        conn = getattr(self.checkpointer, "conn", None)
+        if conn is not None and self.loop.running:
+            self.loop.run(conn.close())
 
     def pipe(self, user_message: str, model_id: str, messages: List[dict], body: dict) -> Union[str, Generator, Iterator]:
         # This is where you can add your custom pipeline logic.
         # Typically, you would retrieve relevant information from your knowledge base and synthesize it to generate a response.
 
-        human_message = HumanMessage(content=user_message)
-        messages = [human_message]
-        messages = self.graph.invoke({"messages": messages})
-
-        content = messages['messages'][-1].content
-        
-        if isinstance(content, str):
-            return self.create_content_stream(content)
-        else:
-            return self.create_content_stream(str(content))
+        # The graph runs on the pipeline's event loop; only this worker thread
+        # waits on it, and the server's own loop is never blocked.
+        return self.loop.iterate(self.loop.run(self.apipe(user_message, model_id, messages, body)))
+
+    async def apipe(self, user_message: str, model_id: str, messages: List[dict], body: dict) -> AsyncIterator[str]:
+        with self.metrics.stage("pipe"):
+            # Chats resume from their checkpoint; requests without a chat id
+            # get a throwaway thread seeded from the full history.
+            thread_id = body.get("chat_id") or f"oneshot-{uuid.uuid4()}"
+            config = {"configurable": {"thread_id": thread_id}}
+            graph = self.graphs.get(self.valve_key(self.GRAPH_VALVES))
+            if graph is None:
+                # Compiling the first graph imports LangChain; keep that off the loop.
+                graph = await asyncio.to_thread(self.get_graph)
+            history = self.history_messages(user_message, messages)
+            inputs = {
+                "messages": await self.turn_inputs(graph, config, history, user_message),
+                "steps": 0,
+                "deadline": time.time() + self.valves.GRAPH_DEADLINE_SECONDS,
+            }
+            turn = history + inputs["messages"][-1:]
+            return self.metrics.adrain(self.astream_graph(graph, inputs, config, turn), name="graph")
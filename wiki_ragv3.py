@@ -1,60 +1,70 @@
 from typing import List, Union, Generator, Iterator
-from pydantic import BaseModel
-from schemas import OpenAIChatMessage
-import requests
+import logging
 import os
+import sys
 import json
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))  # shared pipeline_core package
+
+from pipeline_core.stages import Chain, RerankStage, ReplyStage, RetrieveStage, Services, Turn
+from pipeline_core.valves import HTTPValves, ObservabilityValves, RerankValves, RetrievalCacheValves, VectorSearchValves
+
+logger = logging.getLogger(__name__)
+
+
+def first_result_json(turn: Turn) -> str:
+    if turn.results:
+        first_result = turn.results[0]
+        document = first_result.get('document', "No information found")
+        metadata = first_result.get('metadata', {})
+
+        context = {
+            "document": document,
+            "metadata": metadata
+        }
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Retrieved context: %s", json.dumps(context, indent=2))
+    else:
+        context = {
+            "document": "No information found",
+            "metadata": {}
+        }
+
+    return json.dumps(context, indent=2)
+
+
 class Pipeline:
-    class Valves(BaseModel):
+    class Valves(HTTPValves, RetrievalCacheValves, VectorSearchValves, RerankValves, ObservabilityValves):
         pass
 
     def __init__(self):
         self.name = "Vector Database Pipeline"
         self.valves = self.Valves(**{"OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "")})
+        self.services = Services(__name__, self.valves)
+        self.metrics = self.services.metrics
+        self.chain = Chain(RetrieveStage(), RerankStage(), ReplyStage(first_result_json))
 
     async def on_startup(self):
         print(f"on_startup:{__name__}")
-        pass
+        await self.services.start(self.valves)
 
     async def on_shutdown(self):
         print(f"on_shutdown:{__name__}")
-        pass
+        await self.services.close()
+
+    async def on_valves_updated(self):
+        print(f"on_valves_updated:{__name__}")
+        await self.services.reconfigure(self.valves)
 
     def pipe(
         self, user_message: str, model_id: str, messages: List[dict], body: dict
     ) -> Union[str, Generator, Iterator]:
-        print(f"pipe:{__name__}")
-
-        if body.get("title", False):
-            print("Title Generation")
-            return "Vector Database Pipeline"
-        print(f"Body: {body}")
-        url = "http://192.168.88.23:5000/search"
-        headers = {
-            "Content-Type": "application/json",
-            "User-Agent": "insomnia/2023.5.8"
-        }
-        payload = {"query": user_message}
-
-        response = requests.post(url, json=payload, headers=headers)
-        results = response.json().get('results', [])
-
-        context = None
-        if results:
-            first_result = results[0]
-            document = first_result.get('document', "No information found")
-            metadata = first_result.get('metadata', {})
-
-            context = {
-                "document": document,
-                "metadata": metadata
-            }
-            print(f"Retrieved context: {json.dumps(context, indent=2)}")
-        else:
-            context = {
-                "document": "No information found",
-                "metadata": {}
-            }
-
-        return json.dumps(context, indent=2)
+        with self.metrics.stage("pipe"):
+            logger.debug("pipe:%s", __name__)
+
+            if body.get("title", False):
+                logger.debug("Title Generation")
+                return "Vector Database Pipeline"
+            logger.debug("Body: %s", body)
+
+            return self.chain.run(Turn(user_message, model_id, messages, body), self.services)